@@ -0,0 +1,133 @@
+# answer_cache.py
+#
+# Query results cached in a local SQLite file shared by every app process
+# (Streamlit workers, several app instances on one host). Entries are keyed
+# by the normalized question, the method, its parameters (top_k included)
+# and the index version (artifacts.INDEX_VERSION_PATH), so a rebuild makes
+# every older entry unreachable; those are deleted on the next write.
+# Methods whose answers also depend on a file other than the index (the
+# cascade's calibrated thresholds) add that file's mtime to their key, so
+# rewriting it only invalidates that method's entries. The query encoder
+# (query_encoders.cache_key of the backend and model) is part of every key:
+# onnx-int8 vectors differ slightly from torch's, and so can the answers.
+# Entries also expire after ttl seconds, and beyond max_entries the least
+# recently used ones are evicted.
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from artifacts import INDEX_VERSION_PATH, read_index_version
+from embedding_cache import normalize_text
+
+ANSWER_CACHE_PATH = "retrieval/answer_cache.sqlite"
+ANSWER_CACHE_TTL = 24 * 3600
+ANSWER_CACHE_SIZE = 10000
+# The index version file is re-stat'ed at most this often (seconds)
+VERSION_CHECK_INTERVAL = 1.0
+
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE,
+                 version_path=INDEX_VERSION_PATH, method_files=None, encoder=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_path = version_path
+        # {method: path of a file its answers depend on}
+        self.method_files = dict(method_files or {})
+        self.encoder = encoder
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._version = (-1, None)  # (mtime_ns or None when absent, version)
+        self._version_checked = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    results TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)")
+
+    def _connection(self):
+        # One connection per thread; WAL lets readers in other processes
+        # proceed while one of them writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def version(self):
+        now = time.monotonic()
+        if now - self._version_checked >= VERSION_CHECK_INTERVAL:
+            try:
+                mtime = os.stat(self.version_path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != self._version[0]:
+                self._version = (mtime, read_index_version(self.version_path))
+            self._version_checked = now
+        return self._version[1]
+
+    def file_stamp(self, method):
+        # mtime_ns of the file the method's answers depend on, if any
+        path = self.method_files.get(method)
+        if path is None:
+            return None
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def key(self, question, method, params, version):
+        return json.dumps([normalize_text(question), method, params, version, self.encoder,
+                           self.file_stamp(method)], sort_keys=True)
+
+    def get(self, question, method, params):
+        # -> cached results, or None
+        key = self.key(question, method, params, self.version())
+        conn = self._connection()
+        row = conn.execute("SELECT results, created FROM answers WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE answers SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, question, method, params, results):
+        version = self.version()
+        key = self.key(question, method, params, version)
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, version, created, accessed, results) VALUES (?, ?, ?, ?, ?)",
+                (key, version, now, now, json.dumps(results))
+            )
+            # Entries of older builds, expired entries, then LRU overflow
+            conn.execute("DELETE FROM answers WHERE version != ? OR created < ?", (version, now - self.ttl))
+            conn.execute("""
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM answers")
+
+    def stats(self):
+        entries = self._connection().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "version": self.version()}
@@ -1,10 +1,62 @@
 # app.py
 
+import os
+import time
 import streamlit as st
-import streamlit.components.v1 as components
 import retrieval_functions as rf
+import query_server
+import telemetry
 import re
-from time import sleep
+from answer_cache import AnswerCache
+from query_encoders import cache_key
+
+# Set QUERY_SERVER=host:port to send queries to a running query_server.py,
+# which batches them with other sessions' queries; without it, or when the
+# server cannot be reached or refuses a query (overloaded, timeout), queries
+# run in this process.
+QUERY_SERVER = os.environ.get("QUERY_SERVER")
+
+@st.cache_resource
+def get_query_client():
+    host, _, port = QUERY_SERVER.rpartition(":")
+    return query_server.QueryClient(host or query_server.SERVER_HOST, int(port))
+
+def run_query(method, question, **params):
+    if QUERY_SERVER:
+        try:
+            return get_query_client().query(method, question, **params)
+        except OSError as e:
+            print(f"Query server unavailable ({e}); querying in process")
+        except RuntimeError as e:
+            # "overloaded", "timeout" or a failed batch on the server
+            print(f"Query server refused the query ({e}); querying in process")
+    return query_server.query_in_process(method, question, **params)
+
+# Results shared by every worker through answer_cache.py; hybrid results
+# depend on which backends beat the deadline, so they are not cached.
+# Cascade answers are also keyed by the calibrated thresholds file, and
+# every answer by the query encoder backend computing it.
+UNCACHED_METHODS = {"hybrid"}
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache(method_files={"cascade": rf.CASCADE_THRESHOLDS_PATH},
+                       encoder=cache_key(rf.QUERY_ENCODER, rf.TEXT_MODEL_NAME))
+
+def cached_query(method, question, **params):
+    # -> (results, served from the cache)
+    cache = get_answer_cache() if method not in UNCACHED_METHODS else None
+    if cache is not None:
+        results = cache.get(question, method, params)
+        if results is not None:
+            return results, True
+    results = run_query(method, question, **params)
+    if cache is not None:
+        cache.put(question, method, params, results)
+    return results, False
+
+def play(video_id, start):
+    st.session_state["player"] = (video_id, start)
 
 # Streamlit page config
 st.set_page_config(
@@ -155,7 +207,7 @@ with st.sidebar:
     
     retrieval_method = st.selectbox(
         "**Retrieval Method:**",
-        ["FAISS", "pgvector-IVFFLAT", "pgvector-HNSW", "TF-IDF", "BM25"],
+        ["FAISS", "pgvector-IVFFLAT", "pgvector-HNSW", "pgvector-HNSW-halfvec", "pgvector-HNSW-binary", "TF-IDF", "BM25", "CLIP-Frames", "Multimodal", "Hybrid", "Cascade"],
         help="Choose the vector search method for retrieving video segments"
     )
 
@@ -166,6 +218,56 @@ with st.sidebar:
         value=3,
         help="Number of most relevant segments to return"
     )
+
+    # pgvector search knobs: higher values raise recall at the cost of latency
+    probes = None
+    ef_search = None
+    if retrieval_method == "pgvector-IVFFLAT":
+        probes = st.slider(
+            "**IVFFLAT Probes:**",
+            min_value=1,
+            max_value=100,
+            value=10,
+            help="Number of IVF lists scanned per query (ivfflat.probes)"
+        )
+    elif retrieval_method.startswith("pgvector-HNSW"):
+        ef_search = st.slider(
+            "**HNSW ef_search:**",
+            min_value=10,
+            max_value=400,
+            value=40,
+            step=10,
+            help="Size of the HNSW candidate list per query (hnsw.ef_search)"
+        )
+
+    # Hybrid: one lexical and one semantic backend queried concurrently
+    if retrieval_method == "Hybrid":
+        hybrid_lexical = st.selectbox("**Lexical backend:**", ["tfidf", "bm25"])
+        hybrid_semantic = st.selectbox("**Semantic backend:**", ["faiss", "ivfflat", "hnsw"])
+        hybrid_fusion = st.radio(
+            "**Fusion:**",
+            ["rrf", "weighted"],
+            horizontal=True,
+            help="Reciprocal rank fusion, or a weighted sum of min-max normalized scores"
+        )
+        hybrid_deadline_ms = st.slider(
+            "**Deadline (ms):**",
+            min_value=10,
+            max_value=2000,
+            value=500,
+            step=10,
+            help="Backends that have not answered by then are left out of the fused result"
+        )
+
+    # Restrict the search to some videos; only their shards are queried
+    available_videos = rf.list_videos()
+    selected_videos = st.multiselect(
+        "**Videos:**",
+        available_videos,
+        default=[],
+        help="Search only these videos (leave empty to search the whole corpus)"
+    )
+    video_ids = selected_videos or None
     
     st.markdown("---")
     st.markdown("""
@@ -174,13 +276,16 @@ with st.sidebar:
         </div>
     """, unsafe_allow_html=True)
 
-# Video player section with improved layout
-st.markdown("""
+# Video player section with improved layout. A single player: "▶ Play" on a
+# result points it at that segment instead of embedding one per result.
+current_video = (selected_videos or available_videos or [rf.DEFAULT_VIDEO_ID])[0]
+player_video, player_start = st.session_state.get("player", (current_video, 0))
+st.markdown(f"""
     <div class="video-container">
         <h3 style="margin-top: 0; color: #6a11cb;">🎞️ Currently Analyzing</h3>
         <div class="video-responsive">
             <iframe 
-                src="https://www.youtube.com/embed/dARr3lGKwk8?modestbranding=1&rel=0" 
+                src="https://www.youtube.com/embed/{player_video}?start={int(player_start)}&autoplay={1 if player_start else 0}&modestbranding=1&rel=0" 
                 frameborder="0" 
                 allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture" 
                 allowfullscreen>
@@ -203,117 +308,165 @@ if st.button("🔍 Search for Answers", use_container_width=True):
         st.warning("Please enter a question before searching.")
     else:
         with st.spinner('🔍 Searching across video segments...'):
-            sleep(1)  # Simulate processing time
-
-            # Retrieval
+            # Retrieval: method name and parameters of the batch function
             if retrieval_method == "FAISS":
-                results = rf.query_faiss_text(question, top_k=top_k)
+                method, params = "faiss", {}
             elif retrieval_method == "pgvector-IVFFLAT":
-                results = rf.query_pgvector(question, method="ivfflat", top_k=top_k)
+                method, params = "pgvector", {"method": "ivfflat", "probes": probes}
             elif retrieval_method == "pgvector-HNSW":
-                results = rf.query_pgvector(question, method="hnsw", top_k=top_k)
+                method, params = "pgvector", {"method": "hnsw", "ef_search": ef_search}
+            elif retrieval_method == "pgvector-HNSW-halfvec":
+                method, params = "pgvector", {"method": "hnsw_halfvec", "ef_search": ef_search}
+            elif retrieval_method == "pgvector-HNSW-binary":
+                method, params = "pgvector", {"method": "hnsw_binary", "ef_search": ef_search}
             elif retrieval_method == "TF-IDF":
-                results = rf.query_tfidf(question, top_k=top_k)
+                method, params = "tfidf", {}
             elif retrieval_method == "BM25":
-                results = rf.query_bm25(question, top_k=top_k)
+                method, params = "bm25", {}
+            elif retrieval_method == "CLIP-Frames":
+                method, params = "faiss_image", {}
+            elif retrieval_method == "Multimodal":
+                method, params = "multimodal", {}
+            elif retrieval_method == "Cascade":
+                method, params = "cascade", {}
+            elif retrieval_method == "Hybrid":
+                method, params = "hybrid", {"lexical": hybrid_lexical, "semantic": hybrid_semantic,
+                                            "fusion": hybrid_fusion, "deadline": hybrid_deadline_ms / 1000}
             else:
+                method, params = None, {}
+
+            if method is None:
                 st.error("Invalid retrieval method selected.")
-                results = []
+                results, cached, elapsed = [], False, 0.0
+            else:
+                start = time.perf_counter()
+                results, cached = cached_query(method, question, top_k=top_k, video_ids=video_ids, **params)
+                elapsed = time.perf_counter() - start
 
-        if results:
-            st.markdown(f"""
-                <div class="custom-success">
-                    <div style="display: flex; align-items: center; justify-content: space-between;">
-                        <div>✅ Found {len(results)} relevant segments!</div>
-                        <div style="font-size: 0.9rem;">Method: {retrieval_method} | Top-{top_k}</div>
-                    </div>
-                </div>
-            """, unsafe_allow_html=True)
+        # Kept in the session so the results survive the rerun of a Play click
+        st.session_state["search"] = {
+            "question": question, "method": retrieval_method, "top_k": top_k,
+            "results": results, "cached": cached, "elapsed": elapsed,
+        }
 
-            for idx, res in enumerate(results):
-                with st.container():
-                    st.markdown(f"<div class='card'>", unsafe_allow_html=True)
-                    
-                    # Header with result number and score
-                    st.markdown(f"""
-                        <div style="display: flex; justify-content: space-between; align-items: center;">
-                            <h3 style="margin: 0; color: #6a11cb;">📄 Segment {idx + 1}</h3>
-                            <span style="background: rgba(37, 117, 252, 0.1); color: #2575fc; 
-                                padding: 0.25rem 0.75rem; border-radius: 12px; font-weight: 500;">
-                                Score: {res.get('score', 0):.2f}
-                            </span>
-                        </div>
-                    """, unsafe_allow_html=True)
+search = st.session_state.get("search")
+if search is not None:
+    results = search["results"]
+    if results:
+        timing = "⚡ cached" if search["cached"] else "computed"
+        elapsed_ms = search["elapsed"] * 1000
+        st.markdown(f"""
+            <div class="custom-success">
+                <div style="display: flex; align-items: center; justify-content: space-between;">
+                    <div>✅ Found {len(results)} relevant segments!</div>
+                    <div style="font-size: 0.9rem;">Method: {search['method']} | Top-{search['top_k']} | {timing} in {elapsed_ms:.1f} ms</div>
+                </div>
+            </div>
+        """, unsafe_allow_html=True)
 
-                    # Timestamp with improved styling
-                    st.markdown(f"""
-                        <p style="margin: 0.5rem 0;">
-                            <strong>🕒 Timestamp:</strong> 
-                            <a href="https://youtu.be/dARr3lGKwk8?t={int(res['timestamp'])}" 
-                               class="timestamp-link" target="_blank">
-                                {res['timestamp']:.2f} seconds
-                            </a>
-                        </p>
-                    """, unsafe_allow_html=True)
+        for idx, res in enumerate(results):
+            with st.container():
+                st.markdown(f"<div class='card'>", unsafe_allow_html=True)
+                
+                # Header with result number and score
+                st.markdown(f"""
+                    <div style="display: flex; justify-content: space-between; align-items: center;">
+                        <h3 style="margin: 0; color: #6a11cb;">📄 Segment {idx + 1}</h3>
+                        <span style="background: rgba(37, 117, 252, 0.1); color: #2575fc; 
+                            padding: 0.25rem 0.75rem; border-radius: 12px; font-weight: 500;">
+                            Score: {res.get('score', 0):.2f}
+                        </span>
+                    </div>
+                """, unsafe_allow_html=True)
 
-                    # Highlighted text with improved formatting
-                    highlighted_text = res['text']
-                    for word in question.lower().split():
-                        highlighted_text = re.sub(
-                            f"\\b({word})\\b",
-                            r"<mark>\1</mark>",
-                            highlighted_text,
-                            flags=re.IGNORECASE
-                        )
+                # Timestamp with improved styling
+                st.markdown(f"""
+                    <p style="margin: 0.5rem 0;">
+                        <strong>🕒 Timestamp:</strong> 
+                        <a href="https://youtu.be/{res.get('video_id', rf.DEFAULT_VIDEO_ID)}?t={int(res['timestamp'])}" 
+                           class="timestamp-link" target="_blank">
+                            {res['timestamp']:.2f} seconds
+                        </a>
+                        <span style="opacity: 0.7;">· 🎞️ {res.get('video_id', rf.DEFAULT_VIDEO_ID)}</span>
+                    </p>
+                """, unsafe_allow_html=True)
 
-                    st.markdown("""
-                        <div style="margin: 1rem 0;">
-                            <strong style="color: #6a11cb;">📝 Relevant Content:</strong>
-                            <div style="background: #f8f9fa; padding: 1rem; border-radius: 8px; margin-top: 0.5rem;">
-                                {text}
-                            </div>
-                        </div>
-                    """.format(text=highlighted_text), unsafe_allow_html=True)
+                # Highlighted text with improved formatting
+                highlighted_text = res['text']
+                for word in search["question"].lower().split():
+                    highlighted_text = re.sub(
+                        f"\\b({word})\\b",
+                        r"<mark>\1</mark>",
+                        highlighted_text,
+                        flags=re.IGNORECASE
+                    )
 
-                    # Embedded video at timestamp
-                    video_embed = f"""
+                st.markdown("""
                     <div style="margin: 1rem 0;">
-                        <div class="video-responsive">
-                            <iframe 
-                                src="https://www.youtube.com/embed/dARr3lGKwk8?start={int(res['timestamp'])}&autoplay=0&modestbranding=1&rel=0" 
-                                frameborder="0" 
-                                allow="accelerometer; clipboard-write; encrypted-media; gyroscope; picture-in-picture" 
-                                allowfullscreen>
-                            </iframe>
+                        <strong style="color: #6a11cb;">📝 Relevant Content:</strong>
+                        <div style="background: #f8f9fa; padding: 1rem; border-radius: 8px; margin-top: 0.5rem;">
+                            {text}
                         </div>
                     </div>
-                    """
-                    components.html(video_embed, height=300)
+                """.format(text=highlighted_text), unsafe_allow_html=True)
+
+                # Plays the segment in the player at the top
+                st.button(
+                    "▶ Play",
+                    key=f"play_{idx}",
+                    on_click=play,
+                    args=(res.get('video_id', rf.DEFAULT_VIDEO_ID), res['timestamp'])
+                )
 
-                    # Enhanced explanation expander
-                    with st.expander("🔍 Why is this relevant?", expanded=False):
-                        matched_keywords = ', '.join(set(word.lower() for word in question.split() 
-                                                      if word.lower() in res['text'].lower()))
-                        
-                        st.markdown(f"""
-                            <div style="background: rgba(106, 17, 203, 0.05); padding: 1rem; border-radius: 8px;">
-                                <p><strong>Matched Keywords:</strong> {matched_keywords or "None directly matched"}</p>
-                                <p style="margin-top: 0.5rem;">This segment was retrieved because it contains content 
-                                semantically related to your question. The {retrieval_method} method identified it as 
-                                one of the most relevant portions of the video.</p>
-                            </div>
-                        """, unsafe_allow_html=True)
+                # Enhanced explanation expander
+                with st.expander("🔍 Why is this relevant?", expanded=False):
+                    matched_keywords = ', '.join(set(word.lower() for word in search["question"].split() 
+                                                  if word.lower() in res['text'].lower()))
+                    
+                    st.markdown(f"""
+                        <div style="background: rgba(106, 17, 203, 0.05); padding: 1rem; border-radius: 8px;">
+                            <p><strong>Matched Keywords:</strong> {matched_keywords or "None directly matched"}</p>
+                            <p style="margin-top: 0.5rem;">This segment was retrieved because it contains content 
+                            semantically related to your question. The {search['method']} method identified it as 
+                            one of the most relevant portions of the video.</p>
+                        </div>
+                    """, unsafe_allow_html=True)
 
-                    st.markdown("</div>", unsafe_allow_html=True)
+                st.markdown("</div>", unsafe_allow_html=True)
 
-        else:
-            st.warning("""
-                <div style="background: rgba(255, 193, 7, 0.1); padding: 1rem; border-radius: 8px;">
-                    <p style="margin: 0; color: #ff9800;">⚠️ No matching results found. Try:</p>
-                    <ul style="margin: 0.5rem 0 0 1rem; padding-left: 1rem;">
-                        <li>Using different keywords</li>
-                        <li>Making your question more specific</li>
-                        <li>Trying another retrieval method</li>
-                    </ul>
-                </div>
-            """, unsafe_allow_html=True)
\ No newline at end of file
+    else:
+        st.warning("""
+            <div style="background: rgba(255, 193, 7, 0.1); padding: 1rem; border-radius: 8px;">
+                <p style="margin: 0; color: #ff9800;">⚠️ No matching results found. Try:</p>
+                <ul style="margin: 0.5rem 0 0 1rem; padding-left: 1rem;">
+                    <li>Using different keywords</li>
+                    <li>Making your question more specific</li>
+                    <li>Trying another retrieval method</li>
+                </ul>
+            </div>
+        """, unsafe_allow_html=True)
+
+# Diagnostics: latency per method and per stage, from the process that runs
+# the queries (the query server, or this one). Rendered last so it includes
+# this run's search.
+with st.sidebar.expander("🩺 Diagnostics", expanded=False):
+    metrics = None
+    if QUERY_SERVER:
+        try:
+            metrics = get_query_client().metrics()
+        except (OSError, RuntimeError) as e:
+            st.caption(f"Query server metrics unavailable ({e}); showing this process")
+    if metrics is None:
+        metrics = telemetry.registry.snapshot()
+    if metrics["queries"]:
+        st.markdown("**Queries** (latency in ms)")
+        st.dataframe(metrics["queries"], hide_index=True, use_container_width=True)
+        st.markdown("**Stages** (encode, search, hydrate, load)")
+        st.dataframe(metrics["stages"], hide_index=True, use_container_width=True)
+    else:
+        st.caption("No queries yet.")
+    cache_stats = get_answer_cache().stats()
+    st.markdown(
+        f"**Answer cache:** {cache_stats['entries']} entries, {cache_stats['hits']} hits / "
+        f"{cache_stats['misses']} misses in this worker · index version `{cache_stats['version']}`"
+    )
@@ -0,0 +1,129 @@
+# artifacts.py
+#
+# Read-only, memory-mapped artifact bundles. A bundle is a small JSON file
+# (the path retrievers watch) plus one .npy file per array, named with the
+# build id recorded in the JSON:
+#
+#   retrieval/tfidf_index.json
+#   retrieval/tfidf_index.<build_id>.<array>.npy
+#
+# Arrays are opened with mmap_mode="r", so every process serving queries
+# shares the same pages through the OS cache and loading is a few mmap()
+# calls instead of unpickling. Strings are stored as one UTF-8 blob plus
+# offsets (StringTable).
+
+import os
+import json
+import time
+import numpy as np
+
+# Bumped after every index build (retrieval.py, pipeline.py); loaded
+# backends are reloaded and caches of query results are keyed by it
+INDEX_VERSION_PATH = "retrieval/index_version.json"
+
+def _array_path(meta_path, build_id, name):
+    return f"{os.path.splitext(meta_path)[0]}.{build_id}.{name}.npy"
+
+def new_build_id():
+    return f"{time.strftime('%Y%m%d%H%M%S')}_{os.getpid()}_{time.time_ns() % 1000000:06d}"
+
+def write_bundle(meta_path, arrays, meta=None):
+    # The .npy files are written first and the JSON is swapped in last, so
+    # a reader always sees a complete build. The previous build's files are
+    # kept until the next write: a reader that read the old JSON just before
+    # the swap can still open them. The build before that is unlinked
+    # (processes that still map it keep their pages).
+    os.makedirs(os.path.dirname(meta_path) or ".", exist_ok=True)
+    build_id = new_build_id()
+    for name, array in arrays.items():
+        path = _array_path(meta_path, build_id, name)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(f"{path}.tmp", path)
+
+    previous = None
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r") as f:
+                previous = json.load(f)
+        except ValueError:
+            previous = None
+
+    document = dict(meta or {}, build_id=build_id, arrays=sorted(arrays))
+    if previous and previous.get("build_id") != build_id:
+        document["previous_build"] = {"build_id": previous["build_id"], "arrays": previous.get("arrays", [])}
+    tmp_path = f"{meta_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(document, f)
+    os.replace(tmp_path, meta_path)
+
+    retired = (previous or {}).get("previous_build")
+    if retired and retired["build_id"] != build_id:
+        for name in retired["arrays"]:
+            try:
+                os.remove(_array_path(meta_path, retired["build_id"], name))
+            except OSError:
+                pass
+
+def read_bundle(meta_path):
+    # -> (meta, {name: read-only memmap})
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(_array_path(meta_path, meta["build_id"], name), mmap_mode="r")
+        for name in meta["arrays"]
+    }
+    return meta, arrays
+
+def pack_strings(strings):
+    # -> (offsets, blob): string i is blob[offsets[i]:offsets[i + 1]]
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+class StringTable:
+    # Sequence of strings decoded on access from a mapped blob
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def index(self, value):
+        # Binary search; only valid for a table written from sorted strings.
+        # Returns -1 when absent.
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self[lo] == value else -1
+
+# --- Index version --- #
+
+def write_index_version(path=INDEX_VERSION_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    version = new_build_id()
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version}, f)
+    os.replace(tmp_path, path)
+    return version
+
+def read_index_version(path=INDEX_VERSION_PATH):
+    # "unversioned" until the first build records a version
+    try:
+        with open(path, "r") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        return "unversioned"
@@ -0,0 +1,214 @@
+# benchmark.py
+#
+# Latency and throughput benchmark of the retrieval methods over the gold
+# questions. After a warm-up pass, every question is run --repeat times as
+# a single query and timed with perf_counter_ns; the report gives p50, p95
+# and p99 overall and per stage (encode, search, hydrate), throughput at
+# each --concurrency level, and the peak RSS of the process.
+#
+# The query embedding cache is emptied before every timed query, so the
+# numbers include the encoder forward pass; --warm-cache measures repeated
+# questions answered from the cache instead (reported as "cache": "warm").
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --methods faiss bm25 --concurrency 1 4 16 \
+#       --compare bench.json --threshold 0.10
+#
+# With --compare, a method whose p50/p95/p99 grew, or whose throughput
+# fell, by more than --threshold relative to the baseline is flagged and
+# the script exits with status 1.
+
+import argparse
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import pandas as pd
+import retrieval_functions as rf
+
+GOLD_SET_PATH = "gold_standard_test_set.xlsx"
+STAGES = ("encode", "search", "hydrate")
+PERCENTILES = (50, 95, 99)
+
+def benchmark_methods(top_k, video_ids):
+    # name -> fn(question) for a single query
+    return {
+        "faiss": lambda q: rf.query_faiss_text(q, top_k, video_ids),
+        "pgvector-ivfflat": lambda q: rf.query_pgvector(q, "ivfflat", top_k, video_ids=video_ids),
+        "pgvector-hnsw": lambda q: rf.query_pgvector(q, "hnsw", top_k, video_ids=video_ids),
+        "tfidf": lambda q: rf.query_tfidf(q, top_k, video_ids),
+        "bm25": lambda q: rf.query_bm25(q, top_k, video_ids),
+        "faiss_image": lambda q: rf.query_faiss_image(q, top_k, video_ids),
+        "multimodal": lambda q: rf.query_multimodal(q, top_k, video_ids=video_ids),
+        "hybrid": lambda q: rf.query_hybrid(q, top_k, video_ids=video_ids),
+        "cascade": lambda q: rf.query_cascade(q, top_k, video_ids=video_ids),
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def summarize(samples_ns):
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    if not len(samples):
+        return None
+    summary = {f"p{p}": round(float(np.percentile(samples, p)), 4) for p in PERCENTILES}
+    summary["mean"] = round(float(samples.mean()), 4)
+    return summary
+
+@contextmanager
+def uncached_queries():
+    # A query embedding cache holding no entries: every query, on every
+    # thread, runs the encoder
+    cache = rf.query_embedding_cache
+    max_entries = cache.max_entries
+    cache.clear()
+    cache.max_entries = 0
+    try:
+        yield
+    finally:
+        cache.max_entries = max_entries
+
+def measure_latency(fn, questions, repeat, cold_cache):
+    # Sequential single queries; cold_cache empties the query embedding
+    # cache before each one so "encode" includes the model forward pass
+    totals, stages = [], {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        for question in questions:
+            if cold_cache:
+                rf.query_embedding_cache.clear()
+            with rf.record_stages() as timings:
+                start = time.perf_counter_ns()
+                fn(question)
+                totals.append(time.perf_counter_ns() - start)
+            for stage in STAGES:
+                stages[stage].append(timings.get(stage, 0))
+    return {
+        "latency_ms": summarize(totals),
+        "stages_ms": {stage: summarize(samples) for stage, samples in stages.items()},
+    }
+
+def measure_throughput(fn, questions, concurrency, repeat, cold_cache):
+    # Every question `repeat` times spread over `concurrency` threads
+    workload = [q for _ in range(repeat) for q in questions]
+    cache = uncached_queries() if cold_cache else nullcontext()
+    with cache, ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter_ns()
+        list(executor.map(fn, workload))
+        elapsed = time.perf_counter_ns() - start
+    return round(len(workload) / (elapsed / 1e9), 2) if elapsed else None
+
+def run(args):
+    questions = pd.read_excel(GOLD_SET_PATH)["Question"].tolist()
+    video_ids = None if args.all_videos else [rf.DEFAULT_VIDEO_ID]
+    methods = benchmark_methods(args.top_k, video_ids)
+    unknown = set(args.methods) - set(methods)
+    if unknown:
+        raise SystemExit(f"Unknown methods {sorted(unknown)}. Choose from {sorted(methods)}.")
+
+    print("Warming up retrieval backends...")
+    rf.warmup()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "questions": len(questions),
+            "top_k": args.top_k,
+            "repeat": args.repeat,
+            "cache": "warm" if args.warm_cache else "cold",
+        },
+        "methods": {},
+    }
+    for name in args.methods:
+        fn = methods[name]
+        print(f"Benchmarking {name}...")
+        try:
+            # Warm-up pass: first-call costs (lazy loads, page faults on
+            # mapped indexes, the query cache) stay out of the timings
+            for question in questions[:args.warmup_queries]:
+                fn(question)
+            cold = not args.warm_cache
+            entry = measure_latency(fn, questions, args.repeat, cold)
+            entry["throughput_qps"] = {
+                str(c): measure_throughput(fn, questions, c, args.repeat, cold) for c in args.concurrency
+            }
+        except Exception as e:
+            print(f"  {name} failed: {e}")
+            entry = {"error": str(e)}
+        report["methods"][name] = entry
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return report
+
+def print_report(report):
+    print(f"\n{'Method':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'encode':>9}{'search':>9}{'hydrate':>9}  Throughput (qps @ concurrency)")
+    for name, entry in report["methods"].items():
+        if "error" in entry:
+            print(f"{name:<18}  error: {entry['error']}")
+            continue
+        latency = entry["latency_ms"]
+        stages = "".join(f"{entry['stages_ms'][stage]['p50']:>9.3f}" for stage in STAGES)
+        throughput = ", ".join(f"{qps}@{c}" for c, qps in entry["throughput_qps"].items())
+        print(f"{name:<18}{latency['p50']:>9.3f}{latency['p95']:>9.3f}{latency['p99']:>9.3f}{stages}  {throughput}")
+    cache = report["meta"].get("cache", "cold")
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MB (stage columns are p50; {cache} query embedding cache)")
+
+def compare(report, baseline, threshold):
+    # -> list of regression messages
+    regressions = []
+    for name, entry in report["methods"].items():
+        base = baseline.get("methods", {}).get(name)
+        if not base or "error" in entry or "error" in base:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}"
+            old, new = base["latency_ms"][key], entry["latency_ms"][key]
+            if old and new > old * (1 + threshold):
+                regressions.append(f"{name} {key} latency {old:.3f} -> {new:.3f} ms (+{new / old - 1:.0%})")
+        for c, new in entry["throughput_qps"].items():
+            old = base.get("throughput_qps", {}).get(c)
+            if old and new is not None and new < old * (1 - threshold):
+                regressions.append(f"{name} throughput @{c} {old} -> {new} qps ({new / old - 1:.0%})")
+    old_rss = baseline.get("peak_rss_mb")
+    if old_rss and report["peak_rss_mb"] > old_rss * (1 + threshold):
+        regressions.append(f"peak RSS {old_rss} -> {report['peak_rss_mb']} MB")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency/throughput benchmark of the retrieval methods.")
+    parser.add_argument("--methods", nargs="+", default=["faiss", "pgvector-ivfflat", "pgvector-hnsw", "tfidf", "bm25"])
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed passes over the gold questions")
+    parser.add_argument("--warmup-queries", type=int, default=20, help="Untimed queries per method first")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Keep the query embedding cache warm (repeated questions skip the encoder)")
+    parser.add_argument("--all-videos", action="store_true", help="Search every video, not just the gold one")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--compare", help="Baseline report (JSON) to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressions against {args.compare}:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (threshold {args.threshold:.0%}).")
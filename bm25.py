@@ -0,0 +1,50 @@
+# bm25.py
+#
+# BM25 as an inverted index of precomputed weights (see postings.py).
+# Scores match rank_bm25.BM25Okapi with the same k1, b and epsilon.
+
+import numpy as np
+from postings import PostingsIndex, sorted_vocabulary, write_postings
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Terms in more than half the documents get a negative IDF; like rank_bm25
+# they are floored at epsilon * mean IDF instead
+BM25_EPSILON = 0.25
+
+def tokenize(text):
+    # Shared by index build and query time
+    return text.lower().split()
+
+def build_bm25_index(texts, index_path, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+    vocab = {}
+    doc_terms, doc_counts, doc_lens = [], [], []
+    for text in texts:
+        tokens = tokenize(text)
+        term_ids = np.array([vocab.setdefault(token, len(vocab)) for token in tokens], dtype=np.int64)
+        ids, counts = np.unique(term_ids, return_counts=True)
+        doc_terms.append(ids)
+        doc_counts.append(counts)
+        doc_lens.append(len(tokens))
+
+    n_docs = len(texts)
+    doc_ids = np.repeat(np.arange(n_docs, dtype=np.int32), [len(ids) for ids in doc_terms])
+    term_ids = np.concatenate(doc_terms) if doc_terms else np.empty(0, dtype=np.int64)
+    freqs = np.concatenate(doc_counts).astype(np.float64) if doc_counts else np.empty(0)
+
+    doc_lens = np.array(doc_lens, dtype=np.float64)
+    avgdl = doc_lens.mean() if n_docs else 0.0
+    df = np.bincount(term_ids, minlength=len(vocab))
+    idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+    idf[idf < 0] = epsilon * (idf.mean() if len(idf) else 0.0)
+
+    norm = k1 * (1 - b + b * doc_lens[doc_ids] / avgdl) if n_docs else np.empty(0)
+    weights = idf[term_ids] * freqs * (k1 + 1) / (freqs + norm)
+
+    term_ids, terms = sorted_vocabulary(term_ids, vocab)
+    write_postings(index_path, doc_ids, term_ids, weights, terms, n_docs, {"k1": k1, "b": b, "epsilon": epsilon})
+
+class Bm25Index(PostingsIndex):
+    def query_weights(self, question):
+        # A repeated query term counts once per occurrence, like BM25Okapi
+        return self.term_ids(tokenize(question))
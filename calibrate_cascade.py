@@ -0,0 +1,114 @@
+# calibrate_cascade.py
+#
+# Calibrates the score thresholds of rf.query_cascade_batch on the gold
+# questions and writes them to rf.CASCADE_THRESHOLDS_PATH. For each backend
+# the top-1 score of every question is compared with the gold answer:
+#
+#   reject  the REJECT_PERCENTILE-th percentile of the scores of correctly
+#           answered questions, so rejection keeps ~95% of good answers
+#   accept  (lexical backends) the lowest score above which at least
+#           ACCEPT_PRECISION of the questions are answered correctly, over
+#           at least MIN_ACCEPT_SUPPORT questions; null when none qualifies
+#
+# Only the calibration split of the gold set is used for fitting: a
+# question belongs to it when a hash of its text falls below
+# CALIBRATION_FRACTION, so the split is stable across runs and row orders.
+# The remaining questions are held out, and evaluation.py scores the
+# cascade on them only.
+#
+#   python calibrate_cascade.py --backends bm25 tfidf faiss
+
+import argparse
+import json
+import os
+import zlib
+import numpy as np
+import pandas as pd
+import retrieval_functions as rf
+from embedding_cache import normalize_text
+
+GOLD_SET_PATH = "gold_standard_test_set.xlsx"
+TIMESTAMP_TOLERANCE = 10
+REJECT_PERCENTILE = 5
+ACCEPT_PRECISION = 0.9
+MIN_ACCEPT_SUPPORT = 3
+CALIBRATION_FRACTION = 0.5
+
+def is_calibration_question(question):
+    bucket = zlib.crc32(normalize_text(str(question)).encode("utf-8")) % 1000
+    return bucket < CALIBRATION_FRACTION * 1000
+
+def split_gold(gold):
+    # -> (calibration rows, held-out rows)
+    mask = gold["Question"].map(is_calibration_question).astype(bool)
+    return gold[mask], gold[~mask]
+
+def top_scores(backend, questions, video_ids):
+    results = rf._hybrid_backends()[backend](questions, 1, video_ids)
+    return [(r[0]["score"], r[0]["timestamp"]) if r else (float("-inf"), None) for r in results]
+
+def accept_threshold(scores, correct):
+    # Walk down the ranking by score and keep the lowest cut that still
+    # meets the precision target
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    best = None
+    hits = 0
+    for n, i in enumerate(order, start=1):
+        hits += correct[i]
+        if n >= MIN_ACCEPT_SUPPORT and hits / n >= ACCEPT_PRECISION:
+            best = float(scores[i])
+    return best
+
+def calibrate(backend, gold, video_ids):
+    questions = gold["Question"].astype(str).tolist()
+    answerable = (gold["Question Type"] == "Answerable").tolist()
+    truth = gold["Timestamp (sec)"].tolist()
+
+    scores, correct = [], []
+    for (score, timestamp), is_answerable, expected in zip(top_scores(backend, questions, video_ids),
+                                                          answerable, truth):
+        scores.append(score)
+        correct.append(bool(is_answerable and timestamp is not None
+                            and abs(timestamp - expected) <= TIMESTAMP_TOLERANCE))
+
+    good = [s for s, ok in zip(scores, correct) if ok and np.isfinite(s)]
+    limits = {
+        "reject": float(np.percentile(good, REJECT_PERCENTILE)) if good else None,
+        "accept": accept_threshold(scores, correct) if backend in ("tfidf", "bm25") else None,
+    }
+    print(f"{backend}: {sum(correct)}/{len(correct)} correct, thresholds {limits}")
+    return limits
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate cascade retrieval thresholds on the gold set.")
+    parser.add_argument("--backends", nargs="+", default=["bm25", "tfidf", "faiss", "ivfflat", "hnsw"])
+    parser.add_argument("--output", default=rf.CASCADE_THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    gold, held_out = split_gold(pd.read_excel(GOLD_SET_PATH))
+    print(f"Calibrating on {len(gold)} questions, {len(held_out)} held out for evaluation.py")
+    # The gold questions are about this video only
+    video_ids = [rf.DEFAULT_VIDEO_ID]
+
+    thresholds = {}
+    for backend in args.backends:
+        try:
+            thresholds[backend] = calibrate(backend, gold, video_ids)
+        except Exception as e:
+            print(f"Skipping {backend}: {e}")
+
+    thresholds["_split"] = {
+        "calibration_fraction": CALIBRATION_FRACTION,
+        "calibration_questions": len(gold),
+        "held_out_questions": len(held_out),
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    # Written atomically: rf.load_cascade_thresholds re-reads the file
+    # whenever it changes, possibly mid-write
+    tmp_path = f"{args.output}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(thresholds, f, indent=2)
+    os.replace(tmp_path, args.output)
+    # Cached cascade answers are keyed by this file's mtime (see app.py);
+    # the index version is left alone, so no backend is reloaded
+    print(f"Thresholds written to {args.output}")
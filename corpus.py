@@ -0,0 +1,198 @@
+# corpus.py
+#
+# Layout of a multi-video corpus. Videos are grouped into shards (usually
+# one video per shard); each shard has its own transcript, embeddings and
+# indexes under corpus/<shard_id>/, mirroring the original single-video
+# layout:
+#
+#   corpus/manifest.json                      shard -> videos
+#   corpus/<shard_id>/videos/<video_id>.mp4
+#   corpus/<shard_id>/data/transcript.json    segments of every video in the shard
+#   corpus/<shard_id>/data/frames/
+#   corpus/<shard_id>/embeddings/*.npy
+#   corpus/<shard_id>/retrieval/*
+#
+# Without a manifest the repository-root data/, embeddings/ and retrieval/
+# folders are read as a single shard holding DEFAULT_VIDEO_ID.
+
+import os
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
+
+CORPUS_ROOT = "corpus"
+CORPUS_MANIFEST = os.path.join(CORPUS_ROOT, "manifest.json")
+DEFAULT_VIDEO_ID = "dARr3lGKwk8"
+
+class Shard:
+    def __init__(self, shard_id, videos, root):
+        self.shard_id = shard_id
+        self.videos = tuple(videos)
+        self.root = root
+
+    def __repr__(self):
+        return f"Shard({self.shard_id!r}, videos={list(self.videos)!r})"
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def video_path(self, video_id):
+        return self.path("videos", f"{video_id}.mp4")
+
+    @property
+    def transcript_path(self):
+        return self.path("data", "transcript.json")
+
+    def video_transcript_path(self, video_id):
+        # Whisper output of one video, before merging into the shard transcript
+        return self.path("data", "transcripts", f"{video_id}.json")
+
+    @property
+    def frames_folder(self):
+        return self.path("data", "frames")
+
+    @property
+    def frames_manifest(self):
+        # file name -> {"video_id", "timestamp"} for every extracted frame
+        return self.path("data", "frames", "frames.json")
+
+    @property
+    def text_embeddings_path(self):
+        return self.path("embeddings", "text_embeddings.npy")
+
+    @property
+    def image_embeddings_path(self):
+        return self.path("embeddings", "image_embeddings.npy")
+
+    def frame_features_path(self, video_id):
+        # CLIP features of one video's frames, written when frames are
+        # embedded in memory at extraction time instead of saved as JPEGs
+        return self.path("embeddings", "frames", f"{video_id}.npy")
+
+    @property
+    def faiss_text_index(self):
+        return self.path("retrieval", "faiss_text.index")
+
+    @property
+    def faiss_image_index(self):
+        return self.path("retrieval", "faiss_image.index")
+
+    @property
+    def frame_alignment(self):
+        return self.path("retrieval", "frame_alignment.json")
+
+    @property
+    def segment_table(self):
+        # Memory-mapped columns of transcript.json used at query time
+        return self.path("retrieval", "segments.json")
+
+    @property
+    def tfidf_index(self):
+        return self.path("retrieval", "tfidf_index.json")
+
+    @property
+    def bm25_index(self):
+        # Metadata of the inverted index; the postings are .npy files next to it
+        return self.path("retrieval", "bm25_index.json")
+
+def list_frames(frames_folder):
+    # Frame names in embedding order: row i of image_embeddings.npy and of
+    # faiss_image.index is the i-th name of this list. Frames embedded in
+    # memory have no JPEG and are only listed in frames.json.
+    names = {f for f in os.listdir(frames_folder) if f.endswith(".jpg")}
+    manifest_path = os.path.join(frames_folder, "frames.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            names.update(json.load(f))
+    return sorted(names)
+
+LEGACY_SHARD = Shard(DEFAULT_VIDEO_ID, [DEFAULT_VIDEO_ID], ".")
+
+# --- Manifest --- #
+
+_manifest_lock = threading.Lock()
+_manifest_cache = (None, None)  # (mtime_ns, shards)
+
+def load_shards():
+    # Re-read only when the manifest changes, so callers can ask per query
+    global _manifest_cache
+    try:
+        mtime = os.stat(CORPUS_MANIFEST).st_mtime_ns
+    except OSError:
+        return [LEGACY_SHARD]
+    if _manifest_cache[0] == mtime:
+        return _manifest_cache[1]
+
+    with open(CORPUS_MANIFEST, "r") as f:
+        manifest = json.load(f)
+    shards = [
+        Shard(shard_id, entry["videos"], entry.get("root", os.path.join(CORPUS_ROOT, shard_id)))
+        for shard_id, entry in sorted(manifest["shards"].items())
+    ]
+    _manifest_cache = (mtime, shards)
+    return shards
+
+def get_shard(shard_id):
+    for shard in load_shards():
+        if shard.shard_id == shard_id:
+            return shard
+    raise KeyError(f"Unknown shard '{shard_id}'")
+
+def default_shard():
+    return load_shards()[0]
+
+def shard_for_video(video_id):
+    for shard in load_shards():
+        if video_id in shard.videos:
+            return shard
+    raise KeyError(f"Video '{video_id}' is not in the corpus")
+
+def list_videos():
+    return [video_id for shard in load_shards() for video_id in shard.videos]
+
+def select_shards(video_ids=None):
+    # Only shards holding at least one requested video are searched
+    shards = load_shards()
+    if video_ids is None:
+        return shards
+    wanted = set(video_ids)
+    return [shard for shard in shards if wanted.intersection(shard.videos)]
+
+def register_video(video_id, shard_id=None):
+    # Adds a video to the manifest (creating the shard if needed) and
+    # returns its shard. A pre-existing single-video layout at the
+    # repository root is kept as its own shard.
+    shard_id = shard_id or video_id
+    with _manifest_lock:
+        if os.path.exists(CORPUS_MANIFEST):
+            with open(CORPUS_MANIFEST, "r") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"shards": {}}
+            if os.path.exists(LEGACY_SHARD.transcript_path):
+                manifest["shards"][LEGACY_SHARD.shard_id] = {
+                    "videos": list(LEGACY_SHARD.videos), "root": LEGACY_SHARD.root
+                }
+
+        for entry in manifest["shards"].values():
+            if video_id in entry["videos"]:
+                break
+        else:
+            entry = manifest["shards"].setdefault(shard_id, {"videos": []})
+            entry["videos"].append(video_id)
+
+        os.makedirs(CORPUS_ROOT, exist_ok=True)
+        tmp_path = f"{CORPUS_MANIFEST}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, CORPUS_MANIFEST)
+
+    for shard in load_shards():
+        if video_id in shard.videos:
+            return shard
+
+def video_id_from_url(url):
+    parsed = urlparse(url)
+    if parsed.hostname and parsed.hostname.endswith("youtu.be"):
+        return parsed.path.lstrip("/")
+    return parse_qs(parsed.query)["v"][0]
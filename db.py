@@ -0,0 +1,122 @@
+# db.py
+
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+import psycopg2
+from psycopg2 import extensions, pool
+
+# PostgreSQL Configuration
+PG_HOST = "localhost"
+PG_PORT = 5432
+PG_DBNAME = "rag_db"
+PG_USER = "postgres"
+PG_PASSWORD = "password"
+
+# Connection pool size (per process)
+PG_POOL_MIN = 1
+PG_POOL_MAX = 8
+
+# Dimension of text_embeddings.embedding (all-MiniLM-L6-v2 vectors)
+EMBEDDING_DIM = 384
+
+class PreparedConnection(extensions.connection):
+    # Remembers which statements were PREPAREd on this server session, so
+    # each pooled connection prepares a statement once and then only EXECUTEs.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def prepare(self, name, argtypes, sql):
+        if name in self.prepared:
+            return
+        with self.cursor() as cursor:
+            cursor.execute(f"PREPARE {name} ({', '.join(argtypes)}) AS {sql}")
+        self.prepared.add(name)
+
+class Vector:
+    # Query parameter adapter for pgvector. psycopg2 only speaks the text
+    # protocol, so this is the most compact exact literal: 9 significant
+    # digits round-trip a float32, about half the length of repr(float).
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32).ravel()
+
+    def getquoted(self):
+        body = ",".join(["%.9g"] * len(self.values)) % tuple(self.values.tolist())
+        return f"'[{body}]'::vector".encode()
+
+extensions.register_adapter(Vector, lambda vec: vec)
+
+def connect_db():
+    return psycopg2.connect(
+        dbname=PG_DBNAME,
+        user=PG_USER,
+        password=PG_PASSWORD,
+        host=PG_HOST,
+        port=PG_PORT,
+        connection_factory=PreparedConnection
+    )
+
+# --- Connection Pool --- #
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid, _pool_slots
+    # Connections cannot be shared across fork(), so a child process
+    # (e.g. a Streamlit or multiprocessing worker) builds its own pool.
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = pool.ThreadedConnectionPool(
+                    PG_POOL_MIN,
+                    PG_POOL_MAX,
+                    dbname=PG_DBNAME,
+                    user=PG_USER,
+                    password=PG_PASSWORD,
+                    host=PG_HOST,
+                    port=PG_PORT,
+                    connection_factory=PreparedConnection
+                )
+                # ThreadedConnectionPool raises when exhausted; the semaphore
+                # makes callers wait for a free connection instead.
+                _pool_slots = threading.BoundedSemaphore(PG_POOL_MAX)
+                _pool_pid = os.getpid()
+    return _pool
+
+@contextmanager
+def pooled_connection():
+    # Borrow a connection for one transaction: commit on success, roll back
+    # on error, and drop the connection from the pool if it is broken.
+    conn_pool = get_pool()
+    slots = _pool_slots
+    with slots:
+        conn = conn_pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if conn.closed:
+                broken = True
+            else:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            conn_pool.putconn(conn, close=broken or bool(conn.closed))
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
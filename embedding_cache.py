@@ -0,0 +1,136 @@
+# embedding_cache.py
+
+import os
+import pickle
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+def normalize_text(text):
+    # Unicode- and whitespace-insensitive key; case is left alone because
+    # not every encoder is uncased.
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+class EmbeddingCache:
+    # Bounded LRU of query embeddings keyed by (model name, normalized text).
+    # Entries persisted at path are read on first use (or by ensure_loaded()),
+    # so creating a cache does no disk I/O.
+
+    def __init__(self, max_entries=4096, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = not path
+        self._load_lock = threading.Lock()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                if os.path.exists(self.path):
+                    self.load()
+                self._loaded = True
+
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self._entries)
+
+    def get(self, model_name, text):
+        self.ensure_loaded()
+        key = (model_name, normalize_text(text))
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, model_name, text, vec):
+        key = (model_name, normalize_text(text))
+        vec = np.array(vec, dtype=np.float32)
+        vec.setflags(write=False)
+        self.ensure_loaded()
+        with self._lock:
+            self._put(key, vec)
+
+    def _put(self, key, vec):
+        self._entries[key] = vec
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def encode(self, encoder, model_name, texts):
+        # Returns a (len(texts), dim) float32 matrix; only misses are sent to
+        # the encoder, in a single batch.
+        vecs = [self.get(model_name, text) for text in texts]
+        missing = {}
+        for i, vec in enumerate(vecs):
+            if vec is None:
+                missing.setdefault(normalize_text(texts[i]), []).append(i)
+
+        if missing:
+            missing_texts = list(missing)
+            encoded = np.asarray(encoder.encode(missing_texts), dtype=np.float32)
+            for text, vec in zip(missing_texts, encoded):
+                self.put(model_name, text, vec)
+                for i in missing[text]:
+                    vecs[i] = vec
+        return np.vstack(vecs).astype(np.float32, copy=False)
+
+    def stats(self):
+        self.ensure_loaded()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        # Also drops the persisted entries not loaded yet
+        with self._load_lock, self._lock:
+            self._entries.clear()
+            self._loaded = True
+
+    # --- Persistence --- #
+
+    def save(self, path=None):
+        path = path or self.path
+        # A cache never used has nothing to add to the file
+        if not path or (path == self.path and not self._loaded):
+            return
+        with self._lock:
+            items = list(self._entries.items())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, "rb") as f:
+                items = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f"Could not load embedding cache from {path}: {e}")
+            return
+        with self._lock:
+            # Oldest first, so the saved recency order is preserved
+            for key, vec in items:
+                vec = np.asarray(vec, dtype=np.float32)
+                vec.setflags(write=False)
+                self._put(key, vec)
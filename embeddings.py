@@ -2,12 +2,19 @@
 
 import os
 import json
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 import numpy as np
+from numpy.lib.format import open_memmap
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from PIL import Image
 import torch
 from transformers import CLIPProcessor, CLIPModel
+from corpus import list_frames, load_shards
 
 # Paths
 TRANSCRIPT_PATH = "data/transcript.json"
@@ -15,6 +22,17 @@ FRAMES_FOLDER = "data/frames/"
 TEXT_EMBEDDINGS_PATH = "embeddings/text_embeddings.npy"
 IMAGE_EMBEDDINGS_PATH = "embeddings/image_embeddings.npy"
 
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# CLIP frame encoding: frames per forward pass, and threads decoding and
+# preprocessing upcoming batches while the model runs
+IMAGE_BATCH_SIZE = 32
+DECODE_WORKERS = 4
+
+# Storage type of the embedding files: "float16" halves their size; every
+# reader converts rows to float32 (indexes are built from float32)
+EMBEDDING_DTYPE = "float32"
+
 def load_transcript(transcript_path):
     with open(transcript_path, "r") as f:
         segments = json.load(f)
@@ -26,32 +44,184 @@ def generate_text_embeddings(segments, model_name="sentence-transformers/all-Min
     embeddings = model.encode(texts, show_progress_bar=True)
     return embeddings
 
-def generate_image_embeddings(frames_folder, model_name="openai/clip-vit-base-patch32"):
+def load_clip(model_name=CLIP_MODEL_NAME, torch_threads=None):
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
     processor = CLIPProcessor.from_pretrained(model_name)
-    model = CLIPModel.from_pretrained(model_name).to(device)
+    model = CLIPModel.from_pretrained(model_name).to(device).eval()
+    return processor, model, device
 
-    embeddings = []
-    frame_files = sorted(os.listdir(frames_folder))
-    for frame_file in tqdm(frame_files, desc="Encoding frames"):
-        image = Image.open(os.path.join(frames_folder, frame_file)).convert("RGB")
-        inputs = processor(images=image, return_tensors="pt").to(device)
-        outputs = model.get_image_features(**inputs)
-        embeddings.append(outputs.cpu().detach().numpy()[0])
-    return np.array(embeddings)
+def _preprocess_files(processor, frames_folder, frame_files):
+    # Runs on a decode thread: JPEG decoding in PIL releases the GIL, so
+    # the next batches are ready by the time the model asks for them
+    images = [Image.open(os.path.join(frames_folder, f)).convert("RGB") for f in frame_files]
+    return processor(images=images, return_tensors="pt")["pixel_values"]
 
-if __name__ == "__main__":
-    os.makedirs("embeddings", exist_ok=True)
+def _preprocess_arrays(processor, images):
+    return processor(images=images, return_tensors="pt")["pixel_values"]
+
+def _encode_to_memmap(clip, loaders, output_path, decode_workers, desc, dtype="float32", n_rows=None):
+    # loaders: (n_rows, fn) per batch, in row order; fn returns CLIP pixel
+    # values, or an array of features that were computed earlier. Rows
+    # are written straight into a preallocated .npy memmap, so memory stays
+    # flat however many frames there are. loaders may be a lazy iterator
+    # when n_rows (an upper bound on the rows) is given.
+    processor, model, device = clip
+    if n_rows is None:
+        loaders = list(loaders)
+        n_rows = sum(n for n, _ in loaders)
+    loaders = iter(loaders)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp.{os.getpid()}"
+    embeddings = open_memmap(tmp_path, mode="w+", dtype=dtype,
+                             shape=(n_rows, model.config.projection_dim))
+
+    with ThreadPoolExecutor(decode_workers, thread_name_prefix="decode") as pool, \
+            tqdm(total=n_rows, desc=desc) as progress:
+        # Keep decode_workers batches in flight ahead of the model
+        pending = deque()
+        exhausted = False
+        row = 0
+        while True:
+            while not exhausted and len(pending) < decode_workers:
+                loader = next(loaders, None)
+                if loader is None:
+                    exhausted = True
+                else:
+                    pending.append(pool.submit(loader[1]))
+            if not pending:
+                break
+            batch = pending.popleft().result()
+            if isinstance(batch, np.ndarray):
+                features = batch
+            else:
+                with torch.inference_mode():
+                    features = model.get_image_features(pixel_values=batch.to(device)).cpu().numpy()
+            embeddings[row:row + len(features)] = features
+            row += len(features)
+            progress.update(len(features))
+
+    embeddings.flush()
+    if row < n_rows:
+        # A stream that ended early (e.g. a truncated video): keep the rows
+        # that were written
+        rows = np.array(embeddings[:row])
+        del embeddings
+        with open(tmp_path, "wb") as f:
+            np.save(f, rows)
+    else:
+        del embeddings
+    os.replace(tmp_path, output_path)
+
+def save_npy(array, path):
+    # Renamed into place: FaissRetriever memory-maps the text embeddings
+    # (re-ranking), and rewriting the mapped file would tear its rows
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def _batches(items, batch_size):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+def _iter_batches(items, batch_size):
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
 
-    print("Loading transcript...")
-    segments = load_transcript(TRANSCRIPT_PATH)
+def encode_frames(images, output_path, clip=None, batch_size=IMAGE_BATCH_SIZE, decode_workers=DECODE_WORKERS,
+                  count=None):
+    # In-memory hand-off from frame extraction: RGB arrays are encoded
+    # without being written to and read back from JPEG. images may be a
+    # generator (prepare_data.FrameStream), consumed batch by batch, so
+    # only the batches in flight are held; count bounds its length.
+    clip = clip or load_clip()
+    processor = clip[0]
+    loaders = ((len(batch), partial(_preprocess_arrays, processor, batch))
+               for batch in _iter_batches(images, batch_size))
+    _encode_to_memmap(clip, loaders, output_path, decode_workers, "Encoding frames",
+                      n_rows=len(images) if count is None else count)
 
-    print("Generating text embeddings...")
+def generate_image_embeddings(frames_folder, output_path, model_name=CLIP_MODEL_NAME, batch_size=IMAGE_BATCH_SIZE,
+                              decode_workers=DECODE_WORKERS, torch_threads=None, features_path=None,
+                              dtype=EMBEDDING_DTYPE):
+    # Row i is the i-th frame of list_frames. A video whose frames were
+    # embedded at extraction time (features_path(video_id) exists with one
+    # row per frame) is copied from there; other frames are decoded from JPEG.
+    clip = load_clip(model_name, torch_threads)
+    processor = clip[0]
+
+    manifest = {}
+    manifest_path = os.path.join(frames_folder, "frames.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    frame_files = list_frames(frames_folder)
+    loaders = []
+    start = 0
+    while start < len(frame_files):
+        video_id = manifest.get(frame_files[start], {}).get("video_id")
+        end = start + 1
+        while end < len(frame_files) and manifest.get(frame_files[end], {}).get("video_id") == video_id:
+            end += 1
+        group = frame_files[start:end]
+        start = end
+
+        cached = None
+        if video_id is not None and features_path is not None and os.path.exists(features_path(video_id)):
+            cached = np.load(features_path(video_id), mmap_mode="r")
+        if cached is not None and len(cached) == len(group):
+            loaders.extend((len(rows), partial(np.asarray, rows, dtype=np.float32))
+                           for rows in _batches(cached, batch_size))
+        else:
+            # Frames embedded in memory have no JPEG to fall back to; fail
+            # here, naming the video, rather than deep inside a decode worker
+            missing = [f for f in group if not os.path.exists(os.path.join(frames_folder, f))]
+            if missing:
+                found = (f"{features_path(video_id)} has {len(cached)} rows for"
+                         if cached is not None else "no cached features for")
+                raise FileNotFoundError(
+                    f"Cannot embed frames of video {video_id}: {found} its {len(group)} frames in "
+                    f"frames.json, and {len(missing)} of them have no JPEG (e.g. {missing[0]}). "
+                    f"Re-extract its frames (prepare_data.py, or pipeline.py --force {video_id}/frames)."
+                )
+            loaders.extend((len(batch), partial(_preprocess_files, processor, frames_folder, batch))
+                           for batch in _batches(group, batch_size))
+
+    _encode_to_memmap(clip, loaders, output_path, decode_workers, "Encoding frames", dtype)
+
+def embed_shard(shard, batch_size=IMAGE_BATCH_SIZE, decode_workers=DECODE_WORKERS, torch_threads=None,
+                dtype=EMBEDDING_DTYPE):
+    os.makedirs(os.path.dirname(shard.text_embeddings_path), exist_ok=True)
+
+    print(f"[{shard.shard_id}] Loading transcript...")
+    segments = load_transcript(shard.transcript_path)
+
+    print(f"[{shard.shard_id}] Generating text embeddings...")
     text_embeddings = generate_text_embeddings(segments)
-    np.save(TEXT_EMBEDDINGS_PATH, text_embeddings)
+    save_npy(text_embeddings.astype(dtype), shard.text_embeddings_path)
+
+    print(f"[{shard.shard_id}] Generating image embeddings...")
+    generate_image_embeddings(shard.frames_folder, shard.image_embeddings_path,
+                              batch_size=batch_size, decode_workers=decode_workers, torch_threads=torch_threads,
+                              features_path=shard.frame_features_path, dtype=dtype)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate text and image embeddings per corpus shard.")
+    parser.add_argument("--shard", nargs="*", help="Shard ids to process (default: all)")
+    parser.add_argument("--batch-size", type=int, default=IMAGE_BATCH_SIZE, help="Frames per CLIP forward pass")
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS,
+                        help="Threads decoding frames ahead of the model")
+    parser.add_argument("--torch-threads", type=int, help="Intra-op threads for CPU inference (default: torch's)")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=EMBEDDING_DTYPE,
+                        help="Storage type of the embedding files")
+    args = parser.parse_args()
 
-    print("Generating image embeddings...")
-    image_embeddings = generate_image_embeddings(FRAMES_FOLDER)
-    np.save(IMAGE_EMBEDDINGS_PATH, image_embeddings)
+    for shard in load_shards():
+        if args.shard is None or shard.shard_id in args.shard:
+            embed_shard(shard, args.batch_size, args.decode_workers, args.torch_threads, args.dtype)
 
     print("Done!")
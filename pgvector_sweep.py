@@ -0,0 +1,120 @@
+# pgvector_sweep.py
+#
+# Sweeps pgvector index build parameters (lists, m, ef_construction) and
+# search knobs (probes, ef_search) over the gold questions, reporting
+# recall@k against an exact FAISS search and p50/p95 query latency.
+#
+#   python pgvector_sweep.py --lists 50 100 --probes 1 5 10 \
+#       --m 16 32 --ef-construction 64 128 --ef-search 20 40 100
+
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+import pandas as pd
+import faiss
+import retrieval_functions as rf
+from corpus import load_shards
+from db import pooled_connection
+from retrieval import (
+    IVFFLAT_LISTS,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    build_ivfflat_index,
+    build_hnsw_index,
+)
+
+GOLD_SET_PATH = "gold_standard_test_set.xlsx"
+
+def exact_neighbors(query_vecs, top_k):
+    # Brute-force ground truth over every shard, independent of whatever
+    # index type the FAISS shard indexes were built with. Keys match the
+    # (video_id, segment_index) rows of text_embeddings.
+    keys, blocks = [], []
+    for shard in load_shards():
+        with open(shard.transcript_path, "r") as f:
+            segments = json.load(f)
+        positions = {}
+        for seg in segments:
+            video_id = seg.get("video_id", shard.videos[0])
+            keys.append((video_id, positions.get(video_id, 0)))
+            positions[video_id] = positions.get(video_id, 0) + 1
+        blocks.append(np.load(shard.text_embeddings_path).astype(np.float32))
+    embeddings = np.vstack(blocks)
+
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    _, I = index.search(query_vecs, top_k)
+    return [{keys[i] for i in row if i >= 0} for row in I]
+
+def run_config(query_vecs, truth, top_k, method, probes=None, ef_search=None):
+    retriever = rf.get_retriever("pgvector")
+    # Warm-up: prepare the statement and pull index pages into cache
+    retriever.search(query_vecs[:1], top_k, method=method, probes=probes, ef_search=ef_search)
+
+    latencies = []
+    recalls = []
+    for vec, expected in zip(query_vecs, truth):
+        start = time.perf_counter()
+        rows = retriever.search([vec], top_k, method=method, probes=probes, ef_search=ef_search)[0]
+        latencies.append(time.perf_counter() - start)
+        found = {(video_id, segment_index) for _, video_id, segment_index, *_ in rows}
+        recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+def rebuild(builder, **params):
+    start = time.perf_counter()
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        builder(cursor, rebuild=True, **params)
+    return time.perf_counter() - start
+
+def sweep(args):
+    questions = pd.read_excel(GOLD_SET_PATH)["Question"].astype(str).tolist()
+    query_vecs = rf.encode_queries(questions)
+    truth = exact_neighbors(query_vecs, args.top_k)
+
+    rows = []
+    for lists in args.lists:
+        build_seconds = rebuild(build_ivfflat_index, lists=lists)
+        for probes in args.probes:
+            result = run_config(query_vecs, truth, args.top_k, "ivfflat", probes=probes)
+            rows.append({"index": "ivfflat", "lists": lists, "probes": probes,
+                         "build_s": round(build_seconds, 3), **result})
+            print(rows[-1])
+
+    for m, ef_construction in itertools.product(args.m, args.ef_construction):
+        build_seconds = rebuild(build_hnsw_index, m=m, ef_construction=ef_construction)
+        for ef_search in args.ef_search:
+            result = run_config(query_vecs, truth, args.top_k, "hnsw", ef_search=ef_search)
+            rows.append({"index": "hnsw", "m": m, "ef_construction": ef_construction,
+                         "ef_search": ef_search, "build_s": round(build_seconds, 3), **result})
+            print(rows[-1])
+
+    # Leave the default build in place for the app and evaluation
+    rebuild(build_ivfflat_index, lists=IVFFLAT_LISTS)
+    rebuild(build_hnsw_index, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep pgvector index and search parameters.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--lists", type=int, nargs="+", default=[25, 50, 100])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 40, 100])
+    parser.add_argument("--output", default="pgvector_sweep_results.csv")
+    args = parser.parse_args()
+
+    results_df = sweep(args)
+    results_df.to_csv(args.output, index=False)
+
+    print("\nSweep Complete! Results:")
+    print(results_df.to_string(index=False))
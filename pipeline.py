@@ -0,0 +1,411 @@
+# pipeline.py
+#
+# Runs ingestion (download -> transcribe / extract frames -> embed -> index)
+# as a graph of stages instead of three scripts run by hand. Each stage
+# declares its input and output files: it is skipped when the content
+# hashes of its inputs and its parameters match the last successful run and
+# its outputs still exist. Stages are recorded as they finish, so a run
+# that crashes resumes at the first unfinished stage. Stages whose
+# dependencies are done run concurrently, except that stages sharing a
+# resource (the GPU/CPU-heavy models, the database) run one at a time.
+#
+#   python pipeline.py https://www.youtube.com/watch?v=dARr3lGKwk8 [more URLs...]
+#   python pipeline.py                          # refresh every shard of the manifest
+#   python pipeline.py --force faiss_text       # rerun matching stages regardless of hashes
+
+import os
+import json
+import hashlib
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from artifacts import write_index_version
+from corpus import CORPUS_ROOT, load_shards, register_video, video_id_from_url
+import prepare_data
+import embeddings
+import retrieval
+
+PIPELINE_STATE = os.path.join(CORPUS_ROOT, "pipeline_state.json")
+PIPELINE_WORKERS = 4
+
+class Stage:
+    def __init__(self, name, run, inputs=(), outputs=(), deps=(), params=None, resource=None, check=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+        # Stages with the same resource never run at the same time
+        self.resource = resource
+        # Extra completeness test for outputs shared with other stages
+        self.check = check
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+# --- Content hashes --- #
+
+class HashCache:
+    # sha256 of files, remembered by (mtime_ns, size) across runs so an
+    # unchanged multi-GB embedding file is only hashed once
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        self._lock = threading.Lock()
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        key = [stat.st_mtime_ns, stat.st_size]
+        with self._lock:
+            cached = self.entries.get(path)
+        if cached and cached[:2] == key:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self.entries[path] = key + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.entries)
+
+    def digest(self, path):
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if ".tmp." in name:
+                        continue
+                    file_path = os.path.join(root, name)
+                    digest.update(f"{os.path.relpath(file_path, path)}:{self.file_digest(file_path)}\n".encode())
+            return digest.hexdigest()
+        if os.path.exists(path):
+            return self.file_digest(path)
+        return None
+
+def stage_fingerprint(stage, hashes):
+    payload = {
+        "params": stage.params,
+        "inputs": {path: hashes.digest(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+# --- Runner --- #
+
+class Pipeline:
+    def __init__(self, stages, state_path=PIPELINE_STATE, workers=PIPELINE_WORKERS):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+        self.workers = workers
+        self._state_lock = threading.Lock()
+        self._resource_locks = {}
+        self.state = {"stages": {}, "hashes": {}}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                self.state = json.load(f)
+        self.hashes = HashCache(self.state.setdefault("hashes", {}))
+
+    def _save_state(self):
+        # Called under _state_lock after every stage, so a crash loses at
+        # most the stages that were still running
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(self.state, hashes=self.hashes.snapshot()), f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def is_current(self, stage, fingerprint):
+        record = self.state["stages"].get(stage.name)
+        return (
+            record is not None
+            and record["fingerprint"] == fingerprint
+            and all(os.path.exists(path) for path in stage.outputs)
+            and (stage.check is None or stage.check())
+        )
+
+    def _execute(self, stage, force):
+        # Inputs are hashed only now, once the stages producing them are done
+        fingerprint = stage_fingerprint(stage, self.hashes)
+        if not force and self.is_current(stage, fingerprint):
+            return "skipped", 0.0
+
+        lock = self._resource_locks.setdefault(stage.resource, threading.Lock()) if stage.resource else None
+        start = time.perf_counter()
+        if lock:
+            with lock:
+                stage.run()
+        else:
+            stage.run()
+        elapsed = time.perf_counter() - start
+
+        with self._state_lock:
+            self.state["stages"][stage.name] = {
+                "fingerprint": fingerprint,
+                "seconds": round(elapsed, 3),
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._save_state()
+        return "ran", elapsed
+
+    def run(self, force=()):
+        # force: stage names, or name fragments such as "faiss_text", to rerun
+        # even when current. Returns name -> "ran" | "skipped" | "failed" | "blocked".
+        for stage in self.stages.values():
+            # Resource locks must exist before workers race to create them
+            if stage.resource:
+                self._resource_locks.setdefault(stage.resource, threading.Lock())
+
+        status = {}
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="stage") as pool:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if any(status.get(dep) in ("failed", "blocked") for dep in stage.deps):
+                        status[name] = "blocked"
+                        del pending[name]
+                    elif all(status.get(dep) in ("ran", "skipped") for dep in stage.deps):
+                        forced = any(fragment in name for fragment in force)
+                        running[pool.submit(self._execute, stage, forced)] = name
+                        del pending[name]
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status[name], elapsed = future.result()
+                        print(f"[{status[name]}] {name}" + (f" ({elapsed:.1f}s)" if status[name] == "ran" else ""))
+                    except Exception as e:
+                        status[name] = "failed"
+                        print(f"[failed] {name}: {e}")
+
+        for name in pending:
+            status[name] = "blocked"
+        with self._state_lock:
+            self._save_state()
+        return status
+
+# --- Ingestion stages --- #
+
+def _load_segments(shard):
+    with open(shard.transcript_path, "r") as f:
+        return json.load(f)
+
+def _frames_extracted(shard, video_id):
+    if not os.path.exists(shard.frames_manifest):
+        return False
+    with open(shard.frames_manifest, "r") as f:
+        return any(entry.get("video_id") == video_id for entry in json.load(f).values())
+
+def video_stages(shard, video_id, url, args):
+    prefix = f"{shard.shard_id}/{video_id}"
+    video_path = shard.video_path(video_id)
+    transcript_path = shard.video_transcript_path(video_id)
+
+    def transcribe():
+        # Chunk checkpoints let an interrupted transcription resume mid-video
+        segments = prepare_data.transcribe_audio(video_path, transcript_path + ".chunks",
+                                                 workers=args.transcribe_workers)
+        prepare_data.save_transcript(segments, transcript_path)
+
+    def frames():
+        extracted = prepare_data.extract_frames(
+            video_path, shard.frames_folder, prefix=f"{video_id}_", video_id=video_id,
+            mode=args.frame_mode, workers=args.frame_workers, in_memory=args.embed_frames
+        )
+        if args.embed_frames:
+            embeddings.encode_frames((image for _, _, image in extracted), shard.frame_features_path(video_id),
+                                     count=len(extracted))
+
+    frame_outputs = [shard.frames_manifest] + ([shard.frame_features_path(video_id)] if args.embed_frames else [])
+    return [
+        Stage(f"{prefix}/download", lambda: prepare_data.download_video(url, video_path),
+              outputs=[video_path], params={"url": url}, resource="network"),
+        Stage(f"{prefix}/transcribe", transcribe,
+              inputs=[video_path], outputs=[transcript_path], deps=[f"{prefix}/download"], resource="model"),
+        Stage(f"{prefix}/frames", frames,
+              inputs=[video_path], outputs=frame_outputs, deps=[f"{prefix}/download"],
+              params={"mode": args.frame_mode, "embed_frames": args.embed_frames},
+              resource="model" if args.embed_frames else None,
+              check=lambda: _frames_extracted(shard, video_id)),
+    ]
+
+class BulkLoad:
+    # Shared by the shards' pgvector stages: the first shard of at least
+    # retrieval.BULK_REBUILD_THRESHOLD rows drops the ANN indexes, once, and
+    # the pgvector_indexes stage rebuilds them (with any quantized or partial
+    # ones dropped along) over the whole table after the last shard
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.quantized = []
+        self.partial_videos = []
+        self.dropped = False
+
+    def drop_indexes(self):
+        with self._lock:
+            if not self.dropped:
+                self.quantized, self.partial_videos = retrieval.drop_pgvector_indexes()
+                self.dropped = True
+
+    def build_indexes(self, quantized, partial_videos):
+        with self._lock:
+            quantized = list(quantized) + [kind for kind in self.quantized if kind not in quantized]
+            partial_videos = list(partial_videos) + [v for v in self.partial_videos if v not in partial_videos]
+        retrieval.build_pgvector_indexes(quantized=quantized, partial_videos=partial_videos)
+
+def shard_stages(shard, args, bulk_load):
+    prefix = shard.shard_id
+    transcripts = [shard.video_transcript_path(video_id) for video_id in shard.videos]
+    transcribed = [f"{prefix}/{video_id}/transcribe" for video_id in shard.videos]
+    framed = [f"{prefix}/{video_id}/frames" for video_id in shard.videos]
+    faiss_text_outputs = [shard.faiss_text_index, retrieval.faiss_meta_path(shard.faiss_text_index)]
+    faiss_image_outputs = [shard.faiss_image_index, retrieval.faiss_meta_path(shard.faiss_image_index)]
+
+    def transcript():
+        segments = []
+        for video_id, path in zip(shard.videos, transcripts):
+            with open(path, "r") as f:
+                segments.extend(dict(seg, video_id=video_id) for seg in json.load(f))
+        prepare_data.save_transcript(segments, shard.transcript_path)
+
+    def text_embeddings():
+        vectors = embeddings.generate_text_embeddings(_load_segments(shard))
+        embeddings.save_npy(vectors.astype(args.embedding_dtype), shard.text_embeddings_path)
+
+    def image_embeddings():
+        embeddings.generate_image_embeddings(shard.frames_folder, shard.image_embeddings_path,
+                                             features_path=shard.frame_features_path, dtype=args.embedding_dtype)
+
+    def faiss_text():
+        vectors = np.load(shard.text_embeddings_path)
+        retrieval.build_faiss_index(vectors, vectors.shape[1], shard.faiss_text_index,
+                                    spec=args.faiss_spec, metric=args.faiss_metric,
+                                    rerank=args.faiss_rerank, vectors_path=shard.text_embeddings_path)
+
+    def faiss_image():
+        vectors = np.load(shard.image_embeddings_path)
+        retrieval.build_faiss_index(vectors, vectors.shape[1], shard.faiss_image_index,
+                                    spec=args.faiss_image_spec, metric="cosine",
+                                    rerank=args.faiss_rerank, vectors_path=shard.image_embeddings_path)
+
+    def pgvector():
+        segments = _load_segments(shard)
+        if len(segments) >= retrieval.BULK_REBUILD_THRESHOLD:
+            bulk_load.drop_indexes()
+        retrieval.insert_text_embeddings(
+            np.load(shard.text_embeddings_path),
+            segments,
+            [seg.get('video_id', shard.videos[0]) for seg in segments]
+        )
+
+    def texts():
+        return [seg['text'] for seg in _load_segments(shard)]
+
+    os.makedirs(shard.path("retrieval"), exist_ok=True)
+    return [
+        Stage(f"{prefix}/transcript", transcript,
+              inputs=transcripts, outputs=[shard.transcript_path], deps=transcribed),
+        Stage(f"{prefix}/text_embeddings", text_embeddings,
+              inputs=[shard.transcript_path], outputs=[shard.text_embeddings_path],
+              deps=[f"{prefix}/transcript"], params={"dtype": args.embedding_dtype}, resource="model"),
+        Stage(f"{prefix}/image_embeddings", image_embeddings,
+              inputs=[shard.frames_folder, shard.path("embeddings", "frames")],
+              outputs=[shard.image_embeddings_path], deps=framed, params={"dtype": args.embedding_dtype},
+              resource="model"),
+        Stage(f"{prefix}/faiss_text", faiss_text,
+              inputs=[shard.text_embeddings_path], outputs=faiss_text_outputs,
+              deps=[f"{prefix}/text_embeddings"],
+              params={"spec": args.faiss_spec, "metric": args.faiss_metric, "rerank": args.faiss_rerank}),
+        Stage(f"{prefix}/faiss_image", faiss_image,
+              inputs=[shard.image_embeddings_path], outputs=faiss_image_outputs,
+              deps=[f"{prefix}/image_embeddings"],
+              params={"spec": args.faiss_image_spec, "metric": "cosine", "rerank": args.faiss_rerank}),
+        Stage(f"{prefix}/frame_alignment",
+              lambda: retrieval.build_frame_alignment(shard, _load_segments(shard), shard.frame_alignment),
+              inputs=[shard.transcript_path, shard.frames_manifest], outputs=[shard.frame_alignment],
+              deps=[f"{prefix}/transcript"] + framed),
+        Stage(f"{prefix}/segment_table",
+              lambda: retrieval.build_segment_table(_load_segments(shard), shard.segment_table, shard.videos[0]),
+              inputs=[shard.transcript_path], outputs=[shard.segment_table], deps=[f"{prefix}/transcript"]),
+        Stage(f"{prefix}/tfidf", lambda: retrieval.build_tfidf_model(texts(), shard.tfidf_index),
+              inputs=[shard.transcript_path], outputs=[shard.tfidf_index], deps=[f"{prefix}/transcript"]),
+        Stage(f"{prefix}/bm25", lambda: retrieval.build_bm25_model(texts(), shard.bm25_index),
+              inputs=[shard.transcript_path], outputs=[shard.bm25_index], deps=[f"{prefix}/transcript"]),
+        Stage(f"{prefix}/pgvector", pgvector,
+              inputs=[shard.transcript_path, shard.text_embeddings_path],
+              deps=["pgvector_table", f"{prefix}/text_embeddings"], resource="database",
+              params={"schema": retrieval.TEXT_EMBEDDINGS_SCHEMA}),
+    ]
+
+def build_stages(shards, urls, args):
+    stages = [Stage("pgvector_table", retrieval.create_table, resource="database",
+                    params={"schema": retrieval.TEXT_EMBEDDINGS_SCHEMA})]
+    bulk_load = BulkLoad()
+    for shard in shards:
+        for video_id in shard.videos:
+            url = urls.get(video_id, f"https://www.youtube.com/watch?v={video_id}")
+            stages.extend(video_stages(shard, video_id, url, args))
+        stages.extend(shard_stages(shard, args, bulk_load))
+
+    # One pass over the whole table once every shard is loaded; also rerun
+    # when a bulk load left the table without its indexes
+    stages.append(Stage(
+        "pgvector_indexes",
+        lambda: bulk_load.build_indexes(args.pgvector_quantized, args.pgvector_partial_videos),
+        inputs=[path for shard in shards for path in (shard.transcript_path, shard.text_embeddings_path)],
+        deps=[f"{shard.shard_id}/pgvector" for shard in shards], resource="database",
+        check=retrieval.pgvector_indexes_exist,
+        params={"lists": retrieval.IVFFLAT_LISTS, "m": retrieval.HNSW_M,
+                "ef_construction": retrieval.HNSW_EF_CONSTRUCTION, "quantized": sorted(args.pgvector_quantized),
+                "partial_videos": sorted(args.pgvector_partial_videos)},
+    ))
+    return stages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental, resumable ingestion of the video corpus.")
+    parser.add_argument("urls", nargs="*", help="YouTube URLs to add (default: refresh the corpus manifest)")
+    parser.add_argument("--shard", help="Group the given videos into this shard (default: one shard per video)")
+    parser.add_argument("--only-shard", nargs="*", help="Shard ids to process (default: all)")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="Stages run concurrently")
+    parser.add_argument("--force", nargs="*", default=[], help="Rerun stages whose name contains any of these")
+    parser.add_argument("--frame-mode", choices=prepare_data.FRAME_EXTRACTION_MODES, default="grab")
+    parser.add_argument("--frame-workers", type=int, default=1)
+    parser.add_argument("--embed-frames", action="store_true",
+                        help="Embed frames with CLIP in memory instead of saving them as JPEGs")
+    parser.add_argument("--transcribe-workers", type=int, default=1)
+    parser.add_argument("--faiss-spec", default=retrieval.FAISS_TEXT_SPEC)
+    parser.add_argument("--faiss-metric", default=retrieval.FAISS_TEXT_METRIC, choices=["l2", "ip", "cosine"])
+    parser.add_argument("--faiss-image-spec", default=retrieval.FAISS_IMAGE_SPEC)
+    parser.add_argument("--faiss-rerank", type=int, default=retrieval.FAISS_RERANK,
+                        help="Re-score rerank * top_k candidates of compressed FAISS indexes exactly")
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16"], default=embeddings.EMBEDDING_DTYPE)
+    parser.add_argument("--pgvector-quantized", nargs="*", default=[],
+                        choices=sorted(retrieval.PGVECTOR_QUANTIZED_INDEXES))
+    parser.add_argument("--pgvector-partial-videos", nargs="*", default=[],
+                        help="Videos that get their own partial pgvector HNSW index")
+    args = parser.parse_args()
+
+    urls = {}
+    for url in args.urls:
+        video_id = video_id_from_url(url)
+        register_video(video_id, args.shard)
+        urls[video_id] = url
+
+    shards = [shard for shard in load_shards() if args.only_shard is None or shard.shard_id in args.only_shard]
+    status = Pipeline(build_stages(shards, urls, args), workers=args.workers).run(force=args.force)
+    if "ran" in status.values():
+        # Invalidates cached answers of the previous build (see answer_cache.py)
+        write_index_version()
+
+    counts = {}
+    for result in status.values():
+        counts[result] = counts.get(result, 0) + 1
+    print("Pipeline finished: " + ", ".join(f"{n} {result}" for result, n in sorted(counts.items())))
@@ -0,0 +1,104 @@
+# postings.py
+#
+# Lexical indexes (BM25, TF-IDF) as term-major postings of precomputed
+# document weights, stored as an artifacts.py bundle:
+#
+#   indptr   (n_terms + 1,)  postings of term t are [indptr[t], indptr[t + 1])
+#   indices  (n_postings,)   document positions, ascending within a term
+#   data     (n_postings,)   float32 weight of the term in that document
+#   terms_offsets / terms_blob   sorted vocabulary; term id = sorted position
+#
+# A query is a weight per query term; scoring gathers only those terms'
+# postings, so its cost follows the query, not the corpus size.
+
+from abc import ABC, abstractmethod
+import numpy as np
+from artifacts import StringTable, pack_strings, read_bundle, write_bundle
+
+def write_postings(path, doc_ids, term_ids, weights, terms, n_docs, meta=None):
+    # terms must be sorted; term_ids index into it
+    term_ids = np.asarray(term_ids, dtype=np.int64)
+    order = np.lexsort((doc_ids, term_ids))
+    counts = np.bincount(term_ids, minlength=len(terms))
+    terms_offsets, terms_blob = pack_strings(terms)
+    write_bundle(path, {
+        "indptr": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "indices": np.asarray(doc_ids, dtype=np.int32)[order],
+        "data": np.asarray(weights, dtype=np.float32)[order],
+        "terms_offsets": terms_offsets,
+        "terms_blob": terms_blob,
+    }, dict(meta or {}, n_docs=n_docs))
+
+def sorted_vocabulary(term_ids, vocab):
+    # Renumbers insertion-order term ids (vocab: term -> id) by sorted term
+    terms = sorted(vocab)
+    remap = np.empty(len(vocab), dtype=np.int64)
+    for position, term in enumerate(terms):
+        remap[vocab[term]] = position
+    return remap[np.asarray(term_ids, dtype=np.int64)], terms
+
+class PostingsIndex(ABC):
+    def __init__(self, path):
+        self.meta, arrays = read_bundle(path)
+        self.n_docs = self.meta["n_docs"]
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.data = arrays["data"]
+        self.terms = StringTable(arrays["terms_offsets"], arrays["terms_blob"])
+
+    def term_ids(self, tokens):
+        # Occurrence count of every known token: {term_id: count}
+        counts = {}
+        for token in tokens:
+            term_id = self.terms.index(token)
+            if term_id >= 0:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        return counts
+
+    @abstractmethod
+    def query_weights(self, question):
+        # {term_id: weight} of one query; defined by each index type
+        ...
+
+    def search(self, questions, top_k, doc_mask=None):
+        # Same layout as the other retrievers: (n_queries, top_k), best
+        # first, -inf / -1 where fewer documents matched. All questions are
+        # scored together: their (question, term) postings are gathered in
+        # one pass and summed per (question, document) pair, so a batch
+        # costs a few array operations instead of a Python loop of them.
+        top_scores = np.full((len(questions), top_k), -np.inf)
+        top_ids = np.full((len(questions), top_k), -1, dtype=np.int64)
+        rows, term_ids, weights = [], [], []
+        for row, question in enumerate(questions):
+            for term_id, weight in self.query_weights(question).items():
+                rows.append(row)
+                term_ids.append(term_id)
+                weights.append(weight)
+        if not rows or top_k <= 0:
+            return top_scores, top_ids
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        starts = self.indptr[term_ids]
+        lengths = self.indptr[term_ids + 1] - starts
+        # Position of every gathered posting: each term's run of postings,
+        # laid end to end
+        run_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) + np.repeat(starts - run_starts, lengths)
+        docs = self.indices[positions].astype(np.int64)
+        values = self.data[positions] * np.repeat(np.asarray(weights, dtype=np.float32), lengths)
+        query_rows = np.repeat(np.asarray(rows, dtype=np.int64), lengths)
+        if doc_mask is not None:
+            keep = doc_mask[docs]
+            docs, values, query_rows = docs[keep], values[keep], query_rows[keep]
+
+        pairs, inverse = np.unique(query_rows * self.n_docs + docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=values)
+        pair_rows, pair_docs = np.divmod(pairs, self.n_docs)
+        # Per question: best score first, ties by document position
+        order = np.lexsort((pair_docs, -scores, pair_rows))
+        pair_rows = pair_rows[order]
+        rank = np.arange(len(order)) - np.searchsorted(pair_rows, pair_rows)
+        best = rank < top_k
+        top_scores[pair_rows[best], rank[best]] = scores[order][best]
+        top_ids[pair_rows[best], rank[best]] = pair_docs[order][best]
+        return top_scores, top_ids
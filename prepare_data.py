@@ -2,56 +2,370 @@
 
 import os
 import json
+import argparse
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
+import numpy as np
+import torch
 import whisper
 from tqdm import tqdm
 import yt_dlp
+from corpus import DEFAULT_VIDEO_ID, register_video, video_id_from_url
+
+DEFAULT_YOUTUBE_URL = f"https://www.youtube.com/watch?v={DEFAULT_VIDEO_ID}"
+
+FRAME_EXTRACTION_MODES = ("grab", "seek")
+# Frames extracted in memory are downscaled to CLIP's input size (shortest
+# side) where they are decoded, and parallel extraction hands them over in
+# ranges of at most this many frames, so memory does not grow with the video
+EMBED_FRAME_SIZE = 224
+IN_MEMORY_RANGE_FRAMES = 128
+
+# Whisper transcription: audio is cut near every TRANSCRIBE_CHUNK_SECONDS at
+# the quietest point within SILENCE_SEARCH_SECONDS of the target
+WHISPER_MODEL = "small"
+TRANSCRIBE_CHUNK_SECONDS = 300
+SILENCE_SEARCH_SECONDS = 30
+
+# Shard transcripts and frames.json are shared by the videos of a shard;
+# serializes their read-modify-write when videos are prepared concurrently
+_shard_files_lock = threading.Lock()
 
 def download_video(youtube_url, output_path="video.mp4"):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
     ydl_opts = {'outtmpl': output_path}
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([youtube_url])
 
-def transcribe_audio(video_path):
-    model = whisper.load_model("small")  
-    result = model.transcribe(video_path)
-    return result['segments']
+# --- Transcription --- #
+
+def silence_chunks(audio, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS, search_seconds=SILENCE_SEARCH_SECONDS,
+                   window_seconds=0.05, sample_rate=whisper.audio.SAMPLE_RATE):
+    # Splits audio into (start, end) sample ranges of about chunk_seconds,
+    # each cut placed at the quietest 50 ms window within search_seconds
+    # of the target, so words are rarely split between chunks
+    window = int(sample_rate * window_seconds)
+    n_windows = len(audio) // window
+    energy = np.sqrt(np.mean(np.square(audio[:n_windows * window].reshape(n_windows, window)), axis=1))
+
+    chunk, search = int(chunk_seconds * sample_rate), int(search_seconds * sample_rate)
+    cuts = [0]
+    while len(audio) - cuts[-1] > chunk + search:
+        lo = (cuts[-1] + chunk - search) // window
+        hi = (cuts[-1] + chunk + search) // window
+        quietest = lo + int(np.argmin(energy[lo:hi]))
+        cuts.append(quietest * window + window // 2)
+    cuts.append(len(audio))
+    return list(zip(cuts[:-1], cuts[1:]))
+
+_worker_model = None
+
+def _load_transcriber(model_name, threads=None):
+    # Process pool initializer: one Whisper model per worker process
+    global _worker_model
+    if threads:
+        torch.set_num_threads(threads)
+    _worker_model = whisper.load_model(model_name)
+
+def _transcribe_chunk(index, audio, offset):
+    segments = _worker_model.transcribe(audio)['segments']
+    for seg in segments:
+        seg['start'] += offset
+        seg['end'] += offset
+        seg['seek'] = seg.get('seek', 0) + int(offset * 100)
+        for word in seg.get('words') or ():
+            word['start'] += offset
+            word['end'] += offset
+    return index, segments
+
+def _write_json(data, path, indent=None):
+    # Written next to path and renamed into place, so an interrupted run
+    # never leaves a truncated file for the pipeline to hash and parse
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+def transcribe_audio(video_path, checkpoint_dir=None, workers=1, model_name=WHISPER_MODEL,
+                     chunk_seconds=TRANSCRIBE_CHUNK_SECONDS):
+    # Transcribes silence-bounded chunks, across `workers` processes when
+    # > 1, with segment times shifted by each chunk's offset. With a
+    # checkpoint_dir every finished chunk is saved there and a restarted job
+    # only transcribes the missing chunks. segments.jsonl there holds the
+    # transcribed prefix of the timeline as chunks complete, for following a
+    # long job; the returned segments are the transcript later stages read.
+    audio = whisper.load_audio(video_path)
+    sample_rate = whisper.audio.SAMPLE_RATE
+    chunks = silence_chunks(audio, chunk_seconds)
+
+    done = {}
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        plan = {"model": model_name, "samples": len(audio),
+                "audio_sha256": hashlib.sha256(audio.tobytes()).hexdigest(), "chunks": chunks}
+        plan_path = os.path.join(checkpoint_dir, "plan.json")
+        previous = None
+        if os.path.exists(plan_path):
+            with open(plan_path, "r") as f:
+                previous = json.load(f)
+        if previous is not None and previous["audio_sha256"] == plan["audio_sha256"] \
+                and previous["model"] == model_name:
+            # Keep the original cuts so saved chunks stay valid
+            chunks = [tuple(chunk) for chunk in previous["chunks"]]
+        else:
+            for name in os.listdir(checkpoint_dir):
+                os.remove(os.path.join(checkpoint_dir, name))
+            _write_json(plan, plan_path)
+        for index in range(len(chunks)):
+            chunk_path = os.path.join(checkpoint_dir, f"chunk_{index:04d}.json")
+            if os.path.exists(chunk_path):
+                with open(chunk_path, "r") as f:
+                    done[index] = json.load(f)
+
+    stream_path = os.path.join(checkpoint_dir, "segments.jsonl") if checkpoint_dir else None
+    streamed = 0
+
+    def record(index, segments):
+        # Save the chunk, then append every chunk now contiguous with the
+        # already streamed prefix
+        nonlocal streamed
+        done[index] = segments
+        if not checkpoint_dir:
+            return
+        _write_json(segments, os.path.join(checkpoint_dir, f"chunk_{index:04d}.json"))
+        with open(stream_path, "a") as f:
+            while streamed in done:
+                for seg in done[streamed]:
+                    f.write(json.dumps(seg) + "\n")
+                streamed += 1
+
+    if stream_path:
+        # Rebuilt from the saved chunks; appends continue from there
+        open(stream_path, "w").close()
+        if 0 in done:
+            record(0, done[0])
+
+    todo = [i for i in range(len(chunks)) if i not in done]
+    with tqdm(total=len(chunks), initial=len(chunks) - len(todo), desc="Transcribing chunks") as progress:
+        if workers > 1 and len(todo) > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(min(workers, len(todo)), mp_context=context, initializer=_load_transcriber,
+                                     initargs=(model_name, threads)) as pool:
+                futures = [pool.submit(_transcribe_chunk, i, audio[chunks[i][0]:chunks[i][1]],
+                                       chunks[i][0] / sample_rate) for i in todo]
+                for future in as_completed(futures):
+                    record(*future.result())
+                    progress.update(1)
+        elif todo:
+            _load_transcriber(model_name)
+            for i in todo:
+                record(*_transcribe_chunk(i, audio[chunks[i][0]:chunks[i][1]], chunks[i][0] / sample_rate))
+                progress.update(1)
+
+    segments = [seg for index in range(len(chunks)) for seg in done[index]]
+    for seg_id, seg in enumerate(segments):
+        seg['id'] = seg_id
+    return segments
 
 def save_transcript(segments, output_path="data/transcript.json"):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(segments, f, indent=2)
+    _write_json(segments, output_path, indent=2)
 
-def extract_frames(video_path, frame_folder="data/frames", every_n_seconds=5):
-    os.makedirs(frame_folder, exist_ok=True)
+def merge_into_shard_transcript(segments, video_id, transcript_path):
+    # A shard transcript holds every video of the shard, each video's
+    # segments contiguous and tagged with video_id; re-running a video
+    # replaces its segments.
+    with _shard_files_lock:
+        existing = []
+        if os.path.exists(transcript_path):
+            with open(transcript_path, "r") as f:
+                existing = [seg for seg in json.load(f) if seg.get("video_id") != video_id]
+        tagged = [dict(seg, video_id=video_id) for seg in segments]
+        save_transcript(existing + tagged, transcript_path)
+
+def save_frames_manifest(frames, frame_folder, video_id):
+    # frames.json records when each frame was taken; frames previously
+    # extracted for this video are replaced
+    manifest_path = os.path.join(frame_folder, "frames.json")
+    with _shard_files_lock:
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = {name: entry for name, entry in json.load(f).items()
+                            if entry.get("video_id") != video_id}
+        manifest.update(frames)
+        _write_json(manifest, manifest_path, indent=2)
+
+def _frame_numbers(video_path, every_n_seconds):
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps * every_n_seconds)
-
-    count = 0
-    frame_count = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if count % frame_interval == 0:
-            frame_path = os.path.join(frame_folder, f"frame_{frame_count:04d}.jpg")
-            cv2.imwrite(frame_path, frame)
-            frame_count += 1
-        count += 1
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
+    frame_interval = max(int(fps * every_n_seconds), 1)
+    return fps, list(range(0, total, frame_interval))
 
-if __name__ == "__main__":
-    YOUTUBE_URL = "https://www.youtube.com/watch?v=dARr3lGKwk8"
-    
-    print("Downloading video...")
-    download_video(YOUTUBE_URL)
+def _read_frames(video_path, targets, mode):
+    # Yields (frame_number, BGR image) for the requested frame numbers only.
+    # "grab" advances past skipped frames without retrieving/converting
+    # them; "seek" jumps to each target, which decodes from the nearest
+    # keyframe and wins when frames are far apart.
+    cap = cv2.VideoCapture(video_path)
+    try:
+        position = 0
+        if targets and targets[0] > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, targets[0])
+            position = targets[0]
+        for target in targets:
+            if mode == "seek" and target != position:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target:
+                if not cap.grab():
+                    return
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                return
+            position += 1
+            yield target, frame
+    finally:
+        cap.release()
+
+def _embed_image(frame):
+    # BGR frame -> RGB array with its shortest side at most EMBED_FRAME_SIZE
+    height, width = frame.shape[:2]
+    scale = EMBED_FRAME_SIZE / min(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+def _iter_range(video_path, numbered, fps, mode, frame_folder, prefix, in_memory):
+    # numbered: (frame_index, frame_number) pairs of one contiguous time range
+    names = {number: index for index, number in numbered}
+    for number, frame in _read_frames(video_path, [number for _, number in numbered], mode):
+        frame_name = f"{prefix}frame_{names[number]:04d}.jpg"
+        if in_memory:
+            image = _embed_image(frame)
+        else:
+            cv2.imwrite(os.path.join(frame_folder, frame_name), frame)
+            image = None
+        yield frame_name, number / fps, image
+
+def _extract_range(video_path, numbered, fps, mode, frame_folder, prefix, in_memory):
+    return list(_iter_range(video_path, numbered, fps, mode, frame_folder, prefix, in_memory))
+
+def _iter_frames(video_path, numbered, fps, mode, frame_folder, prefix, in_memory, workers):
+    # Yields (frame_name, timestamp, image) in frame order. workers > 1
+    # splits the video into time ranges, each read by its own process; with
+    # in_memory the ranges are small and only 2 * workers are in flight, so
+    # decoded frames waiting for the consumer stay bounded.
+    if workers <= 1 or len(numbered) <= workers:
+        yield from _iter_range(video_path, numbered, fps, mode, frame_folder, prefix, in_memory)
+        return
+    size = -(-len(numbered) // workers)
+    if in_memory:
+        size = min(size, IN_MEMORY_RANGE_FRAMES)
+    ranges = [numbered[i:i + size] for i in range(0, len(numbered), size)]
+    with ProcessPoolExecutor(min(workers, len(ranges))) as pool:
+        pending = deque()
+        for part in ranges:
+            pending.append(pool.submit(_extract_range, video_path, part, fps, mode, frame_folder, prefix, in_memory))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+class FrameStream:
+    # Frames extracted in memory, yielded as (frame_name, timestamp, image)
+    # while later ones are still being decoded; len() is the number of
+    # frames expected. frames.json is written once the last one is yielded.
+    def __init__(self, frames, expected, frame_folder, video_id):
+        self._frames = frames
+        self._expected = expected
+        self.frame_folder = frame_folder
+        self.video_id = video_id
+
+    def __len__(self):
+        return self._expected
+
+    def __iter__(self):
+        extracted = {}
+        for name, timestamp, image in self._frames:
+            extracted[name] = {"video_id": self.video_id, "timestamp": timestamp}
+            yield name, timestamp, image
+        if self.video_id is not None:
+            save_frames_manifest(extracted, self.frame_folder, self.video_id)
 
-    print("Transcribing audio...")
-    segments = transcribe_audio("video.mp4")
-    save_transcript(segments)
+def extract_frames(video_path, frame_folder="data/frames", every_n_seconds=5, prefix="", video_id=None,
+                   mode="grab", workers=1, in_memory=False):
+    # Returns (frame_name, timestamp, image) per extracted frame. Frames are
+    # written as JPEGs (image is None) unless in_memory, which returns a
+    # FrameStream of downscaled RGB arrays for encode_frames to consume
+    # instead. workers > 1 splits the video across processes.
+    if mode not in FRAME_EXTRACTION_MODES:
+        raise ValueError(f"Invalid mode. Choose from {FRAME_EXTRACTION_MODES}.")
+    os.makedirs(frame_folder, exist_ok=True)
+    fps, numbers = _frame_numbers(video_path, every_n_seconds)
+    numbered = list(enumerate(numbers))
+    frames = _iter_frames(video_path, numbered, fps, mode, frame_folder, prefix, in_memory, workers)
+    if in_memory:
+        return FrameStream(frames, len(numbered), frame_folder, video_id)
+
+    frames = list(frames)
+    if video_id is not None:
+        save_frames_manifest(
+            {name: {"video_id": video_id, "timestamp": timestamp} for name, timestamp, _ in frames},
+            frame_folder, video_id
+        )
+    return frames
+
+def prepare_video(youtube_url, shard_id=None, frame_mode="grab", frame_workers=1, embed_frames=False,
+                  transcribe_workers=1):
+    video_id = video_id_from_url(youtube_url)
+    shard = register_video(video_id, shard_id)
+    video_path = shard.video_path(video_id)
+    print(f"[{video_id}] shard: {shard.shard_id}")
+
+    print(f"[{video_id}] Downloading video...")
+    download_video(youtube_url, video_path)
+
+    print(f"[{video_id}] Transcribing audio...")
+    segments = transcribe_audio(video_path, shard.video_transcript_path(video_id) + ".chunks",
+                                workers=transcribe_workers)
+    merge_into_shard_transcript(segments, video_id, shard.transcript_path)
+
+    print(f"[{video_id}] Extracting frames...")
+    # Prefixed by video id, so a sorted listing groups a shard's frames by video
+    frames = extract_frames(video_path, shard.frames_folder, prefix=f"{video_id}_", video_id=video_id,
+                            mode=frame_mode, workers=frame_workers, in_memory=embed_frames)
+
+    if embed_frames:
+        # Imported here: CLIP is only needed for the in-memory hand-off
+        from embeddings import encode_frames
+        print(f"[{video_id}] Embedding frames...")
+        encode_frames((image for _, _, image in frames), shard.frame_features_path(video_id), count=len(frames))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download, transcribe and extract frames for videos.")
+    parser.add_argument("urls", nargs="*", default=[DEFAULT_YOUTUBE_URL], help="YouTube URLs")
+    parser.add_argument("--shard", help="Group all given videos into this shard (default: one shard per video)")
+    parser.add_argument("--frame-mode", choices=FRAME_EXTRACTION_MODES, default="grab",
+                        help="Skip unneeded frames by grabbing past them or seeking to each kept frame")
+    parser.add_argument("--frame-workers", type=int, default=1,
+                        help="Processes extracting frames, each over its own time range")
+    parser.add_argument("--embed-frames", action="store_true",
+                        help="Embed frames with CLIP in memory instead of saving them as JPEGs")
+    parser.add_argument("--transcribe-workers", type=int, default=1,
+                        help="Processes transcribing audio chunks in parallel")
+    args = parser.parse_args()
 
-    print("Extracting frames...")
-    extract_frames("video.mp4")
+    for url in args.urls:
+        prepare_video(url, args.shard, args.frame_mode, args.frame_workers, args.embed_frames,
+                      args.transcribe_workers)
 
     print("Done!")
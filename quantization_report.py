@@ -0,0 +1,173 @@
+# quantization_report.py
+#
+# Memory saved against quality lost by the compressed representations of
+# the text embeddings, over the gold questions. Each FAISS configuration is
+# built in memory from the shards' embedding files and compared with an
+# exact float32 search: index size, recall@k of the exact neighbours, and
+# accuracy@1 on the answerable gold questions. With --pgvector the
+# pgvector indexes (including the quantized ones, see retrieval.py
+# --pgvector-quantized) are measured the same way.
+#
+#   python quantization_report.py --top-k 5 --rerank 4 --pgvector --output quantization.json
+
+import argparse
+import io
+import json
+import numpy as np
+import pandas as pd
+import faiss
+import retrieval_functions as rf
+from corpus import DEFAULT_VIDEO_ID, load_shards
+from retrieval import FAISS_TEXT_METRIC, PGVECTOR_QUANTIZED_INDEXES, create_faiss_index
+from retrievers import binarize, exact_rerank
+
+GOLD_SET_PATH = "gold_standard_test_set.xlsx"
+TIMESTAMP_TOLERANCE = 10
+# (name, index_factory spec, float16 storage) measured besides exact float32
+FAISS_CONFIGS = (
+    ("float16 file, Flat", "Flat", True),
+    ("SQfp16", "SQfp16", False),
+    ("SQ8", "SQ8", False),
+    ("IVF + SQ8", "IVF{nlist},SQ8", False),
+    ("binary", "BFlat", False),
+)
+PGVECTOR_INDEXES = {"ivfflat": "ivfflat_index", "hnsw": "hnsw_index"}
+PGVECTOR_INDEXES.update({f"hnsw_{kind}": name for kind, (name, _) in PGVECTOR_QUANTIZED_INDEXES.items()})
+
+def load_corpus():
+    # -> (keys, starts, float32 embeddings, bytes on disk); keys are the
+    # (video_id, segment_index) rows of text_embeddings
+    keys, starts, blocks = [], [], []
+    disk_bytes = 0
+    for shard in load_shards():
+        with open(shard.transcript_path, "r") as f:
+            segments = json.load(f)
+        positions = {}
+        for seg in segments:
+            video_id = seg.get("video_id", shard.videos[0])
+            keys.append((video_id, positions.get(video_id, 0)))
+            positions[video_id] = positions.get(video_id, 0) + 1
+            starts.append(seg["start"])
+        block = np.load(shard.text_embeddings_path, mmap_mode="r")
+        disk_bytes += block.nbytes
+        blocks.append(np.asarray(block, dtype=np.float32))
+    return keys, np.array(starts), np.vstack(blocks), disk_bytes
+
+def index_bytes(index):
+    if isinstance(index, faiss.IndexBinary):
+        return len(faiss.serialize_index_binary(index))
+    return len(faiss.serialize_index(index))
+
+def npy_bytes(array):
+    # Size of the array as an embeddings.py .npy file
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getbuffer().nbytes
+
+def search(index, extra, query_vecs, embeddings, metric, top_k, rerank):
+    # Mirrors retrievers.FaissRetriever.search
+    query_vecs = np.array(query_vecs, dtype=np.float32)
+    if metric == "cosine":
+        query_vecs /= np.maximum(np.linalg.norm(query_vecs, axis=1, keepdims=True), 1e-12)
+    queries = binarize(query_vecs, np.asarray(extra["center"], dtype=np.float32)) if extra.get("binary") else query_vecs
+    _, I = index.search(queries, top_k * rerank if rerank else top_k)
+    if rerank:
+        _, I = exact_rerank(query_vecs, I, embeddings, metric, top_k)
+    return I
+
+def quality(I, truth, keys, starts, gold):
+    recall = np.mean([len({keys[i] for i in row if i >= 0} & expected) / len(expected) if expected else 1.0
+                      for row, expected in zip(I, truth)])
+    correct = [
+        bool(row[0] >= 0 and keys[row[0]][0] == DEFAULT_VIDEO_ID
+             and abs(starts[row[0]] - timestamp) <= TIMESTAMP_TOLERANCE)
+        for row, (answerable, timestamp) in zip(I, gold) if answerable
+    ]
+    return float(recall), float(np.mean(correct)) if correct else None
+
+def faiss_report(args, query_vecs, gold):
+    keys, starts, embeddings, disk_bytes = load_corpus()
+    dim = embeddings.shape[1]
+    nlist = max(1, int(np.sqrt(len(embeddings))))
+
+    exact, _ = create_faiss_index(embeddings, dim, "Flat", args.metric)
+    I = search(exact, {}, query_vecs, embeddings, args.metric, args.top_k, 0)
+    truth = [{keys[i] for i in row if i >= 0} for row in I]
+    base_bytes = index_bytes(exact)
+    base_recall, base_accuracy = quality(I, truth, keys, starts, gold)
+    rows = [{"representation": "float32, Flat (exact)", "bytes": base_bytes, "memory_saved": 0.0,
+             "recall": base_recall, "accuracy": base_accuracy}]
+    print(f"{len(embeddings)} vectors of {dim} dims, embedding files {disk_bytes / 2**20:.1f} MB "
+          f"(float16: {embeddings.size * 2 / 2**20:.1f} MB)")
+
+    for name, spec, half in FAISS_CONFIGS:
+        vectors = embeddings.astype(np.float16).astype(np.float32) if half else embeddings
+        index, extra = create_faiss_index(vectors, dim, spec.format(nlist=nlist), args.metric)
+        if "IVF" in spec:
+            faiss.extract_index_ivf(index).nprobe = args.nprobe
+        # float16 storage shrinks the file the index is built and re-ranked
+        # from, not the index itself: its row measures that file against
+        # the float32 one
+        if half:
+            size, base = npy_bytes(embeddings.astype(np.float16)), npy_bytes(embeddings)
+        else:
+            size, base = index_bytes(index), base_bytes
+        saved = 1 - size / base
+        for rerank in sorted({0, 0 if half else args.rerank}):
+            I = search(index, extra, query_vecs, vectors, args.metric, args.top_k, rerank)
+            recall, accuracy = quality(I, truth, keys, starts, gold)
+            rows.append({"representation": name + (f" + exact rerank x{rerank}" if rerank else ""),
+                         "bytes": size, "memory_saved": round(saved, 4),
+                         "recall": recall, "accuracy": accuracy})
+    return rows, truth
+
+def pgvector_report(args, query_vecs, truth):
+    from db import pooled_connection
+    retriever = rf.get_retriever("pgvector")
+    rows = []
+    for method, index_name in PGVECTOR_INDEXES.items():
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT pg_relation_size(to_regclass(%s));", (index_name,))
+            size = cursor.fetchone()[0]
+        if size is None:
+            print(f"pgvector index {index_name} does not exist; skipped")
+            continue
+        recalls = []
+        for vec, expected in zip(query_vecs, truth):
+            found = {(video_id, segment_index)
+                     for _, video_id, segment_index, *_ in retriever.search([vec], args.top_k, method=method)[0]}
+            recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+        rows.append({"representation": f"pgvector {method}", "bytes": size, "recall": float(np.mean(recalls))})
+    base = next((row["bytes"] for row in rows if row["representation"] == "pgvector hnsw"), None)
+    for row in rows:
+        row["memory_saved"] = round(1 - row["bytes"] / base, 4) if base else None
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory vs recall report for quantized embeddings.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--metric", default=FAISS_TEXT_METRIC, choices=["l2", "ip", "cosine"])
+    parser.add_argument("--rerank", type=int, default=4, help="Shortlist factor for exact re-ranking (0: off)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--pgvector", action="store_true", help="Also measure the pgvector indexes")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    gold_set = pd.read_excel(GOLD_SET_PATH)
+    query_vecs = rf.encode_queries(gold_set["Question"].astype(str).tolist())
+    gold = list(zip(gold_set["Question Type"] == "Answerable", gold_set["Timestamp (sec)"]))
+
+    faiss_rows, truth = faiss_report(args, query_vecs, gold)
+    report = {"top_k": args.top_k, "metric": args.metric, "faiss": faiss_rows}
+    if args.pgvector:
+        report["pgvector"] = pgvector_report(args, query_vecs, truth)
+
+    for section in ("faiss", "pgvector"):
+        if section in report:
+            df = pd.DataFrame(report[section])
+            df["MB"] = (df["bytes"] / 2**20).round(3)
+            print(f"\n{section}:")
+            print(df.drop(columns="bytes").to_string(index=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
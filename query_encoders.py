@@ -0,0 +1,293 @@
+# query_encoders.py
+#
+# Query-time text encoders for all-MiniLM-L6-v2, the model behind the FAISS
+# text index and the pgvector table. Every backend returns the same
+# L2-normalized, mean-pooled 384-d float32 vectors as SentenceTransformer:
+#
+#   torch       SentenceTransformer on PyTorch (the reference)
+#   onnx        the transformer exported to ONNX, run by ONNX Runtime;
+#               only onnxruntime, tokenizers and numpy are imported
+#   onnx-int8   the same graph with dynamically int8-quantized weights
+#
+# An exported model is only served once its outputs were validated against
+# SentenceTransformer (min cosine similarity over a set of texts, recorded
+# in encoder.json), so existing indexes stay compatible.
+#
+#   python query_encoders.py export --int8          # export + validate
+#   python query_encoders.py benchmark --backends torch onnx onnx-int8 --threads 1 4
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+TEXT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+QUERY_ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_MODEL_DIR = "retrieval/onnx_encoder"
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+# SentenceTransformer truncates this model's inputs at 256 tokens
+MAX_SEQ_LENGTH = 256
+# Lowest acceptable cosine similarity to the SentenceTransformer vector.
+# int8 weights move vectors slightly, which can reorder near-ties only.
+VALIDATION_MIN_COSINE = {"onnx": 0.9999, "onnx-int8": 0.98}
+VALIDATION_TEXTS = 500
+
+def cache_key(backend, model_name=TEXT_MODEL_NAME):
+    # Query-cache model key: fp32 ONNX reproduces the torch vectors, int8
+    # does not exactly, so its vectors are cached separately
+    return f"{model_name}#int8" if backend == "onnx-int8" else model_name
+
+class SentenceTransformerEncoder:
+    def __init__(self, model_name=TEXT_MODEL_NAME, threads=None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, **kwargs):
+        return self.model.encode(list(texts), **kwargs)
+
+class OnnxEncoder:
+    # Tokenizer (tokenizers' Rust implementation) -> ONNX transformer ->
+    # mean pooling over the attention mask -> L2 normalization
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, backend="onnx", threads=None, validated=True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "encoder.json"), "r") as f:
+            meta = json.load(f)
+        validation = meta.get("validation", {}).get(backend)
+        if validated and not (validation and validation["passed"]):
+            raise RuntimeError(f"{backend} encoder in {model_dir} has not passed validation; "
+                               f"run `python query_encoders.py export`")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(meta["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=meta["pad_id"], pad_token=meta["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, ONNX_FILES[backend]), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        texts = list(texts)
+        out = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+            summed = (hidden * mask[:, :, None]).sum(axis=1)
+            pooled = summed / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            out.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        if not out:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(out).astype(np.float32)
+
+def load_query_encoder(backend="torch", threads=None, model_dir=ONNX_MODEL_DIR, model_name=TEXT_MODEL_NAME):
+    if backend == "torch":
+        return SentenceTransformerEncoder(model_name, threads)
+    if backend in ONNX_FILES:
+        return OnnxEncoder(model_dir, backend, threads)
+    raise ValueError(f"Unknown query encoder backend '{backend}'. Choose from {QUERY_ENCODER_BACKENDS}.")
+
+# --- Export and validation --- #
+
+def validation_texts(limit=VALIDATION_TEXTS):
+    # Gold questions plus transcript segments: both query-like and
+    # document-like inputs, short and long
+    import pandas as pd
+    from corpus import load_shards
+    texts = []
+    if os.path.exists("gold_standard_test_set.xlsx"):
+        texts += pd.read_excel("gold_standard_test_set.xlsx")["Question"].astype(str).tolist()
+    for shard in load_shards():
+        if os.path.exists(shard.transcript_path):
+            with open(shard.transcript_path, "r") as f:
+                texts += [seg["text"] for seg in json.load(f)]
+    return texts[:limit] or ["What is retrieval-augmented generation?"]
+
+def validate(encoder, reference, texts):
+    expected = np.asarray(reference.encode(texts), dtype=np.float32)
+    actual = np.asarray(encoder.encode(texts), dtype=np.float32)
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+    }
+
+def export_onnx(output_dir=ONNX_MODEL_DIR, model_name=TEXT_MODEL_NAME, int8=False):
+    # The transformer module of the SentenceTransformer is exported as is;
+    # pooling and normalization run in numpy (OnnxEncoder.encode)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name)
+    transformer = reference[0]
+    model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["an example query"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(output_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in names), f"{model_path}.tmp",
+                          input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic, opset_version=17)
+    os.replace(f"{model_path}.tmp", model_path)
+    backends = ["onnx"]
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(output_dir, ONNX_FILES["onnx-int8"])
+        quantize_dynamic(model_path, f"{int8_path}.tmp", weight_type=QuantType.QInt8)
+        os.replace(f"{int8_path}.tmp", int8_path)
+        backends.append("onnx-int8")
+
+    meta = {
+        "model_name": model_name,
+        "dim": reference.get_sentence_embedding_dimension(),
+        "max_seq_length": min(reference.max_seq_length or MAX_SEQ_LENGTH, MAX_SEQ_LENGTH),
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "validation": {},
+    }
+    meta_path = os.path.join(output_dir, "encoder.json")
+    _write_meta(meta, meta_path)
+
+    texts = validation_texts()
+    for backend in backends:
+        result = validate(OnnxEncoder(output_dir, backend, validated=False), reference, texts)
+        result["passed"] = result["min_cosine"] >= VALIDATION_MIN_COSINE[backend]
+        meta["validation"][backend] = result
+        print(f"{backend}: min cosine {result['min_cosine']:.6f} over {result['texts']} texts "
+              f"-> {'passed' if result['passed'] else 'FAILED'}")
+
+    _write_meta(meta, meta_path)
+    return meta
+
+def _write_meta(meta, meta_path):
+    # Renamed into place, so a concurrent load never parses a partial file
+    tmp_path = f"{meta_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+# --- Benchmark --- #
+
+BENCHMARK_QUERIES = 200
+BENCHMARK_PASSES = 3
+
+def measure(backend, threads, batch_sizes, model_dir):
+    # Runs inside a fresh interpreter, so startup includes every import
+    start = time.perf_counter()
+    encoder = load_query_encoder(backend, threads, model_dir)
+    startup = time.perf_counter() - start
+
+    texts = validation_texts(BENCHMARK_QUERIES)
+    encoder.encode(texts[:8])  # first-run allocations
+    latency = {}
+    for batch_size in batch_sizes:
+        samples = []
+        for _ in range(BENCHMARK_PASSES):
+            for i in range(0, len(texts), batch_size):
+                t0 = time.perf_counter_ns()
+                encoder.encode(texts[i:i + batch_size])
+                samples.append((time.perf_counter_ns() - t0) / 1e6)
+        latency[str(batch_size)] = {
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        }
+
+    from startup_report import current_rss_mb
+    return {
+        "backend": backend,
+        "threads": threads,
+        "startup_seconds": round(startup, 3),
+        "rss_mb": round(current_rss_mb(), 1),
+        "torch_loaded": "torch" in sys.modules,
+        "latency_ms": latency,
+    }
+
+def run_child(backend, threads, batch_sizes, model_dir):
+    output = subprocess.run(
+        [sys.executable, __file__, "measure", backend, str(threads or 0), model_dir,
+         *map(str, batch_sizes)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def child_error(error):
+    # Last stderr line of a failed child; a child killed (e.g. by the OOM
+    # killer) may leave none, so fall back to how it exited
+    lines = (error.stderr or "").strip().splitlines()
+    if lines:
+        return lines[-1]
+    if error.returncode < 0:
+        return f"killed by signal {-error.returncode}"
+    return f"exit status {error.returncode}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export, validate and benchmark query encoder backends.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the model to ONNX and validate it")
+    export.add_argument("--output-dir", default=ONNX_MODEL_DIR)
+    export.add_argument("--int8", action="store_true", help="Also write a dynamically int8-quantized model")
+
+    bench = commands.add_parser("benchmark", help="Startup time, memory and latency per backend")
+    bench.add_argument("--backends", nargs="+", default=list(QUERY_ENCODER_BACKENDS), choices=QUERY_ENCODER_BACKENDS)
+    bench.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    bench.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    bench.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    bench.add_argument("--output", help="Write the report as JSON to this path")
+
+    child = commands.add_parser("measure", help=argparse.SUPPRESS)
+    child.add_argument("backend")
+    child.add_argument("threads", type=int)
+    child.add_argument("model_dir")
+    child.add_argument("batch_sizes", type=int, nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.output_dir, int8=args.int8)
+    elif args.command == "measure":
+        print(json.dumps(measure(args.backend, args.threads or None, args.batch_sizes, args.model_dir)))
+    else:
+        report = []
+        for backend in args.backends:
+            for threads in args.threads:
+                try:
+                    report.append(run_child(backend, threads, args.batch_sizes, args.model_dir))
+                except subprocess.CalledProcessError as e:
+                    print(f"{backend} ({threads} threads) failed:\n{child_error(e)}")
+
+        print(f"\n{'Backend':<11}{'Threads':>8}{'Startup (s)':>13}{'RSS (MB)':>10}  Latency p50/p95 ms by batch size")
+        for entry in report:
+            latency = ", ".join(f"b{size}: {v['p50_ms']}/{v['p95_ms']}" for size, v in entry["latency_ms"].items())
+            print(f"{entry['backend']:<11}{entry['threads']:>8}{entry['startup_seconds']:>13.3f}"
+                  f"{entry['rss_mb']:>10.1f}  {latency}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
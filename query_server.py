@@ -0,0 +1,361 @@
+# query_server.py
+#
+# Local retrieval service with dynamic micro-batching. Requests that arrive
+# within a few milliseconds of each other (and ask for the same method and
+# parameters) are answered by one call to the matching *_batch function in
+# retrieval_functions, i.e. one encoder pass and one index search, instead
+# of one call per request.
+#
+# Protocol: newline-delimited JSON over TCP, one object per line.
+#   -> {"id": 1, "method": "faiss", "question": "...", "params": {"top_k": 3}}
+#   <- {"id": 1, "results": [...]}   or   {"id": 1, "error": "..."}
+# The "stats" and "metrics" methods return the server's queue counters and
+# its telemetry snapshot (see telemetry.py).
+#
+# Backpressure: the request queue is bounded; when it is full a request is
+# refused at once with "overloaded" instead of queueing without limit, and
+# a request that waited longer than max_queue_ms is answered with "timeout"
+# rather than served late.
+#
+#   python query_server.py --port 8765 --max-batch 64 --max-delay-ms 5
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import retrieval_functions as rf
+import telemetry
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+MAX_BATCH = 64
+# How long the first request of a batch waits for company
+MAX_DELAY_MS = 5
+# Requests queued longer than this are refused (tail-latency cap)
+MAX_QUEUE_MS = 2000
+QUEUE_SIZE = 1024
+# Batches executed at the same time; the next batch fills while one runs
+BATCH_CONCURRENCY = 2
+# Ids of timed-out requests a client remembers, to discard their late answers
+ABANDONED_IDS = 1024
+
+def batch_functions():
+    # method -> fn(questions, **params) returning one result list per question
+    return {
+        "faiss": rf.query_faiss_text_batch,
+        "pgvector": rf.query_pgvector_batch,
+        "tfidf": rf.query_tfidf_batch,
+        "bm25": rf.query_bm25_batch,
+        "faiss_image": rf.query_faiss_image_batch,
+        "multimodal": rf.query_multimodal_batch,
+        "hybrid": rf.query_hybrid_batch,
+        "cascade": rf.query_cascade_batch,
+    }
+
+def query_in_process(method, question, **params):
+    # The server's answer to one request, computed in the calling process
+    # (clients fall back to it when no server is reachable)
+    return batch_functions()[method]([question], **params)[0]
+
+class QueryServer:
+    def __init__(self, max_batch=MAX_BATCH, max_delay_ms=MAX_DELAY_MS, max_queue_ms=MAX_QUEUE_MS,
+                 queue_size=QUEUE_SIZE, concurrency=BATCH_CONCURRENCY):
+        self.functions = batch_functions()
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.max_queue = max_queue_ms / 1000
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="batch")
+        self.stats = {"requests": 0, "batches": 0, "overloaded": 0, "timeouts": 0, "errors": 0}
+        self.queue = None
+
+    def batch_key(self, method, params):
+        return method, json.dumps(params, sort_keys=True)
+
+    async def submit(self, method, question, params):
+        if method not in self.functions:
+            raise ValueError(f"Unknown method '{method}'. Choose from {sorted(self.functions)}.")
+        if self.queue.full():
+            self.stats["overloaded"] += 1
+            raise RuntimeError("overloaded")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((self.batch_key(method, params), question, future, time.monotonic()))
+        self.stats["requests"] += 1
+        return await future
+
+    async def _collect(self):
+        # Blocks for the first request, then takes whatever else arrives
+        # within max_delay, up to max_batch requests. Waiting goes through a
+        # get() task that is cancelled only if it has not dequeued anything;
+        # before Python 3.12, wait_for(get()) could time out just as get()
+        # returned and lose that request.
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            getter = asyncio.ensure_future(self.queue.get())
+            try:
+                await asyncio.wait((getter,), timeout=timeout)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+            if not getter.done():
+                break
+            batch.append(getter.result())
+        return batch
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            groups = {}
+            now = time.monotonic()
+            for key, question, future, enqueued in batch:
+                if future.cancelled():
+                    continue
+                if now - enqueued > self.max_queue:
+                    self.stats["timeouts"] += 1
+                    future.set_exception(TimeoutError("timeout"))
+                    continue
+                groups.setdefault(key, []).append((question, future))
+
+            for (method, params), items in groups.items():
+                fn = self.functions[method]
+                questions = [question for question, _ in items]
+                kwargs = json.loads(params)
+                self.stats["batches"] += 1
+                try:
+                    results = await loop.run_in_executor(self.executor, lambda: fn(questions, **kwargs))
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    async def handle_connection(self, reader, writer):
+        # Requests of one connection may be pipelined; each is answered as
+        # soon as its batch completes, tagged with its id
+        write_lock = asyncio.Lock()
+
+        async def answer(request):
+            response = {"id": request.get("id")}
+            try:
+                if request.get("method") == "stats":
+                    response["stats"] = dict(self.stats, queued=self.queue.qsize())
+                elif request.get("method") == "metrics":
+                    response["metrics"] = telemetry.registry.snapshot()
+                else:
+                    response["results"] = await self.submit(
+                        request.get("method"), request.get("question", ""), request.get("params") or {}
+                    )
+            except Exception as e:
+                response["error"] = str(e) or type(e).__name__
+            async with write_lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = {"method": None}
+                task = asyncio.create_task(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        self.queue = asyncio.Queue(self.queue_size)
+        dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.concurrency)]
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Query server listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+
+# --- Client --- #
+
+class QueryClient:
+    # Blocking client with one persistent connection, safe to share across
+    # threads. Requests of concurrent threads are pipelined on the socket,
+    # so the server can put them in the same batch; a reader thread hands
+    # each response to the request with the same id. Raises OSError when
+    # the server cannot be reached.
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, timeout=30.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+        self._pending = {}  # request id -> Future of the response
+        # Ids of requests that timed out, oldest first; their answers may
+        # still arrive and are discarded
+        self._abandoned = OrderedDict()
+        self._next_id = 0
+
+    def _connect(self):
+        # Called with _lock held
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        # Reads block in the reader thread; requests time out on their future
+        sock.settimeout(None)
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        threading.Thread(target=self._read_responses, args=(sock, self._reader),
+                         name="query-client", daemon=True).start()
+
+    def _disconnect(self, error):
+        # Called with _lock held: closes the socket and its reader, and fails
+        # the requests still waiting on them
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._reader.close()
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+        self._abandoned.clear()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _read_responses(self, sock, reader):
+        error = ConnectionError("query server closed the connection")
+        try:
+            while line := reader.readline():
+                response = json.loads(line)
+                with self._lock:
+                    future = self._pending.pop(response.get("id"), None)
+                    late = future is None and self._abandoned.pop(response.get("id"), False)
+                if late:
+                    continue
+                if future is None:
+                    # Only an id this client never issued means the stream
+                    # is out of sync
+                    error = ConnectionError(f"query server answered unknown request id {response.get('id')!r}")
+                    break
+                future.set_result(response)
+        except (OSError, ValueError) as e:
+            error = e if isinstance(e, OSError) else ConnectionError(f"malformed response: {e}")
+        with self._lock:
+            if self._sock is sock:
+                self._disconnect(error)
+
+    def close(self):
+        with self._lock:
+            self._disconnect(ConnectionError("client closed"))
+
+    def _send(self, method, question, params):
+        # -> Future of the response
+        future = Future()
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = future
+            payload = json.dumps({"id": request_id, "method": method, "question": question,
+                                  "params": params}).encode() + b"\n"
+            try:
+                self._sock.sendall(payload)
+            except OSError as e:
+                self._disconnect(e)
+                raise
+        future.request_id = request_id
+        return future
+
+    def request(self, method, question="", **params):
+        for attempt in range(2):
+            try:
+                future = self._send(method, question, params)
+                try:
+                    response = future.result(self.timeout)
+                except FutureTimeoutError:
+                    with self._lock:
+                        if self._pending.pop(future.request_id, None) is not None:
+                            self._abandoned[future.request_id] = True
+                            while len(self._abandoned) > ABANDONED_IDS:
+                                self._abandoned.popitem(last=False)
+                    raise TimeoutError(f"no response from query server in {self.timeout}s")
+                break
+            except OSError as e:
+                # One reconnect, e.g. after the server restarted; a request
+                # that timed out is not sent again
+                if attempt or isinstance(e, TimeoutError):
+                    raise
+        if response.get("id") != future.request_id:
+            raise RuntimeError(f"query server: response id {response.get('id')!r} "
+                               f"does not match request {future.request_id}")
+        if "error" in response:
+            raise RuntimeError(f"query server: {response['error']}")
+        for key in ("results", "stats", "metrics"):
+            if key in response:
+                return response[key]
+        return None
+
+    def query(self, method, question, **params):
+        return self.request(method, question, **params)
+
+    def stats(self):
+        return self.request("stats")
+
+    def metrics(self):
+        return self.request("metrics")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching retrieval server.")
+    parser.add_argument("--host", default=os.environ.get("QUERY_SERVER_HOST", SERVER_HOST))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("QUERY_SERVER_PORT", SERVER_PORT)))
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-delay-ms", type=float, default=MAX_DELAY_MS,
+                        help="Longest wait for more requests before running a batch")
+    parser.add_argument("--max-queue-ms", type=float, default=MAX_QUEUE_MS,
+                        help="Requests queued longer than this fail with 'timeout'")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--warmup", nargs="*", default=["faiss", "tfidf", "bm25"],
+                        help="Backends to load before accepting requests")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics on this port (GET /metrics)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        telemetry.start_metrics_server(args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    for backend, seconds in rf.warmup(args.warmup).items():
+        print(f"  warm-up {backend}: {'failed' if seconds is None else f'{seconds:.2f}s'}")
+
+    server = QueryServer(args.max_batch, args.max_delay_ms, args.max_queue_ms, args.queue_size, args.concurrency)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
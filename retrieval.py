@@ -2,157 +2,561 @@
 
 import os
 import json
+import time
+import hashlib
+import argparse
+import struct
 import numpy as np
 import faiss
-import pickle
-import psycopg2
-from sklearn.feature_extraction.text import TfidfVectorizer
-from rank_bm25 import BM25Okapi
-
-# PostgreSQL Configuration
-PG_HOST = "localhost"
-PG_PORT = 5432
-PG_DBNAME = "rag_db"
-PG_USER = "postgres"
-PG_PASSWORD = "password"  
-
-# Paths
-TEXT_EMBEDDINGS_PATH = "embeddings/text_embeddings.npy"
-IMAGE_EMBEDDINGS_PATH = "embeddings/image_embeddings.npy"
-TRANSCRIPT_PATH = "data/transcript.json"
-
-# Output Paths
-FAISS_TEXT_INDEX = "retrieval/faiss_text.index"
-FAISS_IMAGE_INDEX = "retrieval/faiss_image.index"
-TFIDF_VECTORIZER = "retrieval/tfidf_vectorizer.pkl"
-BM25_MODEL = "retrieval/bm25_model.pkl"
+from artifacts import pack_strings, write_bundle, write_index_version
+from bm25 import build_bm25_index
+from tfidf import build_tfidf_index
+from db import EMBEDDING_DIM, pooled_connection
+from corpus import DEFAULT_VIDEO_ID, list_frames, load_shards
+from retrievers import binarize
 
-# --- PostgreSQL Functions --- #
+# --- Helper Functions --- #
 
-def connect_db():
-    return psycopg2.connect(
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        host=PG_HOST,
-        port=PG_PORT
-    )
+# Artifacts are written next to their final path and renamed into place, so
+# running query processes (see retrievers.py) never load a partial file.
+def _tmp_path(path):
+    return f"{path}.tmp.{os.getpid()}"
 
-def create_table():
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS text_embeddings (
-            id SERIAL PRIMARY KEY,
-            text TEXT NOT NULL,
-            embedding vector(384)  -- dimension must match your embedding size
-        );
-    """)
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+# --- PostgreSQL Functions --- #
 
-def insert_text_embeddings(embeddings, texts):
-    conn = connect_db()
-    cursor = conn.cursor()
+# Bumped when text_embeddings gains columns, so pipeline.py reloads the rows
+TEXT_EMBEDDINGS_SCHEMA = 2
 
-    for text, embedding in zip(texts, embeddings):
-        embedding_str = "[" + ",".join(map(str, embedding)) + "]"
+def create_table():
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS text_embeddings (
+                id SERIAL PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                segment_index INTEGER NOT NULL,  -- position among the video's segments
+                start_time DOUBLE PRECISION,  -- segment bounds in seconds
+                end_time DOUBLE PRECISION,
+                text TEXT NOT NULL,
+                embedding vector({EMBEDDING_DIM})  -- dimension must match your embedding size
+            );
+        """)
+        # Tables created before segment_index existed hold one copy of the
+        # transcript per run of this script; drop them and reload once.
+        cursor.execute("ALTER TABLE text_embeddings ADD COLUMN IF NOT EXISTS segment_index INTEGER;")
+        cursor.execute("DELETE FROM text_embeddings WHERE segment_index IS NULL;")
+        if cursor.rowcount:
+            print(f"Removed {cursor.rowcount} legacy rows without a segment key")
+        cursor.execute("ALTER TABLE text_embeddings ALTER COLUMN segment_index SET NOT NULL;")
+        # Rows from the single-video layout belong to the default video
         cursor.execute(
-            "INSERT INTO text_embeddings (text, embedding) VALUES (%s, %s);",
-            (text, embedding_str)
+            "ALTER TABLE text_embeddings ADD COLUMN IF NOT EXISTS video_id TEXT NOT NULL DEFAULT %s;",
+            (DEFAULT_VIDEO_ID,)
         )
+        cursor.execute("ALTER TABLE text_embeddings ALTER COLUMN video_id DROP DEFAULT;")
+        cursor.execute("DROP INDEX IF EXISTS text_embeddings_segment_key;")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS text_embeddings_video_segment_key
+            ON text_embeddings (video_id, segment_index);
+        """)
+        # Rows carry their own timestamps, so queries need no transcript;
+        # rows loaded before these columns existed get them on the next load
+        cursor.execute("ALTER TABLE text_embeddings ADD COLUMN IF NOT EXISTS start_time DOUBLE PRECISION;")
+        cursor.execute("ALTER TABLE text_embeddings ADD COLUMN IF NOT EXISTS end_time DOUBLE PRECISION;")
+        # Serves selective video / time range filters without the ANN index
+        # (the planner then sorts the few matching rows by exact distance)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS text_embeddings_video_time
+            ON text_embeddings (video_id, start_time);
+        """)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# Loads at least this large drop the ANN indexes first and rebuild them
+# once afterwards, instead of updating them row by row
+BULK_REBUILD_THRESHOLD = 10000
 
-def build_pgvector_indexes():
-    conn = connect_db()
-    cursor = conn.cursor()
+def drop_pgvector_indexes():
+    # Drops every ANN index of text_embeddings (IVFFLAT, HNSW, quantized and
+    # partial) before a bulk load. -> (quantized kinds, partial videos) that
+    # were dropped, for build_pgvector_indexes to recreate
+    kinds = {name: kind for kind, (name, _) in PGVECTOR_QUANTIZED_INDEXES.items()}
+    quantized, partial_videos = [], []
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname, obj_description(c.oid, 'pg_class')
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.indrelid = to_regclass('text_embeddings') AND am.amname IN ('ivfflat', 'hnsw');
+        """)
+        for name, comment in cursor.fetchall():
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}";')
+            if name in kinds:
+                quantized.append(kinds[name])
+            elif name.startswith(PARTIAL_HNSW_PREFIX) and comment:
+                partial_videos.append(comment)
+    return quantized, partial_videos
 
+def pgvector_indexes_exist():
+    # Completeness check for pipeline.py: the two main ANN indexes are there
     try:
-        # First ensure the vector extension is enabled
-        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-        
-        # Create IVFFLAT index with vector_l2_ops operator class
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_indexes WHERE indexname IN ('ivfflat_index', 'hnsw_index');"
+            )
+            return cursor.fetchone()[0] == 2
+    except Exception:
+        return False
+
+class _CopyStream:
+    # File-like reader over an iterator of byte chunks, for copy_expert
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = b""
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            rest = self._current[self._pos:]
+            self._current, self._pos = b"", 0
+            return rest + b"".join(self._chunks)
+
+        parts = []
+        while size > 0:
+            if self._pos >= len(self._current):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._current, self._pos = chunk, 0
+            part = self._current[self._pos:self._pos + size]
+            self._pos += len(part)
+            size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+def _binary_copy_rows(embeddings, texts, video_ids, segment_indexes, starts, ends, rows_per_chunk=1000):
+    # PostgreSQL binary COPY: header, then per row a field count and
+    # length-prefixed big-endian fields, then a -1 trailer. The vector field
+    # uses pgvector's wire format: int16 dim, int16 unused, float4[dim].
+    vectors = np.ascontiguousarray(embeddings, dtype=">f4")
+    dim = vectors.shape[1]
+    vector_header = struct.pack(">ihh", 4 + 4 * dim, dim, 0)
+
+    yield b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    chunk = []
+    for video_id, segment_index, start, end, text, vector in zip(video_ids, segment_indexes, starts, ends,
+                                                                 texts, vectors):
+        video_bytes = video_id.encode("utf-8")
+        text_bytes = text.encode("utf-8")
+        chunk.append(b"".join((
+            struct.pack(">hi", 6, len(video_bytes)), video_bytes,
+            struct.pack(">ii", 4, segment_index),
+            struct.pack(">id", 8, start),
+            struct.pack(">id", 8, end),
+            struct.pack(">i", len(text_bytes)), text_bytes,
+            vector_header, vector.tobytes(),
+        )))
+        if len(chunk) >= rows_per_chunk:
+            yield b"".join(chunk)
+            chunk = []
+    chunk.append(struct.pack(">h", -1))
+    yield b"".join(chunk)
+
+def insert_text_embeddings(embeddings, segments, video_ids=None):
+    # Idempotent bulk load: stream rows into a temp table with binary COPY,
+    # then upsert on (video_id, segment_index) so re-running never
+    # duplicates rows. Only the videos being loaded are touched.
+    texts = [seg["text"] for seg in segments]
+    starts = [float(seg["start"]) for seg in segments]
+    ends = [float(seg["end"]) for seg in segments]
+    # ANN indexes are maintained row by row here; callers loading at least
+    # BULK_REBUILD_THRESHOLD rows drop them first (drop_pgvector_indexes)
+    # and rebuild them once after the last shard (build_pgvector_indexes)
+    start = time.perf_counter()
+
+    if video_ids is None:
+        video_ids = [DEFAULT_VIDEO_ID] * len(texts)
+    segment_indexes = []
+    seen = {}
+    for video_id in video_ids:
+        segment_indexes.append(seen.get(video_id, 0))
+        seen[video_id] = segment_indexes[-1] + 1
+
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TEMP TABLE text_embeddings_stage (
+                video_id TEXT,
+                segment_index INTEGER,
+                start_time DOUBLE PRECISION,
+                end_time DOUBLE PRECISION,
+                text TEXT,
+                embedding vector({embeddings.shape[1]})
+            ) ON COMMIT DROP;
+        """)
+        cursor.copy_expert(
+            "COPY text_embeddings_stage (video_id, segment_index, start_time, end_time, text, embedding) "
+            "FROM STDIN WITH (FORMAT binary)",
+            _CopyStream(_binary_copy_rows(embeddings, texts, video_ids, segment_indexes, starts, ends))
+        )
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS ivfflat_index
-            ON text_embeddings USING ivfflat (embedding vector_l2_ops)
-            WITH (lists = 100);  -- Adjust lists based on your dataset size
+            INSERT INTO text_embeddings (video_id, segment_index, start_time, end_time, text, embedding)
+            SELECT video_id, segment_index, start_time, end_time, text, embedding FROM text_embeddings_stage
+            ON CONFLICT (video_id, segment_index) DO UPDATE
+            SET start_time = EXCLUDED.start_time, end_time = EXCLUDED.end_time,
+                text = EXCLUDED.text, embedding = EXCLUDED.embedding
+            WHERE (text_embeddings.start_time, text_embeddings.end_time, text_embeddings.text, text_embeddings.embedding)
+                IS DISTINCT FROM (EXCLUDED.start_time, EXCLUDED.end_time, EXCLUDED.text, EXCLUDED.embedding);
         """)
-
-        # Create HNSW index with proper parameters
+        changed = cursor.rowcount
+        # Segments of the loaded videos that no longer exist in the transcript
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS hnsw_index
-            ON text_embeddings USING hnsw (embedding vector_l2_ops)
-            WITH (m = 16, ef_construction = 64);  -- Good default values
+            DELETE FROM text_embeddings t
+            WHERE t.video_id IN (SELECT DISTINCT video_id FROM text_embeddings_stage)
+            AND NOT EXISTS (
+                SELECT 1 FROM text_embeddings_stage s
+                WHERE s.video_id = t.video_id AND s.segment_index = t.segment_index
+            );
         """)
+        removed = cursor.rowcount
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {len(texts)} segments ({changed} inserted/updated, {removed} removed) "
+          f"in {elapsed:.2f}s, {len(texts) / elapsed:.0f} rows/s")
+
+# Index build parameters (pgvector_sweep.py explores alternatives)
+IVFFLAT_LISTS = 100
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+
+def build_ivfflat_index(cursor, lists=IVFFLAT_LISTS, rebuild=False):
+    if rebuild:
+        cursor.execute("DROP INDEX IF EXISTS ivfflat_index;")
+    # L2 operator class; queries for this method order by <->
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS ivfflat_index
+        ON text_embeddings USING ivfflat (embedding vector_l2_ops)
+        WITH (lists = {int(lists)});
+    """)
+
+def build_hnsw_index(cursor, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, rebuild=False):
+    # Cosine operator class, so an HNSW query (ordered by <=>) can never be
+    # answered from the IVFFLAT index and vice versa. Older builds used
+    # vector_l2_ops here and are replaced.
+    cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'hnsw_index';")
+    row = cursor.fetchone()
+    if rebuild or (row and "vector_cosine_ops" not in row[0]):
+        cursor.execute("DROP INDEX IF EXISTS hnsw_index;")
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS hnsw_index
+        ON text_embeddings USING hnsw (embedding vector_cosine_ops)
+        WITH (m = {int(m)}, ef_construction = {int(ef_construction)});
+    """)
+
+# Quantized HNSW indexes over expressions of the full-precision column
+# (pgvector >= 0.7), so the table keeps float32 vectors for exact
+# re-ranking: "halfvec" stores 2 bytes per dimension, "binary" one bit
+# (searched by Hamming distance, then re-ranked, see retrievers.py)
+PGVECTOR_QUANTIZED_INDEXES = {
+    "halfvec": ("hnsw_halfvec_index", f"(embedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops"),
+    "binary": ("hnsw_binary_index", f"(binary_quantize(embedding)::bit({EMBEDDING_DIM})) bit_hamming_ops"),
+}
+
+def build_quantized_hnsw_index(cursor, kind, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, rebuild=False):
+    name, expression = PGVECTOR_QUANTIZED_INDEXES[kind]
+    if rebuild:
+        cursor.execute(f"DROP INDEX IF EXISTS {name};")
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS {name}
+        ON text_embeddings USING hnsw ({expression})
+        WITH (m = {int(m)}, ef_construction = {int(ef_construction)});
+    """)
+
+# Partial HNSW indexes over the rows of one video. A query filtered to that
+# video is planned against the small graph instead of post-filtering the
+# global one (retrievers.PgvectorRetriever plans filtered queries per call
+# so the planner can match the partial index predicate).
+PARTIAL_HNSW_PREFIX = "hnsw_video_"
+
+def partial_hnsw_index_name(video_id):
+    return f"{PARTIAL_HNSW_PREFIX}{hashlib.sha1(video_id.encode('utf-8')).hexdigest()[:12]}"
 
-        conn.commit()
+def build_partial_hnsw_index(cursor, video_id, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, rebuild=False):
+    name = partial_hnsw_index_name(video_id)
+    if rebuild:
+        cursor.execute(f"DROP INDEX IF EXISTS {name};")
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS {name}
+        ON text_embeddings USING hnsw (embedding vector_cosine_ops)
+        WITH (m = {int(m)}, ef_construction = {int(ef_construction)})
+        WHERE video_id = %s;
+    """, (video_id,))
+    # The video id, for drop_pgvector_indexes to know what to recreate
+    cursor.execute(f"COMMENT ON INDEX {name} IS %s;", (video_id,))
+
+def build_pgvector_indexes(lists=IVFFLAT_LISTS, m=HNSW_M,
+                           ef_construction=HNSW_EF_CONSTRUCTION, rebuild=False, quantized=(), partial_videos=()):
+    # quantized: kinds of PGVECTOR_QUANTIZED_INDEXES to build as well;
+    # partial_videos: videos that get their own partial HNSW index
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            # First ensure the vector extension is enabled
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            build_ivfflat_index(cursor, lists, rebuild)
+            build_hnsw_index(cursor, m, ef_construction, rebuild)
+            for kind in quantized:
+                build_quantized_hnsw_index(cursor, kind, m, ef_construction, rebuild)
+            for video_id in partial_videos:
+                build_partial_hnsw_index(cursor, video_id, m, ef_construction, rebuild)
         print("Successfully created PostgreSQL vector indexes")
     except Exception as e:
-        conn.rollback()
         print(f"Error creating indexes: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
 # --- FAISS Functions --- #
 
-def build_faiss_index(embeddings, dim, index_path):
-    index = faiss.IndexFlatL2(dim)
+# Index type for the text index, as a FAISS index_factory string, e.g.
+# "Flat" (exact), "IVF1024,Flat", "IVF1024,PQ32" or "HNSW32,Flat".
+# Compressed codes: "SQfp16" (2 bytes per dimension), "SQ8" (1 byte),
+# "IVF1024,SQ8", or a binary index_binary_factory spec starting with "B"
+# ("BFlat", "BHNSW32") storing one sign bit per dimension.
+FAISS_TEXT_SPEC = "Flat"
+FAISS_IMAGE_SPEC = "Flat"
+# "l2", "ip" (raw inner product) or "cosine" (inner product over
+# L2-normalized vectors; queries are normalized the same way)
+FAISS_TEXT_METRIC = "l2"
+# Query-time defaults recorded next to the index
+FAISS_NPROBE = 16
+FAISS_EF_SEARCH = 64
+# Upper bound on vectors used to train IVF/PQ indexes
+FAISS_TRAIN_SIZE = 100000
+# With a compressed index, search rerank * top_k candidates and re-score
+# them exactly against the embeddings file (0 disables)
+FAISS_RERANK = 0
+
+def faiss_meta_path(index_path):
+    return index_path + ".json"
+
+def is_binary_spec(spec):
+    return spec.startswith("B")
+
+def create_faiss_index(embeddings, dim, spec="Flat", metric="l2", train_size=FAISS_TRAIN_SIZE):
+    # -> (trained and filled index, extra metadata)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if metric == "cosine":
+        embeddings = embeddings.copy()
+        faiss.normalize_L2(embeddings)
+
+    if is_binary_spec(spec):
+        center = embeddings.mean(axis=0)
+        index = faiss.index_binary_factory(dim, spec)
+        codes = binarize(embeddings, center)
+        if not index.is_trained:
+            index.train(codes[:train_size])
+        index.add(codes)
+        return index, {"binary": True, "center": center.tolist()}
+
+    faiss_metric = faiss.METRIC_L2 if metric == "l2" else faiss.METRIC_INNER_PRODUCT
+    index = faiss.index_factory(dim, spec, faiss_metric)
+
+    if not index.is_trained:
+        # Train on a fixed random sample; IVF wants ~39 points per list
+        rng = np.random.default_rng(0)
+        n_train = min(train_size, len(embeddings))
+        sample = embeddings[np.sort(rng.choice(len(embeddings), n_train, replace=False))]
+        nlist = getattr(faiss.extract_index_ivf(index), "nlist", 0) if "IVF" in spec else 0
+        if nlist and n_train < 39 * nlist:
+            print(f"Warning: training {spec} on {n_train} vectors; {39 * nlist} recommended")
+        index.train(sample)
     index.add(embeddings)
-    faiss.write_index(index, index_path)
+    return index, {}
+
+def build_faiss_index(embeddings, dim, index_path, spec="Flat", metric="l2",
+                      train_size=FAISS_TRAIN_SIZE, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH,
+                      rerank=FAISS_RERANK, vectors_path=None):
+    # rerank needs vectors_path, the .npy file `embeddings` was loaded from
+    index, extra = create_faiss_index(embeddings, dim, spec, metric, train_size)
+
+    # Query-time parameters this index type understands, stored alongside
+    # it so retrievers.FaissRetriever can apply them on load
+    meta = dict(extra, spec=spec, metric=metric, dim=dim, ntotal=index.ntotal, params={})
+    if "IVF" in spec:
+        meta["params"]["nprobe"] = nprobe
+    if "HNSW" in spec:
+        meta["params"]["efSearch"] = ef_search
+    if rerank and vectors_path:
+        meta["rerank"] = {"factor": int(rerank), "vectors": vectors_path}
+
+    # Metadata first: a reader reloads when the index file changes, and by
+    # then the matching metadata is already in place
+    tmp_path = _tmp_path(faiss_meta_path(index_path))
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, faiss_meta_path(index_path))
+
+    tmp_path = _tmp_path(index_path)
+    if extra.get("binary"):
+        faiss.write_index_binary(index, tmp_path)
+    else:
+        faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+
+# --- Frame / Segment Alignment --- #
+
+# Spacing used by prepare_data.extract_frames; only needed for frames
+# extracted before frames.json recorded exact timestamps
+FRAME_INTERVAL_SECONDS = 5
+
+def frame_timestamps(shard, every_n_seconds=FRAME_INTERVAL_SECONDS):
+    manifest = {}
+    if os.path.exists(shard.frames_manifest):
+        with open(shard.frames_manifest, "r") as f:
+            manifest = json.load(f)
+
+    video_ids, timestamps = [], []
+    for name in list_frames(shard.frames_folder):
+        entry = manifest.get(name)
+        if entry:
+            video_ids.append(entry["video_id"])
+            timestamps.append(entry["timestamp"])
+        else:
+            # "<video_id>_frame_NNNN.jpg", or "frame_NNNN.jpg" in the legacy
+            # layout; only the separator is stripped, video ids may end in "_"
+            prefix, _, number = name[:-len(".jpg")].rpartition("frame_")
+            prefix = prefix[:-1] if prefix.endswith("_") else prefix
+            video_ids.append(prefix or shard.videos[0])
+            timestamps.append(int(number) * every_n_seconds)
+    return video_ids, np.array(timestamps, dtype=np.float64)
+
+def build_frame_alignment(shard, segments, save_path):
+    # Maps every frame to the segment playing when it was taken: a binary
+    # search of the frame time over the video's sorted segment start times.
+    video_ids, timestamps = frame_timestamps(shard)
+    frame_videos = np.array(video_ids)
+
+    segment_positions = {}
+    for position, seg in enumerate(segments):
+        segment_positions.setdefault(seg.get("video_id", shard.videos[0]), []).append(position)
+
+    aligned = np.full(len(timestamps), -1, dtype=np.int32)
+    for video_id, positions in segment_positions.items():
+        frames = np.flatnonzero(frame_videos == video_id)
+        if not len(frames):
+            continue
+        positions = np.array(positions)
+        starts = np.array([segments[p]["start"] for p in positions])
+        slot = np.searchsorted(starts, timestamps[frames], side="right") - 1
+        aligned[frames] = positions[np.clip(slot, 0, len(positions) - 1)]
+
+    video_numbers = {video_id: i for i, video_id in enumerate(dict.fromkeys(video_ids))}
+    video_index = np.array([video_numbers[v] for v in video_ids], dtype=np.int32)
+    write_bundle(save_path, {"segment": aligned, "timestamp": timestamps, "video_index": video_index},
+                 {"videos": list(video_numbers)})
+
+def build_segment_table(segments, save_path, default_video_id=DEFAULT_VIDEO_ID):
+    # Query-time copy of transcript.json as memory-mapped columns (see
+    # retrievers.SegmentTable); video i of "videos" owns the rows with
+    # video_index == i
+    videos = []
+    video_index = []
+    for seg in segments:
+        video_id = seg.get("video_id", default_video_id)
+        if not videos or videos[-1] != video_id:
+            videos.append(video_id)
+        video_index.append(len(videos) - 1)
+    text_offsets, text_blob = pack_strings([seg["text"] for seg in segments])
+    write_bundle(save_path, {
+        "start": np.array([seg["start"] for seg in segments], dtype=np.float64),
+        "end": np.array([seg["end"] for seg in segments], dtype=np.float64),
+        "text_offsets": text_offsets,
+        "text_blob": text_blob,
+        "video_index": np.array(video_index, dtype=np.int32),
+    }, {"videos": videos})
 
 # --- Lexical Retrieval Functions (TF-IDF and BM25) --- #
 
 def build_tfidf_model(texts, save_path):
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(texts)
-    with open(save_path, "wb") as f:
-        pickle.dump((vectorizer, tfidf_matrix), f)
+    # Inverted index of the fitted TF-IDF matrix, see tfidf.py
+    build_tfidf_index(texts, save_path)
 
 def build_bm25_model(texts, save_path):
-    tokenized_corpus = [text.lower().split() for text in texts]
-    bm25 = BM25Okapi(tokenized_corpus)
-    with open(save_path, "wb") as f:
-        pickle.dump(bm25, f)
+    # Inverted index of BM25Okapi weights, see bm25.py
+    build_bm25_index(texts, save_path)
 
 # --- Main Script --- #
 
 if __name__ == "__main__":
-    os.makedirs("retrieval", exist_ok=True)
+    parser = argparse.ArgumentParser(description="Build retrieval models and indexes.")
+    parser.add_argument("--faiss-spec", default=FAISS_TEXT_SPEC,
+                        help="FAISS index_factory spec for the text index, e.g. IVF256,Flat or HNSW32,Flat")
+    parser.add_argument("--faiss-metric", default=FAISS_TEXT_METRIC, choices=["l2", "ip", "cosine"])
+    parser.add_argument("--faiss-image-spec", default=FAISS_IMAGE_SPEC,
+                        help="FAISS spec for the CLIP frame index, e.g. SQ8 or BFlat")
+    parser.add_argument("--faiss-rerank", type=int, default=FAISS_RERANK,
+                        help="Re-score rerank * top_k candidates exactly from the embeddings files")
+    parser.add_argument("--pgvector-quantized", nargs="*", default=[], choices=sorted(PGVECTOR_QUANTIZED_INDEXES),
+                        help="Also build quantized pgvector HNSW indexes")
+    parser.add_argument("--pgvector-partial-videos", nargs="*", default=[],
+                        help="Videos that get their own partial pgvector HNSW index for filtered search")
+    parser.add_argument("--shard", nargs="*", help="Shard ids to build (default: all)")
+    args = parser.parse_args()
 
-    # Load Data
-    print("Loading transcript texts...")
-    with open(TRANSCRIPT_PATH, "r") as f:
-        segments = json.load(f)
-    texts = [seg['text'] for seg in segments]
+    print("Preparing PostgreSQL table...")
+    create_table()
 
-    print("Loading embeddings...")
-    text_embeddings = np.load(TEXT_EMBEDDINGS_PATH)
-    image_embeddings = np.load(IMAGE_EMBEDDINGS_PATH)
+    shards = [shard for shard in load_shards() if args.shard is None or shard.shard_id in args.shard]
+    # A large load drops the ANN indexes once up front; they are rebuilt
+    # once, over the whole table, after the last shard
+    quantized, partial_videos = list(args.pgvector_quantized), list(args.pgvector_partial_videos)
+    rows = sum(np.load(shard.text_embeddings_path, mmap_mode="r").shape[0] for shard in shards)
+    if rows >= BULK_REBUILD_THRESHOLD:
+        print(f"Dropping PostgreSQL vector indexes for a bulk load of {rows} rows...")
+        dropped_quantized, dropped_videos = drop_pgvector_indexes()
+        quantized += [kind for kind in dropped_quantized if kind not in quantized]
+        partial_videos += [video_id for video_id in dropped_videos if video_id not in partial_videos]
 
-    # --- Semantic Retrieval --- #
-    print("Building FAISS indexes...")
-    build_faiss_index(text_embeddings, text_embeddings.shape[1], FAISS_TEXT_INDEX)
-    build_faiss_index(image_embeddings, image_embeddings.shape[1], FAISS_IMAGE_INDEX)
+    for shard in shards:
+        os.makedirs(shard.path("retrieval"), exist_ok=True)
 
-    print("Storing text embeddings into PostgreSQL...")
-    create_table()
-    insert_text_embeddings(text_embeddings, texts)
+        # Load Data
+        print(f"[{shard.shard_id}] Loading transcript texts...")
+        with open(shard.transcript_path, "r") as f:
+            segments = json.load(f)
+        texts = [seg['text'] for seg in segments]
+        video_ids = [seg.get('video_id', shard.videos[0]) for seg in segments]
 
-    print("Building PostgreSQL IVFFLAT and HNSW indexes...")
-    build_pgvector_indexes()
+        print(f"[{shard.shard_id}] Loading embeddings...")
+        text_embeddings = np.load(shard.text_embeddings_path)
+        image_embeddings = np.load(shard.image_embeddings_path)
+
+        # --- Semantic Retrieval --- #
+        print(f"[{shard.shard_id}] Building FAISS indexes...")
+        build_faiss_index(text_embeddings, text_embeddings.shape[1], shard.faiss_text_index,
+                          spec=args.faiss_spec, metric=args.faiss_metric,
+                          rerank=args.faiss_rerank, vectors_path=shard.text_embeddings_path)
+        # CLIP text and image features are compared by cosine similarity
+        build_faiss_index(image_embeddings, image_embeddings.shape[1], shard.faiss_image_index,
+                          spec=args.faiss_image_spec, metric="cosine",
+                          rerank=args.faiss_rerank, vectors_path=shard.image_embeddings_path)
+
+        print(f"[{shard.shard_id}] Writing segment table...")
+        build_segment_table(segments, shard.segment_table, shard.videos[0])
+
+        print(f"[{shard.shard_id}] Aligning frames with transcript segments...")
+        build_frame_alignment(shard, segments, shard.frame_alignment)
 
-    # --- Lexical Retrieval --- #
-    print("Building TF-IDF model...")
-    build_tfidf_model(texts, TFIDF_VECTORIZER)
+        print(f"[{shard.shard_id}] Storing text embeddings into PostgreSQL...")
+        insert_text_embeddings(text_embeddings, segments, video_ids)
+
+        # --- Lexical Retrieval --- #
+        print(f"[{shard.shard_id}] Building TF-IDF model...")
+        build_tfidf_model(texts, shard.tfidf_index)
+
+        print(f"[{shard.shard_id}] Building BM25 model...")
+        build_bm25_model(texts, shard.bm25_index)
+
+    print("Building PostgreSQL IVFFLAT and HNSW indexes...")
+    build_pgvector_indexes(quantized=quantized, partial_videos=partial_videos)
 
-    print("Building BM25 model...")
-    build_bm25_model(texts, BM25_MODEL)
+    # Invalidates cached answers of the previous build (see answer_cache.py)
+    write_index_version()
 
     print("Done! Retrieval indexes and models built successfully.")
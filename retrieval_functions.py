@@ -2,120 +2,555 @@
 
 import os
 import json
-import pickle
-import numpy as np
-import faiss
-import psycopg2
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from rank_bm25 import BM25Okapi
-
-# Paths
-TRANSCRIPT_PATH = "data/transcript.json"
-FAISS_TEXT_INDEX = "retrieval/faiss_text.index"
-TFIDF_VECTORIZER = "retrieval/tfidf_vectorizer.pkl"
-BM25_MODEL = "retrieval/bm25_model.pkl"
-
-# PostgreSQL Configuration
-PG_HOST = "localhost"
-PG_PORT = 5432
-PG_DBNAME = "rag_db"  
-PG_USER = "postgres"
-PG_PASSWORD = "password"  
-
-# Model for encoding queries
-text_encoder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-# Load transcript segments
-with open(TRANSCRIPT_PATH, "r") as f:
-    segments = json.load(f)
-texts = [seg['text'] for seg in segments]
-timestamps = [seg['start'] for seg in segments]  
+import time
+import heapq
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from embedding_cache import EmbeddingCache
+from query_encoders import cache_key
+from telemetry import configure_from_env, instrument, record_stages, span
+from corpus import DEFAULT_VIDEO_ID, list_videos, load_shards, select_shards
+from retrievers import UNSHARDED, get_retriever, shard_snapshot
+
+# Backends are imported and loaded on first use (or by warmup()), so a
+# process that only runs BM25 never imports torch or opens a database pool.
+
+# Model for encoding queries, and the backend running it (see
+# query_encoders.py): "torch", or an exported "onnx" / "onnx-int8" model,
+# which keeps torch out of the process. QUERY_ENCODER_THREADS caps the
+# encoder's intra-op threads (default: the runtime's choice).
+TEXT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+QUERY_ENCODER = os.environ.get("QUERY_ENCODER", "torch")
+QUERY_ENCODER_THREADS = int(os.environ.get("QUERY_ENCODER_THREADS", 0)) or None
+_text_encoder = None
+_text_encoder_lock = threading.Lock()
+
+# CLIP model whose image tower built faiss_image.index; its text tower
+# encodes queries for frame search
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+_clip_encoder = None
+_clip_encoder_lock = threading.Lock()
+
+# Frames searched per requested result: several frames usually land on the
+# same segment, so frame search over-fetches before collapsing to segments
+FRAME_OVERFETCH = 4
+
+# Reciprocal rank fusion constant (Cormack et al.); larger values flatten
+# the advantage of the very top ranks
+RRF_K = 60
+
+# Query embeddings shared by every semantic backend, read from
+# QUERY_CACHE_PATH on first use (or by warmup()) and saved there at exit.
+# Set QUERY_CACHE_PATH to None to keep the cache in memory only.
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_PATH = "retrieval/query_embedding_cache.pkl"
+query_embedding_cache = EmbeddingCache(QUERY_CACHE_SIZE, QUERY_CACHE_PATH)
+if QUERY_CACHE_PATH:
+    atexit.register(query_embedding_cache.save)
+
+# Shards are searched concurrently by this many threads
+SHARD_WORKERS = 8
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+
+# Hybrid queries run their two backends on this pool; hybrid_stats counts
+# backends dropped by the deadline or failing, per backend name
+HYBRID_WORKERS = 8
+_hybrid_executor = None
+_hybrid_executor_lock = threading.Lock()
+hybrid_stats = {}
+
+# Cascade thresholds per backend, written by calibrate_cascade.py:
+# {"bm25": {"accept": 12.3, "reject": 4.5}, "faiss": {"accept": null, "reject": 0.31}, ...}
+# A question whose lexical top score reaches "accept" is answered lexically;
+# one below "reject" on both stages is rejected. null disables a threshold.
+CASCADE_THRESHOLDS_PATH = "retrieval/cascade_thresholds.json"
+_cascade_thresholds = (None, {})  # (mtime_ns, thresholds)
+cascade_stats = {}
+_cascade_stats_lock = threading.Lock()
+
+# Metrics endpoint/file and sampling profiler, when enabled through the
+# environment (see telemetry.py)
+configure_from_env()
+
+# Backend names accepted by warmup(), and what each one needs at query time
+BACKENDS = ("encoder", "clip_encoder", "segments", "frames", "faiss", "faiss_image", "pgvector", "tfidf", "bm25")
+BACKEND_DEPENDENCIES = {
+    "faiss": ("encoder", "segments"),
+    "faiss_image": ("clip_encoder", "segments", "frames"),
+    "pgvector": ("encoder", "segments"),
+    "tfidf": ("segments",),
+    "bm25": ("segments",),
+}
 
 # --- Helper functions --- #
 
+def get_text_encoder():
+    global _text_encoder
+    if _text_encoder is None:
+        with _text_encoder_lock:
+            if _text_encoder is None:
+                from query_encoders import load_query_encoder
+                _text_encoder = load_query_encoder(QUERY_ENCODER, QUERY_ENCODER_THREADS, model_name=TEXT_MODEL_NAME)
+    return _text_encoder
+
+def __getattr__(name):
+    # Keeps rf.text_encoder working without loading the model at import
+    if name == "text_encoder":
+        return get_text_encoder()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class _LazyTextEncoder:
+    # Handed to the embedding cache so the model is only loaded on a miss
+    def encode(self, texts, **kwargs):
+        return get_text_encoder().encode(texts, **kwargs)
+
+class ClipTextEncoder:
+    # CLIP text tower with the SentenceTransformer-style encode() the
+    # embedding cache expects
+    def __init__(self, model_name=CLIP_MODEL_NAME):
+        from transformers import CLIPModel, CLIPTokenizer
+        self.tokenizer = CLIPTokenizer.from_pretrained(model_name)
+        self.model = CLIPModel.from_pretrained(model_name).eval()
+
+    def encode(self, texts, **kwargs):
+        import torch
+        inputs = self.tokenizer(list(texts), padding=True, truncation=True, return_tensors="pt")
+        with torch.no_grad():
+            features = self.model.get_text_features(**inputs)
+        return features.numpy()
+
+def get_clip_encoder():
+    global _clip_encoder
+    if _clip_encoder is None:
+        with _clip_encoder_lock:
+            if _clip_encoder is None:
+                _clip_encoder = ClipTextEncoder()
+    return _clip_encoder
+
+class _LazyClipEncoder:
+    def encode(self, texts, **kwargs):
+        return get_clip_encoder().encode(texts, **kwargs)
+
 def connect_db():
-    return psycopg2.connect(
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        host=PG_HOST,
-        port=PG_PORT
-    )
+    from db import connect_db
+    return connect_db()
+
+def get_segments(shard=None):
+    # Transcript is held by the shard's snapshot and reloaded with the other
+    # backends when a new build is published;
+    # the table is a read-only sequence of segment dicts
+    return get_retriever("segments", shard).state()
+
+def encode_queries(questions):
+    with span("encode"):
+        return query_embedding_cache.encode(_LazyTextEncoder(), cache_key(QUERY_ENCODER, TEXT_MODEL_NAME), questions)
+
+def encode_clip_queries(questions):
+    # Shares the query cache; entries are keyed by model name
+    with span("encode"):
+        return query_embedding_cache.encode(_LazyClipEncoder(), CLIP_MODEL_NAME, questions)
+
+def warmup(backends=BACKENDS):
+    # Preload the given backends (plus what they depend on) for every shard
+    # and return the seconds each took; a backend that fails maps to None.
+    ordered = []
+    for name in backends:
+        for dependency in BACKEND_DEPENDENCIES.get(name, ()) + (name,):
+            if dependency not in ordered:
+                ordered.append(dependency)
+
+    timings = {}
+    for name in ordered:
+        start = time.perf_counter()
+        try:
+            if name == "encoder":
+                query_embedding_cache.ensure_loaded()
+                get_text_encoder().encode(["warm-up"])
+            elif name == "clip_encoder":
+                query_embedding_cache.ensure_loaded()
+                get_clip_encoder().encode(["warm-up"])
+            elif name in UNSHARDED:
+                get_retriever(name).state()
+            else:
+                for shard in load_shards():
+                    get_retriever(name, shard).state()
+            timings[name] = time.perf_counter() - start
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+            timings[name] = None
+    return timings
+
+def _segment_result(seg):
+    return {
+        "text": seg['text'],
+        "timestamp": seg['start'],
+        "video_id": seg['video_id']
+    }
+
+def _shard_map(fn, shards):
+    global _shard_executor
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    if _shard_executor is None:
+        with _shard_executor_lock:
+            if _shard_executor is None:
+                _shard_executor = ThreadPoolExecutor(SHARD_WORKERS, thread_name_prefix="shard")
+    return list(_shard_executor.map(fn, shards))
+
+def _search_shards(backend, queries, top_k, video_ids=None):
+    # Fan the batch out to every shard holding a requested video, then keep
+    # the global top-k per query. Shards that also hold other videos filter
+    # inside the search. TF-IDF/BM25 use per-shard IDF statistics, so their
+    # cross-shard ranking is approximate.
+    shards = select_shards(video_ids)
+
+    def search_shard(shard):
+        # Segments and index from the same build (see retrievers.Snapshot)
+        snapshot = shard_snapshot(shard)
+        segments = get_retriever("segments", shard).state(snapshot)
+        doc_ranges = None
+        if video_ids is not None and not set(shard.videos) <= set(video_ids):
+            doc_ranges = segments.doc_ranges(video_ids)
+        scores, ids = get_retriever(backend, shard).search(queries, top_k, doc_ranges=doc_ranges, snapshot=snapshot)
+        return segments, scores, ids
+
+    with span("search"):
+        per_shard = _shard_map(search_shard, shards)
+
+    batch_results = []
+    with span("hydrate"):
+        for q in range(len(queries)):
+            hits = []
+            for segments, scores, ids in per_shard:
+                for score, idx in zip(scores[q], ids[q]):
+                    if 0 <= idx < len(segments):
+                        hits.append((float(score), segments, int(idx)))
+            hits = heapq.nlargest(top_k, hits, key=lambda hit: hit[0])
+            batch_results.append([
+                dict(_segment_result(segments[idx]), score=score) for score, segments, idx in hits
+            ])
+    return batch_results
 
 # --- Query Functions --- #
+# Each *_batch function takes a list of questions and returns one ranked
+# result list per question; the single-question functions wrap them.
+# Every result carries a "score", higher is better: embedding similarity for
+# FAISS/pgvector/CLIP, the BM25 or TF-IDF score for lexical backends, and
+# the fused score for multimodal/hybrid queries.
+# video_ids restricts the search to those videos (None searches all).
+
+@instrument("faiss")
+def query_faiss_text_batch(questions, top_k=3, video_ids=None):
+    if not questions:
+        return []
+    query_vecs = encode_queries(questions)
+    return _search_shards("faiss", query_vecs, top_k, video_ids)
+
+def query_faiss_text(question, top_k=3, video_ids=None):
+    return query_faiss_text_batch([question], top_k, video_ids)[0]
+
+@instrument("faiss_image")
+def query_faiss_image_batch(questions, top_k=3, video_ids=None):
+    # Text-to-frame search with CLIP. Each frame hit resolves to the segment
+    # playing at that moment via the shard's frame alignment table; a
+    # segment keeps the score of its best frame.
+    if not questions:
+        return []
+    query_vecs = encode_clip_queries(questions)
+    shards = select_shards(video_ids)
+
+    def search_shard(shard):
+        snapshot = shard_snapshot(shard)
+        segments = get_retriever("segments", shard).state(snapshot)
+        frames = get_retriever("frames", shard).state(snapshot)
+        doc_ranges = None
+        if video_ids is not None and not set(shard.videos) <= set(video_ids):
+            doc_ranges = frames.doc_ranges(video_ids)
+        scores, ids = get_retriever("faiss_image", shard).search(
+            query_vecs, top_k * FRAME_OVERFETCH, doc_ranges=doc_ranges, snapshot=snapshot
+        )
+        return segments, frames, scores, ids
+
+    with span("search"):
+        per_shard = _shard_map(search_shard, shards)
+
+    batch_results = []
+    with span("hydrate"):
+        for q in range(len(questions)):
+            best = {}
+            for segments, frames, scores, ids in per_shard:
+                for score, frame in zip(scores[q], ids[q]):
+                    if not 0 <= frame < len(frames):
+                        continue
+                    position = int(frames.segment[frame])
+                    key = (id(segments), position)
+                    if position < 0 or (key in best and best[key][0] >= score):
+                        continue
+                    best[key] = (float(score), segments, position, float(frames.timestamp[frame]))
+            hits = heapq.nlargest(top_k, best.values(), key=lambda hit: hit[0])
+            batch_results.append([
+                dict(_segment_result(segments[position]), score=score, frame_timestamp=frame_timestamp)
+                for score, segments, position, frame_timestamp in hits
+            ])
+    return batch_results
+
+def query_faiss_image(question, top_k=3, video_ids=None):
+    return query_faiss_image_batch([question], top_k, video_ids)[0]
+
+def fuse_rankings(rankings, top_k=3, weights=None, k=RRF_K):
+    # Reciprocal rank fusion of result lists for one question: a result
+    # scores sum(weight / (k + rank)) over the lists it appears in, so
+    # backends with incomparable score scales can be merged. Results are
+    # identified by (video_id, timestamp); the first list's copy is kept.
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for weight, results in zip(weights, rankings):
+        for rank, result in enumerate(results, start=1):
+            key = (result["video_id"], result["timestamp"])
+            score, first = fused.get(key, (0.0, result))
+            fused[key] = (score + weight / (k + rank), first)
+    ranked = heapq.nlargest(top_k, fused.values(), key=lambda entry: entry[0])
+    return [dict(result, score=score) for score, result in ranked]
+
+def fuse_scores(rankings, top_k=3, weights=None):
+    # Weighted score fusion: each list's scores are min-max normalized to
+    # [0, 1] (a single hit counts as 1) and summed with its weight. Results
+    # without a score fall back to 1 / rank.
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for weight, results in zip(weights, rankings):
+        raw = [result.get("score", 1.0 / rank) for rank, result in enumerate(results, start=1)]
+        if not raw:
+            continue
+        low, high = min(raw), max(raw)
+        for result, value in zip(results, raw):
+            normalized = (value - low) / (high - low) if high > low else 1.0
+            key = (result["video_id"], result["timestamp"])
+            score, first = fused.get(key, (0.0, result))
+            fused[key] = (score + weight * normalized, first)
+    ranked = heapq.nlargest(top_k, fused.values(), key=lambda entry: entry[0])
+    return [dict(result, score=score) for score, result in ranked]
+
+@instrument("multimodal")
+def query_multimodal_batch(questions, top_k=3, text_method="faiss", weights=(1.0, 1.0), video_ids=None):
+    # Transcript hits (text_method: "faiss", "tfidf" or "bm25") fused with
+    # CLIP frame hits; each side contributes twice top_k candidates
+    text_queries = {
+        "faiss": query_faiss_text_batch,
+        "tfidf": query_tfidf_batch,
+        "bm25": query_bm25_batch,
+    }
+    if text_method not in text_queries:
+        raise ValueError(f"Invalid text_method. Choose from {sorted(text_queries)}.")
+    if not questions:
+        return []
+
+    text_results = text_queries[text_method](questions, top_k * 2, video_ids)
+    frame_results = query_faiss_image_batch(questions, top_k * 2, video_ids)
+    return [
+        fuse_rankings([text, frames], top_k, weights)
+        for text, frames in zip(text_results, frame_results)
+    ]
+
+def query_multimodal(question, top_k=3, text_method="faiss", weights=(1.0, 1.0), video_ids=None):
+    return query_multimodal_batch([question], top_k, text_method, weights, video_ids)[0]
+
+def _hybrid_backends():
+    return {
+        "tfidf": query_tfidf_batch,
+        "bm25": query_bm25_batch,
+        "faiss": query_faiss_text_batch,
+        "ivfflat": lambda questions, top_k, video_ids: query_pgvector_batch(
+            questions, "ivfflat", top_k, video_ids=video_ids),
+        "hnsw": lambda questions, top_k, video_ids: query_pgvector_batch(
+            questions, "hnsw", top_k, video_ids=video_ids),
+    }
+
+def _get_hybrid_executor():
+    global _hybrid_executor
+    if _hybrid_executor is None:
+        with _hybrid_executor_lock:
+            if _hybrid_executor is None:
+                _hybrid_executor = ThreadPoolExecutor(HYBRID_WORKERS, thread_name_prefix="hybrid")
+    return _hybrid_executor
+
+@instrument("hybrid")
+def query_hybrid_batch(questions, top_k=3, lexical="tfidf", semantic="faiss", fusion="rrf",
+                       weights=(1.0, 1.0), deadline=None, video_ids=None):
+    # Runs a lexical (tfidf/bm25) and a semantic (faiss/ivfflat/hnsw) backend
+    # concurrently and fuses their rankings ("rrf" or "weighted" scores).
+    # deadline (seconds) bounds the wait: a backend still running then is
+    # dropped from this call (its thread finishes in the background) and
+    # counted in hybrid_stats. Each backend contributes twice top_k candidates.
+    backends = _hybrid_backends()
+    if lexical not in ("tfidf", "bm25") or semantic not in ("faiss", "ivfflat", "hnsw"):
+        raise ValueError("Invalid hybrid backends. Choose lexical from ('tfidf', 'bm25') "
+                         "and semantic from ('faiss', 'ivfflat', 'hnsw').")
+    if fusion not in ("rrf", "weighted"):
+        raise ValueError("Invalid fusion. Choose 'rrf' or 'weighted'.")
+    if not questions:
+        return []
+
+    executor = _get_hybrid_executor()
+    futures = {
+        name: executor.submit(backends[name], questions, top_k * 2, video_ids)
+        for name in (lexical, semantic)
+    }
+    done, _ = wait(futures.values(), timeout=deadline)
+
+    rankings, used_weights = [], []
+    for (name, future), weight in zip(futures.items(), weights):
+        if future not in done:
+            _count_hybrid("dropped", name)
+            continue
+        try:
+            rankings.append(future.result())
+            used_weights.append(weight)
+        except Exception as e:
+            print(f"Hybrid backend {name} failed: {e}")
+            _count_hybrid("failed", name)
+    if not rankings:
+        return [[] for _ in questions]
+
+    fuse = fuse_rankings if fusion == "rrf" else fuse_scores
+    return [
+        fuse([ranking[q] for ranking in rankings], top_k, used_weights)
+        for q in range(len(questions))
+    ]
+
+def query_hybrid(question, top_k=3, lexical="tfidf", semantic="faiss", fusion="rrf",
+                 weights=(1.0, 1.0), deadline=None, video_ids=None):
+    return query_hybrid_batch([question], top_k, lexical, semantic, fusion, weights, deadline, video_ids)[0]
+
+def _count_hybrid(event, backend):
+    with _hybrid_executor_lock:
+        counts = hybrid_stats.setdefault(event, {})
+        counts[backend] = counts.get(backend, 0) + 1
+
+def load_cascade_thresholds():
+    # Re-read only when the calibration file changes
+    global _cascade_thresholds
+    try:
+        mtime = os.stat(CASCADE_THRESHOLDS_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if _cascade_thresholds[0] != mtime:
+        with open(CASCADE_THRESHOLDS_PATH, "r") as f:
+            _cascade_thresholds = (mtime, json.load(f))
+    return _cascade_thresholds[1]
+
+def _top_score(results):
+    return results[0]["score"] if results else float("-inf")
+
+def _passes(score, threshold):
+    return threshold is not None and score >= threshold
+
+@instrument("cascade")
+def query_cascade_batch(questions, top_k=3, lexical="bm25", semantic="faiss", thresholds=None, video_ids=None):
+    # Lexical first: questions whose top lexical score reaches the lexical
+    # "accept" threshold are answered from it. The others escalate to the
+    # semantic backend in one batch, and are rejected (empty result) when
+    # both top scores are below their "reject" thresholds. Results are
+    # tagged with the stage that produced them; uncalibrated thresholds
+    # (see calibrate_cascade.py) never accept early and never reject.
+    backends = _hybrid_backends()
+    if lexical not in ("tfidf", "bm25") or semantic not in ("faiss", "ivfflat", "hnsw"):
+        raise ValueError("Invalid cascade backends. Choose lexical from ('tfidf', 'bm25') "
+                         "and semantic from ('faiss', 'ivfflat', 'hnsw').")
+    if not questions:
+        return []
+    thresholds = load_cascade_thresholds() if thresholds is None else thresholds
+    lexical_limits = thresholds.get(lexical, {})
+    semantic_limits = thresholds.get(semantic, {})
+
+    lexical_results = backends[lexical](questions, top_k, video_ids)
+    batch_results = [None] * len(questions)
+    escalated = []
+    for q, results in enumerate(lexical_results):
+        if _passes(_top_score(results), lexical_limits.get("accept")):
+            batch_results[q] = [dict(result, stage="lexical") for result in results]
+            _count_cascade("lexical")
+        else:
+            escalated.append(q)
+
+    if escalated:
+        semantic_results = backends[semantic]([questions[q] for q in escalated], top_k, video_ids)
+        for q, results in zip(escalated, semantic_results):
+            lexical_reject = lexical_limits.get("reject")
+            semantic_reject = semantic_limits.get("reject")
+            if lexical_reject is not None and semantic_reject is not None \
+                    and _top_score(lexical_results[q]) < lexical_reject \
+                    and _top_score(results) < semantic_reject:
+                batch_results[q] = []
+                _count_cascade("rejected")
+            else:
+                batch_results[q] = [dict(result, stage="semantic") for result in results]
+                _count_cascade("semantic")
+    return batch_results
+
+def query_cascade(question, top_k=3, lexical="bm25", semantic="faiss", thresholds=None, video_ids=None):
+    return query_cascade_batch([question], top_k, lexical, semantic, thresholds, video_ids)[0]
+
+def _count_cascade(outcome):
+    with _cascade_stats_lock:
+        cascade_stats[outcome] = cascade_stats.get(outcome, 0) + 1
+
+@instrument("pgvector", variant="method")
+def query_pgvector_batch(questions, method="ivfflat", top_k=3, probes=None, ef_search=None, video_ids=None,
+                         time_range=None):
+    # probes (IVFFLAT) and ef_search (HNSW) trade recall for latency;
+    # None keeps the server default. "hnsw_halfvec" and "hnsw_binary" use
+    # the quantized indexes (retrieval.py --pgvector-quantized). time_range
+    # (start, end) in seconds keeps segments overlapping it. The rows carry
+    # their timestamps, so no transcript is loaded.
+    if method not in ("ivfflat", "hnsw", "hnsw_halfvec", "hnsw_binary"):
+        raise ValueError("Invalid method. Choose 'ivfflat', 'hnsw', 'hnsw_halfvec' or 'hnsw_binary'.")
+
+    if not questions:
+        return []
+
+    query_vecs = encode_queries(questions)
+    with span("search"):
+        batch_rows = get_retriever("pgvector").search(
+            query_vecs, top_k, method=method, probes=probes, ef_search=ef_search, video_ids=video_ids,
+            time_range=time_range
+        )
+
+    batch_results = []
+    with span("hydrate"):
+        for rows in batch_rows:
+            batch_results.append([
+                {
+                    "text": text,
+                    # NULL for rows loaded before the table had timestamps
+                    "timestamp": start_time if start_time is not None else 0,
+                    "video_id": video_id,
+                    "score": score
+                }
+                for text, video_id, _, start_time, _, score in rows
+            ])
+    return batch_results
+
+def query_pgvector(question, method="ivfflat", top_k=3, probes=None, ef_search=None, video_ids=None,
+                   time_range=None):
+    return query_pgvector_batch([question], method, top_k, probes, ef_search, video_ids, time_range)[0]
+
+@instrument("tfidf")
+def query_tfidf_batch(questions, top_k=3, video_ids=None):
+    if not questions:
+        return []
+    return _search_shards("tfidf", questions, top_k, video_ids)
+
+def query_tfidf(question, top_k=3, video_ids=None):
+    return query_tfidf_batch([question], top_k, video_ids)[0]
+
+@instrument("bm25")
+def query_bm25_batch(questions, top_k=3, video_ids=None):
+    if not questions:
+        return []
+    return _search_shards("bm25", questions, top_k, video_ids)
 
-def query_faiss_text(question, top_k=3):
-    index = faiss.read_index(FAISS_TEXT_INDEX)
-    query_vec = text_encoder.encode([question]).astype(np.float32)
-    D, I = index.search(query_vec, top_k)
-    results = []
-    for idx in I[0]:
-        if idx < len(segments):
-            results.append({
-                "text": segments[idx]['text'],
-                "timestamp": segments[idx]['start']
-            })
-    return results
-
-def query_pgvector(question, method="ivfflat", top_k=3):
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    query_vec = text_encoder.encode([question])[0]
-    embedding_str = "[" + ",".join(map(str, query_vec)) + "]"
-
-    if method == "ivfflat":
-        index_name = "ivfflat_index"
-    elif method == "hnsw":
-        index_name = "hnsw_index"
-    else:
-        raise ValueError("Invalid method. Choose 'ivfflat' or 'hnsw'.")
-
-    # Search using <-> distance operator
-    query = f"""
-        SELECT text, id FROM text_embeddings
-        ORDER BY embedding <-> '{embedding_str}'
-        LIMIT {top_k};
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-
-    results = []
-    for text, idx in rows:
-        results.append({
-            "text": text,
-            "timestamp": segments[idx-1]['start'] if idx-1 < len(segments) else 0
-        })
-    return results
-
-def query_tfidf(question, top_k=3):
-    with open(TFIDF_VECTORIZER, "rb") as f:
-        vectorizer, tfidf_matrix = pickle.load(f)
-    query_vec = vectorizer.transform([question])
-    scores = (tfidf_matrix @ query_vec.T).toarray().squeeze()
-    top_indices = np.argsort(scores)[::-1][:top_k]
-
-    results = []
-    for idx in top_indices:
-        results.append({
-            "text": segments[idx]['text'],
-            "timestamp": segments[idx]['start']
-        })
-    return results
-
-def query_bm25(question, top_k=3):
-    with open(BM25_MODEL, "rb") as f:
-        bm25 = pickle.load(f)
-    tokenized_query = question.lower().split()
-    scores = bm25.get_scores(tokenized_query)
-    top_indices = np.argsort(scores)[::-1][:top_k]
-
-    results = []
-    for idx in top_indices:
-        results.append({
-            "text": segments[idx]['text'],
-            "timestamp": segments[idx]['start']
-        })
-    return results
+def query_bm25(question, top_k=3, video_ids=None):
+    return query_bm25_batch([question], top_k, video_ids)[0]
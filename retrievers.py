@@ -0,0 +1,580 @@
+# retrievers.py
+
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+
+# Backend libraries (faiss, psycopg2 via db, and the lexical index modules)
+# are imported inside the retriever that needs them, so importing this
+# module, or using only one backend, stays cheap. Every file-backed index
+# is memory-mapped read-only (see artifacts.py).
+
+from corpus import default_shard
+from telemetry import span
+
+# The index version is re-read at most this often (seconds)
+RELOAD_CHECK_INTERVAL = 1.0
+
+def range_mask(n_docs, doc_ranges):
+    mask = np.zeros(n_docs, dtype=bool)
+    for start, end in doc_ranges:
+        mask[start:end] = True
+    return mask
+
+def binarize(vectors, center):
+    # One sign bit per dimension, after centering (sign bits of raw
+    # sentence embeddings are heavily skewed), packed 8 dimensions a byte
+    return np.packbits(np.asarray(vectors, dtype=np.float32) > center, axis=1)
+
+def exact_rerank(query_vecs, ids, vectors, metric, top_k):
+    # Re-scores each query's candidate ids (-1 = empty) against the
+    # full-precision rows and keeps the best top_k, with the similarity
+    # FaissRetriever reports for an exact index of that metric
+    scores = np.full(ids.shape, -np.inf, dtype=np.float32)
+    for q, row in enumerate(ids):
+        slots = np.flatnonzero(row >= 0)
+        # Gather rows in file order, which is kinder to a memory-mapped file
+        slots = slots[np.argsort(row[slots])]
+        candidates = np.asarray(vectors[row[slots]], dtype=np.float32)
+        if metric == "cosine":
+            candidates /= np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+        if metric == "l2":
+            scores[q, slots] = 1 - ((candidates - query_vecs[q]) ** 2).sum(axis=1) / 2
+        else:
+            scores[q, slots] = candidates @ query_vecs[q]
+
+    best = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    scores = np.take_along_axis(scores, best, axis=1)
+    ids = np.where(np.isfinite(scores), np.take_along_axis(ids, best, axis=1), -1)
+    return scores, ids
+
+# --- Snapshots --- #
+
+class Snapshot:
+    # The loaded state of the file-backed backends of one shard, all from
+    # one index build (artifacts.read_index_version). A query takes its
+    # shard's snapshot once and reads every backend from it, so segment
+    # positions always resolve against the table of the index that
+    # returned them. Backends load lazily into the snapshot they are first
+    # used from.
+
+    def __init__(self, version):
+        self.version = version
+        self.states = {}
+        self.retrievers = {}
+        self._lock = threading.Lock()
+
+    def get(self, retriever):
+        key = type(retriever)
+        state = self.states.get(key)
+        if state is None:
+            with self._lock:
+                state = self.states.get(key)
+                if state is None:
+                    # Timed as the "load" stage of the query that triggered it
+                    with span("load"):
+                        state = retriever.load()
+                    self.retrievers[key] = retriever
+                    self.states[key] = state
+        return state
+
+class ShardSnapshots:
+    # Current snapshot of one shard. Builds (retrieval.py, pipeline.py) bump
+    # the index version once every artifact is in place; the next query
+    # after that reloads every backend the old snapshot held into a new one
+    # and swaps it in as a whole. Until then, and if the reload fails,
+    # queries keep the previous build. A backend first loaded while a build
+    # is still being written may already come from it; it is replaced with
+    # the rest when that build's version appears.
+
+    def __init__(self, shard):
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    def current(self):
+        from artifacts import read_index_version
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return snapshot
+
+        version = read_index_version()
+        if snapshot is None or version != snapshot.version:
+            with self._lock:
+                if self._snapshot is None or version != self._snapshot.version:
+                    self._swap(version)
+        self._checked_at = now
+        return self._snapshot
+
+    def _swap(self, version):
+        snapshot = Snapshot(version)
+        previous = self._snapshot
+        if previous is not None:
+            try:
+                for retriever in list(previous.retrievers.values()):
+                    snapshot.get(retriever)
+            except Exception as e:
+                print(f"Reload of shard {self.shard.shard_id} failed, keeping previous build: {e}")
+                return
+        self._snapshot = snapshot
+
+    def reload(self):
+        from artifacts import read_index_version
+        with self._lock:
+            self._swap(read_index_version())
+        self._checked_at = time.monotonic()
+        return self._snapshot
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def shard_snapshot(shard=None):
+    # -> the current Snapshot of the shard's backends
+    shard = shard or default_shard()
+    key = (shard.shard_id, shard.root)
+    holder = _snapshots.get(key)
+    if holder is None:
+        with _snapshots_lock:
+            holder = _snapshots.get(key)
+            if holder is None:
+                holder = _snapshots[key] = ShardSnapshots(shard)
+    return holder.current()
+
+# --- Retriever base class --- #
+
+class Retriever(ABC):
+    # One instance per (backend, shard). Every search returns (scores, ids)
+    # of shape (n_queries, top_k) with higher scores better and -1 ids for
+    # empty slots; doc_ranges restricts the search to [start, end) segment
+    # positions of the shard (used for video filters). The loaded state
+    # lives in the shard's Snapshot; pass the query's snapshot to state()
+    # and search() to read several backends from the same build.
+
+    def __init__(self, shard=None):
+        self.shard = shard or default_shard()
+
+    @abstractmethod
+    def load(self):
+        # -> the backend's loaded state, held by the shard's Snapshot
+        ...
+
+    def state(self, snapshot=None):
+        return (snapshot or shard_snapshot(self.shard)).get(self)
+
+    def reload(self):
+        # Reloads every backend of the shard, not just this one
+        with _snapshots_lock:
+            holder = _snapshots.get((self.shard.shard_id, self.shard.root))
+        if holder is None:
+            return self.state()
+        return holder.reload().get(self)
+
+# --- Backends --- #
+
+def video_ranges(video_index, videos):
+    # Rows of a video are contiguous: video id -> [start, end) positions
+    video_index = np.asarray(video_index)
+    if not len(video_index):
+        return {}
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(video_index)) + 1])
+    ends = np.concatenate([starts[1:], [len(video_index)]])
+    return {videos[video_index[start]]: (int(start), int(end)) for start, end in zip(starts, ends)}
+
+class SegmentTable:
+    # Transcript of one shard as columns (start, end, text, video). Loaded
+    # from the memory-mapped segment table when it exists, else parsed from
+    # transcript.json. Segments of a video are contiguous, so a video maps
+    # to one [start, end) range of shard positions.
+
+    def __init__(self, start, end, text, video_index, videos):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.video_index = video_index
+        self.videos = videos
+        self.ranges = video_ranges(video_index, videos)
+
+    @classmethod
+    def from_segments(cls, segments, default_video_id):
+        videos = []
+        video_index = []
+        for seg in segments:
+            video_id = seg.get("video_id", default_video_id)
+            if not videos or videos[-1] != video_id:
+                videos.append(video_id)
+            video_index.append(len(videos) - 1)
+        return cls(
+            np.array([seg["start"] for seg in segments], dtype=np.float64),
+            np.array([seg["end"] for seg in segments], dtype=np.float64),
+            [seg["text"] for seg in segments],
+            np.array(video_index, dtype=np.int32),
+            videos,
+        )
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, position):
+        video_id = self.videos[self.video_index[position]]
+        return {
+            "text": self.text[position],
+            "start": float(self.start[position]),
+            "end": float(self.end[position]),
+            "video_id": video_id,
+            "segment_index": position - self.ranges[video_id][0],
+        }
+
+    def position(self, video_id, segment_index):
+        start, end = self.ranges[video_id]
+        return start + segment_index if start + segment_index < end else None
+
+    def doc_ranges(self, video_ids):
+        return [self.ranges[v] for v in video_ids if v in self.ranges]
+
+class SegmentStore(Retriever):
+    def load(self):
+        # Shards built before segment tables existed fall back to the JSON
+        if os.path.exists(self.shard.segment_table):
+            from artifacts import StringTable, read_bundle
+            meta, arrays = read_bundle(self.shard.segment_table)
+            return SegmentTable(arrays["start"], arrays["end"],
+                                StringTable(arrays["text_offsets"], arrays["text_blob"]),
+                                arrays["video_index"], meta["videos"])
+        with open(self.shard.transcript_path, "r") as f:
+            return SegmentTable.from_segments(json.load(f), self.shard.videos[0])
+
+class FaissRetriever(Retriever):
+    @property
+    def index_path(self):
+        return self.shard.faiss_text_index
+
+    def load(self):
+        import faiss
+        index_path = self.index_path
+
+        # Written by retrieval.build_faiss_index; indexes built before it
+        # existed are exact L2 with nothing to tune
+        meta = {"spec": "Flat", "metric": "l2", "params": {}}
+        if os.path.exists(index_path + ".json"):
+            with open(index_path + ".json", "r") as f:
+                meta = json.load(f)
+
+        if meta.get("binary"):
+            index = faiss.read_index_binary(index_path)
+            if "efSearch" in meta["params"]:
+                index.hnsw.efSearch = meta["params"]["efSearch"]
+            if "nprobe" in meta["params"]:
+                index.nprobe = meta["params"]["nprobe"]
+        else:
+            try:
+                # Map the index read-only so processes share its pages
+                # (IVF lists, and flat codes with faiss >= 1.11's IO_FLAG_MMAP_IFC);
+                # index types faiss cannot map are read into memory instead
+                flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+                index = faiss.read_index(index_path, flags)
+            except RuntimeError:
+                index = faiss.read_index(index_path)
+            parameter_space = faiss.ParameterSpace()
+            for name, value in meta["params"].items():
+                parameter_space.set_index_parameter(index, name, value)
+
+        # Full-precision rows for re-ranking a compressed index's shortlist
+        vectors = None
+        if meta.get("rerank"):
+            vectors = np.load(meta["rerank"]["vectors"], mmap_mode="r")
+            if len(vectors) != index.ntotal:
+                print(f"{meta['rerank']['vectors']} does not match {index_path}; re-ranking disabled")
+                vectors = None
+        return index, meta, vectors
+
+    def _search_params(self, meta, doc_ranges):
+        # Video filters become an ID selector evaluated inside the index
+        # scan; the index-specific parameter class must be used, and it
+        # has to carry nprobe/efSearch since it overrides the index's own.
+        import faiss
+        if len(doc_ranges) == 1:
+            selector = faiss.IDSelectorRange(*doc_ranges[0])
+        else:
+            ids = np.concatenate([np.arange(start, end) for start, end in doc_ranges] or [np.empty(0)])
+            selector = faiss.IDSelectorBatch(ids.astype(np.int64))
+        params = meta.get("params", {})
+        if "IVF" in meta["spec"]:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=params.get("nprobe", 1)), selector
+        if "HNSW" in meta["spec"]:
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=params.get("efSearch", 16)), selector
+        return faiss.SearchParameters(sel=selector), selector
+
+    def search(self, query_vecs, top_k, doc_ranges=None, snapshot=None):
+        # One index.search over the whole (n_queries, dim) matrix
+        index, meta, vectors = self.state(snapshot)
+        query_vecs = np.array(query_vecs, dtype=np.float32)
+        if meta["metric"] == "cosine":
+            query_vecs /= np.maximum(np.linalg.norm(query_vecs, axis=1, keepdims=True), 1e-12)
+
+        k = top_k * meta["rerank"]["factor"] if vectors is not None else top_k
+        if meta.get("binary"):
+            queries = binarize(query_vecs, np.asarray(meta["center"], dtype=np.float32))
+        else:
+            queries = query_vecs
+        if doc_ranges is None:
+            D, I = index.search(queries, k)
+        else:
+            params, selector = self._search_params(meta, doc_ranges)
+            D, I = index.search(queries, k, params=params)
+
+        if vectors is not None:
+            return exact_rerank(query_vecs, I, vectors, meta["metric"], top_k)
+        if meta.get("binary"):
+            # Hamming distance h over d bits -> 1 - 2h/d, the cosine
+            # similarity of the two sign vectors
+            return 1 - 2 * D.astype(np.float32) / meta["dim"], I
+        # Squared L2 distances are turned into similarities (higher is
+        # better): 1 - D / 2 is the cosine similarity for unit-length
+        # vectors such as MiniLM's, and preserves the ranking otherwise
+        return (1 - D / 2 if meta["metric"] == "l2" else D), I
+
+class FaissImageRetriever(FaissRetriever):
+    # CLIP frame embeddings; ids are frame rows, see FrameAlignmentStore
+    @property
+    def index_path(self):
+        return self.shard.faiss_image_index
+
+class FrameAlignment:
+    # Per frame (row of faiss_image.index): video, timestamp, and the shard
+    # position of the transcript segment playing at that moment (-1: none).
+    # Frames of a video are contiguous, like segments in SegmentTable.
+
+    def __init__(self, segment, timestamp, video_index, videos):
+        self.segment = segment
+        self.timestamp = timestamp
+        self.video_index = video_index
+        self.videos = videos
+        self.ranges = video_ranges(video_index, videos)
+
+    def __len__(self):
+        return len(self.segment)
+
+    def doc_ranges(self, video_ids):
+        return [self.ranges[v] for v in video_ids if v in self.ranges]
+
+class FrameAlignmentStore(Retriever):
+    def load(self):
+        from artifacts import read_bundle
+        meta, arrays = read_bundle(self.shard.frame_alignment)
+        return FrameAlignment(arrays["segment"], arrays["timestamp"], arrays["video_index"], meta["videos"])
+
+class TfidfRetriever(Retriever):
+    def load(self):
+        from tfidf import TfidfIndex
+        return TfidfIndex(self.shard.tfidf_index)
+
+    def search(self, questions, top_k, doc_ranges=None, snapshot=None):
+        index = self.state(snapshot)
+        doc_mask = None if doc_ranges is None else range_mask(index.n_docs, doc_ranges)
+        return index.search(questions, top_k, doc_mask)
+
+class Bm25Retriever(Retriever):
+    def load(self):
+        from bm25 import Bm25Index
+        return Bm25Index(self.shard.bm25_index)
+
+    def search(self, questions, top_k, doc_ranges=None, snapshot=None):
+        index = self.state(snapshot)
+        doc_mask = None if doc_ranges is None else range_mask(index.n_docs, doc_ranges)
+        return index.search(questions, top_k, doc_mask)
+
+class PgvectorRetriever(Retriever):
+    # No files to watch: the state is the process-wide connection pool from
+    # db.py, and the one text_embeddings table holds every video. Each call
+    # borrows a connection and runs one EXECUTE of a statement prepared
+    # once per connection.
+    #
+    # The planner is free to pick any index that serves the ORDER BY
+    # operator, so each method orders by an operator only its own index
+    # supports: IVFFLAT is built on vector_l2_ops (<->), HNSW on
+    # vector_cosine_ops (<=>). The MiniLM embeddings are unit-normalized,
+    # so both operators give the same ranking, and both distances convert
+    # to the cosine similarity reported as the score.
+    #
+    # The quantized methods order by the expression their HNSW index was
+    # built on (retrieval.PGVECTOR_QUANTIZED_INDEXES): halfvec cosine, or
+    # Hamming distance of the sign bits. Binary candidates are too coarse to
+    # rank directly, so RERANK_FACTOR * top_k of them are re-ranked by the
+    # exact cosine distance of the float32 column.
+    #
+    # Rows carry their video, position and start/end times, so one EXECUTE
+    # returns everything a result needs. Filters (video_ids, time_range)
+    # are planned per call (plan_cache_mode=force_custom_plan), which lets
+    # the planner see the actual values: a selective filter is served by
+    # the (video_id, start_time) index and an exact sort, a single video by
+    # its partial HNSW index (retrieval.py --pgvector-partial-videos), and
+    # anything else by the global ANN index with an iterative scan
+    # (pgvector >= 0.8) that keeps scanning until top_k rows pass the filter.
+    KNN_ORDER = {
+        "ivfflat": "embedding <-> q.embedding",
+        "hnsw": "embedding <=> q.embedding",
+        "hnsw_halfvec": "embedding::halfvec({dim}) <=> q.embedding::halfvec({dim})",
+        "hnsw_binary": "binary_quantize(embedding)::bit({dim}) <~> binary_quantize(q.embedding)",
+    }
+    RERANK_FACTOR = 4
+    KNN_SQL = """
+        SELECT q.ord, t.text, t.video_id, t.segment_index, t.start_time, t.end_time, t.distance
+        FROM unnest($1::vector[]) WITH ORDINALITY AS q(embedding, ord)
+        CROSS JOIN LATERAL (
+            SELECT text, video_id, segment_index, start_time, end_time, {order} AS distance
+            FROM text_embeddings
+            {where}
+            ORDER BY {order}
+            LIMIT $2
+        ) t
+        ORDER BY q.ord, t.distance
+    """
+    RERANK_SQL = """
+        SELECT q.ord, t.text, t.video_id, t.segment_index, t.start_time, t.end_time, t.distance
+        FROM unnest($1::vector[]) WITH ORDINALITY AS q(embedding, ord)
+        CROSS JOIN LATERAL (
+            SELECT text, video_id, segment_index, start_time, end_time, embedding <=> q.embedding AS distance
+            FROM (
+                SELECT text, video_id, segment_index, start_time, end_time, embedding
+                FROM text_embeddings
+                {where}
+                ORDER BY {order}
+                LIMIT $2 * {factor}
+            ) candidates
+            ORDER BY distance
+            LIMIT $2
+        ) t
+        ORDER BY q.ord, t.distance
+    """
+
+    # Iterative index scans, when the server's pgvector has them
+    ITERATIVE_SCAN_VERSION = (0, 8)
+    ITERATIVE_SCAN = "relaxed_order"
+
+    def load(self):
+        from db import get_pool
+        return get_pool()
+
+    def state(self, snapshot=None):
+        return self.load()
+
+    def _iterative_scan(self, conn):
+        # -> whether pgvector supports iterative scans; asked once
+        supported = getattr(self, "_iterative_scan_supported", None)
+        if supported is None:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+                row = cursor.fetchone()
+            version = tuple(int(part) for part in row[0].split(".")[:2]) if row else (0, 0)
+            supported = self._iterative_scan_supported = version >= self.ITERATIVE_SCAN_VERSION
+        return supported
+
+    def search(self, query_vecs, top_k, method="ivfflat", probes=None, ef_search=None, video_ids=None,
+               time_range=None):
+        # time_range: (start, end) seconds; keeps segments overlapping it.
+        # -> per query, a list of (text, video_id, segment_index, start_time,
+        # end_time, similarity)
+        from db import EMBEDDING_DIM, Vector, pooled_connection
+        if method not in self.KNN_ORDER:
+            raise ValueError(f"Invalid method. Choose from {sorted(self.KNN_ORDER)}.")
+        statement = f"pgvector_knn_{method}"
+        argtypes = ["vector[]", "integer"]
+        execute_args = [[Vector(vec) for vec in query_vecs], int(top_k)]
+        conditions = []
+        if video_ids is not None:
+            statement += "_videos"
+            argtypes.append("text[]")
+            execute_args.append(list(video_ids))
+            conditions.append(f"video_id = ANY(${len(execute_args)})")
+        if time_range is not None:
+            statement += "_time"
+            argtypes += ["double precision", "double precision"]
+            execute_args += [float(time_range[0]), float(time_range[1])]
+            conditions.append(f"end_time >= ${len(execute_args) - 1} AND start_time <= ${len(execute_args)}")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        placeholders = ", ".join(["%s"] * len(execute_args))
+
+        # Search knobs are SET LOCAL, so they apply to this transaction only
+        # and never leak into the next borrower of the pooled connection.
+        # enable_seqscan=off keeps small tables from skipping the index.
+        settings = ["SELECT set_config('enable_seqscan', 'off', true)"]
+        params = []
+        if probes is not None:
+            settings.append("SELECT set_config('ivfflat.probes', %s, true)")
+            params.append(str(int(probes)))
+        if ef_search is not None:
+            settings.append("SELECT set_config('hnsw.ef_search', %s, true)")
+            params.append(str(int(ef_search)))
+
+        with pooled_connection() as conn:
+            if conditions:
+                settings.append("SELECT set_config('plan_cache_mode', 'force_custom_plan', true)")
+                if self._iterative_scan(conn):
+                    # Relaxed order may return the LIMIT rows slightly out
+                    # of order; the outer ORDER BY distance restores it
+                    scan = "ivfflat" if method == "ivfflat" else "hnsw"
+                    settings.append(f"SELECT set_config('{scan}.iterative_scan', %s, true)")
+                    params.append(self.ITERATIVE_SCAN)
+            sql = self.RERANK_SQL if method == "hnsw_binary" else self.KNN_SQL
+            conn.prepare(
+                statement,
+                argtypes,
+                sql.format(order=self.KNN_ORDER[method].format(dim=EMBEDDING_DIM), where=where,
+                           factor=self.RERANK_FACTOR)
+            )
+            with conn.cursor() as cursor:
+                # Settings and query go out in a single round trip
+                cursor.execute(
+                    "; ".join(settings + [f"EXECUTE {statement} ({placeholders})"]),
+                    params + execute_args
+                )
+                rows = cursor.fetchall()
+
+        results = [[] for _ in query_vecs]
+        for ord_, text, video_id, segment_index, start_time, end_time, distance in rows:
+            # L2 distance d of unit vectors: cosine = 1 - d^2 / 2; every
+            # other method reports a cosine distance
+            similarity = 1 - distance * distance / 2 if method == "ivfflat" else 1 - distance
+            results[ord_ - 1].append((text, video_id, segment_index, start_time, end_time, similarity))
+        return results
+
+# --- Registry --- #
+
+RETRIEVER_CLASSES = {
+    "segments": SegmentStore,
+    "frames": FrameAlignmentStore,
+    "faiss": FaissRetriever,
+    "faiss_image": FaissImageRetriever,
+    "tfidf": TfidfRetriever,
+    "bm25": Bm25Retriever,
+    "pgvector": PgvectorRetriever,
+}
+
+# Backends that hold one table for the whole corpus instead of per-shard files
+UNSHARDED = {"pgvector"}
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def get_retriever(name, shard=None):
+    if name not in RETRIEVER_CLASSES:
+        raise ValueError(f"Unknown retriever '{name}'. Choose from {sorted(RETRIEVER_CLASSES)}.")
+    if name in UNSHARDED:
+        key = (name, None)
+    else:
+        shard = shard or default_shard()
+        key = (name, shard.shard_id, shard.root)
+
+    retriever = _registry.get(key)
+    if retriever is None:
+        with _registry_lock:
+            retriever = _registry.get(key)
+            if retriever is None:
+                retriever = RETRIEVER_CLASSES[name](shard)
+                _registry[key] = retriever
+    return retriever
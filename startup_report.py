@@ -0,0 +1,83 @@
+# startup_report.py
+#
+# Measures import time and memory of retrieval_functions, then the warm-up
+# cost of each backend. Every scenario runs in a fresh interpreter so one
+# backend's libraries never hide another's startup cost.
+#
+#   python startup_report.py                       # every backend, one at a time
+#   python startup_report.py --backends bm25 faiss --output startup.json
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "onnxruntime", "faiss", "psycopg2", "sklearn", "scipy")
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Not Linux: fall back to the peak RSS (KB on Linux, bytes on macOS)
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def measure(backends):
+    # Runs inside the child interpreter
+    baseline_rss = current_rss_mb()
+    start = time.perf_counter()
+    import retrieval_functions as rf
+    import_seconds = time.perf_counter() - start
+    import_rss = current_rss_mb()
+
+    warmup = rf.warmup(backends) if backends else {}
+    return {
+        "backends": backends,
+        "import_seconds": round(import_seconds, 4),
+        "warmup_seconds": {name: None if t is None else round(t, 4) for name, t in warmup.items()},
+        "rss_mb": {
+            "interpreter": round(baseline_rss, 1),
+            "after_import": round(import_rss, 1),
+            "after_warmup": round(current_rss_mb(), 1),
+        },
+        "heavy_modules_loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+    }
+
+def run_child(backends):
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", *backends],
+        capture_output=True, text=True, check=True
+    ).stdout
+    # Backends may print while loading; the report is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time and memory report for retrieval_functions.")
+    parser.add_argument("--backends", nargs="*", default=["faiss", "pgvector", "tfidf", "bm25"])
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--child", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child)))
+        sys.exit(0)
+
+    # Bare import first, then each backend in isolation
+    report = [run_child([])] + [run_child([backend]) for backend in args.backends]
+
+    print(f"{'Scenario':<12}{'Import (s)':>12}{'Warm-up (s)':>13}{'RSS (MB)':>10}  Heavy modules")
+    for entry in report:
+        warm = sum(t for t in entry["warmup_seconds"].values() if t is not None)
+        print(f"{'+'.join(entry['backends']) or 'import':<12}{entry['import_seconds']:>12.3f}"
+              f"{warm:>13.3f}{entry['rss_mb']['after_warmup']:>10.1f}  "
+              f"{', '.join(entry['heavy_modules_loaded']) or '-'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,343 @@
+# telemetry.py
+#
+# Always-on, in-process metrics for the query path. Query functions are
+# wrapped with @instrument(method), which counts calls, questions and
+# errors and records the latency histogram, labeled by method and top_k;
+# inside them span(stage) times each stage (encode, search, hydrate, and
+# load when an index is (re)loaded). Recording is a perf_counter_ns pair
+# and a few dict updates under one lock.
+#
+# Export, all optional (environment variables are read on import of
+# retrieval_functions):
+#   RETRIEVAL_METRICS_PORT=9464        GET /metrics in Prometheus text format
+#   RETRIEVAL_METRICS_PATH=metrics.prom   the same text, rewritten every
+#                                         METRICS_WRITE_INTERVAL seconds
+#   RETRIEVAL_PROFILE_INTERVAL_MS=10   sample every thread's stack; collapsed
+#   RETRIEVAL_PROFILE_PATH=profile.txt   stacks (flamegraph.pl input) at exit
+
+import os
+import sys
+import time
+import atexit
+import bisect
+import inspect
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_WRITE_INTERVAL = 15
+
+METRICS = {
+    "retrieval_queries_total": ("counter", "Query function calls (one per batch)"),
+    "retrieval_query_questions_total": ("counter", "Questions answered by query function calls"),
+    "retrieval_query_errors_total": ("counter", "Query function calls that raised"),
+    "retrieval_query_duration_seconds": ("histogram", "Query function latency"),
+    "retrieval_stage_duration_seconds": ("histogram", "Latency of one stage of a query function"),
+}
+
+# Labels of spans that run outside any instrumented query (e.g. warm-up)
+NO_QUERY = (("method", "none"), ("top_k", ""))
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket, like PromQL's
+        # histogram_quantile; the overflow bucket reports the last bound
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        # Prometheus text exposition format
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                ((key, (list(h.counts), h.count, h.sum, h.buckets)) for key, h in self.histograms.items()),
+                key=lambda item: item[0],
+            )
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in counters:
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (metric, labels), (counts, count, total, buckets) in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        # JSON-friendly summary for the app's diagnostics panel
+        with self._lock:
+            counters = self.counters
+            queries, stages = [], []
+            for (name, labels), h in sorted(self.histograms.items()):
+                row = dict(labels)
+                row.update(
+                    calls=h.count,
+                    mean_ms=round(1000 * h.sum / h.count, 3) if h.count else None,
+                    p50_ms=_ms(h.quantile(0.5)),
+                    p95_ms=_ms(h.quantile(0.95)),
+                    p99_ms=_ms(h.quantile(0.99)),
+                )
+                if name == "retrieval_query_duration_seconds":
+                    row["questions"] = counters.get(("retrieval_query_questions_total", labels), 0)
+                    row["errors"] = counters.get(("retrieval_query_errors_total", labels), 0)
+                    queries.append(row)
+                elif name == "retrieval_stage_duration_seconds":
+                    stages.append(row)
+        return {"queries": queries, "stages": stages}
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+def _ms(seconds):
+    return None if seconds is None else round(1000 * seconds, 3)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+registry = Registry()
+
+# --- Spans --- #
+
+# Per thread: the labels of the instrumented queries being run (innermost
+# last), and the timings dict of an active record_stages() block
+_context = threading.local()
+
+def _query_stack():
+    stack = getattr(_context, "stack", None)
+    if stack is None:
+        stack = _context.stack = []
+    return stack
+
+def instrument(method, variant=None):
+    # Decorator for a query function taking `questions` and `top_k`.
+    # variant names an argument whose value is appended to the method label
+    # (query_pgvector_batch's "method" gives pgvector-ivfflat/-hnsw).
+    def decorate(fn):
+        signature = inspect.signature(fn)
+        defaults = {name: p.default for name, p in signature.parameters.items()}
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            label = method if variant is None else f"{method}-{arguments.get(variant, defaults[variant])}"
+            labels = (("method", label), ("top_k", str(arguments.get("top_k", defaults.get("top_k")))))
+            stack = _query_stack()
+            stack.append(labels)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                registry.inc("retrieval_query_errors_total", labels)
+                raise
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                stack.pop()
+                registry.inc("retrieval_queries_total", labels)
+                registry.inc("retrieval_query_questions_total", labels, len(arguments.get("questions") or ()))
+                registry.observe("retrieval_query_duration_seconds", labels, elapsed / 1e9)
+        return wrapper
+    return decorate
+
+@contextmanager
+def span(stage):
+    # Time one stage, attributed to the innermost running query
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter_ns() - start
+        stack = getattr(_context, "stack", None)
+        labels = stack[-1] if stack else NO_QUERY
+        registry.observe("retrieval_stage_duration_seconds", labels + (("stage", stage),), elapsed / 1e9)
+        timings = getattr(_context, "timings", None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + elapsed
+
+@contextmanager
+def record_stages():
+    # -> {stage: nanoseconds} of the spans this thread runs inside the
+    # block (used by benchmark.py). Backends that hybrid queries run on
+    # their pool threads are not attributed.
+    previous = getattr(_context, "timings", None)
+    timings = _context.timings = {}
+    try:
+        yield timings
+    finally:
+        _context.timings = previous
+
+# --- Export --- #
+
+def write_metrics(path):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+def start_metrics_writer(path, interval=METRICS_WRITE_INTERVAL):
+    # For node_exporter's textfile collector; also written once at exit
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics(path)
+            except OSError as e:
+                print(f"Writing metrics to {path} failed: {e}")
+
+    threading.Thread(target=loop, name="metrics-writer", daemon=True).start()
+    atexit.register(write_metrics, path)
+
+def start_metrics_server(port, host="127.0.0.1"):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+# --- Sampling profiler --- #
+
+class SamplingProfiler:
+    # Samples the stack of every other thread every `interval` seconds and
+    # counts collapsed stacks ("outer;...;inner count", the input format of
+    # flamegraph.pl and speedscope). Costs nothing until started.
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._samples_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with self._samples_lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        with self._samples_lock:
+            samples = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+    def write(self, path):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(self.collapsed())
+        os.replace(tmp_path, path)
+
+    def stop_and_write(self, path):
+        # At exit: the sampler thread is a daemon still counting stacks
+        self.stop()
+        self.write(path)
+
+profiler = None
+
+def configure_from_env():
+    # Starts whatever exporters the environment asks for (see top of file)
+    global profiler
+    port = os.environ.get("RETRIEVAL_METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port))
+        except OSError as e:
+            # e.g. another worker process already serves this port
+            print(f"Metrics endpoint on port {port} not started: {e}")
+    path = os.environ.get("RETRIEVAL_METRICS_PATH")
+    if path:
+        start_metrics_writer(path)
+    interval_ms = os.environ.get("RETRIEVAL_PROFILE_INTERVAL_MS")
+    if interval_ms and profiler is None:
+        profiler = SamplingProfiler(float(interval_ms) / 1000).start()
+        profile_path = os.environ.get("RETRIEVAL_PROFILE_PATH", "profile.txt")
+        atexit.register(profiler.stop_and_write, profile_path)
@@ -0,0 +1,124 @@
+# test_answer_cache.py
+
+import os
+import pytest
+import answer_cache
+from answer_cache import AnswerCache
+from artifacts import write_index_version
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "time", clock)
+    # Re-read the index version on every call
+    monkeypatch.setattr(answer_cache, "VERSION_CHECK_INTERVAL", 0.0)
+    return clock
+
+@pytest.fixture
+def paths(tmp_path):
+    version_path = str(tmp_path / "index_version.json")
+    write_index_version(version_path)
+    return str(tmp_path / "answer_cache.sqlite"), version_path
+
+RESULTS = [{"text": "hello", "timestamp": 1.5, "video_id": "v", "score": 0.9}]
+
+def test_round_trip_and_key(clock, paths):
+    path, version_path = paths
+    cache = AnswerCache(path, version_path=version_path)
+    assert cache.get("What is X?", "bm25", {"top_k": 3}) is None
+    cache.put("What is X?", "bm25", {"top_k": 3}, RESULTS)
+    # Whitespace-normalized question hits; other method or params miss
+    assert cache.get("  What is   X? ", "bm25", {"top_k": 3}) == RESULTS
+    assert cache.get("What is X?", "tfidf", {"top_k": 3}) is None
+    assert cache.get("What is X?", "bm25", {"top_k": 5}) is None
+    assert cache.stats()["hits"] == 1
+    # Shared through the file with another instance (another process)
+    assert AnswerCache(path, version_path=version_path).get("What is X?", "bm25", {"top_k": 3}) == RESULTS
+
+def test_ttl_expiry(clock, paths):
+    path, version_path = paths
+    cache = AnswerCache(path, ttl=60, version_path=version_path)
+    cache.put("q", "bm25", {}, RESULTS)
+    clock.now += 59
+    assert cache.get("q", "bm25", {}) == RESULTS
+    clock.now += 2
+    assert cache.get("q", "bm25", {}) is None
+    # Expired entries are deleted by the next write
+    cache.put("other", "bm25", {}, RESULTS)
+    assert cache.stats()["entries"] == 1
+
+def test_lru_eviction(clock, paths):
+    path, version_path = paths
+    cache = AnswerCache(path, max_entries=3, version_path=version_path)
+    for question in ("a", "b", "c"):
+        cache.put(question, "bm25", {}, RESULTS)
+        clock.now += 1
+    # "a" becomes the most recently used, so "b" is evicted next
+    assert cache.get("a", "bm25", {}) == RESULTS
+    clock.now += 1
+    cache.put("d", "bm25", {}, RESULTS)
+    assert cache.stats()["entries"] == 3
+    assert cache.get("b", "bm25", {}) is None
+    for question in ("a", "c", "d"):
+        assert cache.get(question, "bm25", {}) == RESULTS
+
+def test_index_version_bump_invalidates(clock, paths):
+    path, version_path = paths
+    cache = AnswerCache(path, version_path=version_path)
+    cache.put("q", "bm25", {}, RESULTS)
+    old_version = cache.version()
+
+    stat = os.stat(version_path)
+    write_index_version(version_path)
+    # Make sure the change is visible on filesystems with coarse mtimes
+    os.utime(version_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.version() != old_version
+    assert cache.get("q", "bm25", {}) is None
+    # Entries of the old build are deleted by the next write
+    cache.put("other", "bm25", {}, RESULTS)
+    assert cache.stats()["entries"] == 1
+
+def test_clear(clock, paths):
+    path, version_path = paths
+    cache = AnswerCache(path, version_path=version_path)
+    cache.put("q", "bm25", {}, RESULTS)
+    cache.clear()
+    assert cache.get("q", "bm25", {}) is None
+    assert cache.stats()["entries"] == 0
+
+def test_method_file_change_invalidates_only_that_method(clock, paths, tmp_path):
+    path, version_path = paths
+    thresholds_path = tmp_path / "cascade_thresholds.json"
+    thresholds_path.write_text("{}")
+    cache = AnswerCache(path, version_path=version_path, method_files={"cascade": str(thresholds_path)})
+    cache.put("q", "cascade", {}, RESULTS)
+    cache.put("q", "bm25", {}, RESULTS)
+    version = cache.version()
+
+    stat = os.stat(thresholds_path)
+    thresholds_path.write_text('{"bm25": {"accept": 1.0}}')
+    os.utime(thresholds_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.get("q", "cascade", {}) is None
+    assert cache.get("q", "bm25", {}) == RESULTS
+    assert cache.version() == version
+
+def test_query_encoder_is_part_of_the_key(clock, paths):
+    from query_encoders import cache_key
+    path, version_path = paths
+    torch_cache = AnswerCache(path, version_path=version_path, encoder=cache_key("torch"))
+    int8_cache = AnswerCache(path, version_path=version_path, encoder=cache_key("onnx-int8"))
+    onnx_cache = AnswerCache(path, version_path=version_path, encoder=cache_key("onnx"))
+    torch_cache.put("q", "faiss", {}, RESULTS)
+    assert int8_cache.get("q", "faiss", {}) is None
+    # fp32 ONNX reproduces the torch vectors, so it shares their answers
+    assert onnx_cache.get("q", "faiss", {}) == RESULTS
+    int8_cache.put("q", "faiss", {}, [])
+    assert torch_cache.get("q", "faiss", {}) == RESULTS
+    assert int8_cache.get("q", "faiss", {}) == []
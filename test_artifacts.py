@@ -0,0 +1,46 @@
+# test_artifacts.py
+
+import json
+import numpy as np
+from artifacts import StringTable, pack_strings, read_bundle, write_bundle
+
+def npy_files(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir() if p.suffix == ".npy")
+
+def test_round_trip_read_only(tmp_path):
+    path = str(tmp_path / "index.json")
+    write_bundle(path, {"data": np.arange(5, dtype=np.float32)}, {"n_docs": 5})
+    meta, arrays = read_bundle(path)
+    assert meta["n_docs"] == 5
+    np.testing.assert_array_equal(arrays["data"], np.arange(5))
+    assert not arrays["data"].flags.writeable
+
+def test_previous_build_survives_one_rewrite(tmp_path):
+    path = str(tmp_path / "index.json")
+    write_bundle(path, {"data": np.zeros(3)})
+    with open(path) as f:
+        first = json.load(f)
+
+    write_bundle(path, {"data": np.ones(3)})
+    # A reader holding the first build's JSON can still open its arrays
+    first_files = [f"index.{first['build_id']}.data.npy"]
+    assert set(first_files) <= set(npy_files(tmp_path))
+    np.testing.assert_array_equal(np.load(tmp_path / first_files[0]), np.zeros(3))
+    np.testing.assert_array_equal(read_bundle(path)[1]["data"], np.ones(3))
+
+    with open(path) as f:
+        second = json.load(f)
+    write_bundle(path, {"data": np.full(3, 2.0)})
+    with open(path) as f:
+        third = json.load(f)
+    # Only the current and the previous build remain
+    assert npy_files(tmp_path) == sorted([f"index.{second['build_id']}.data.npy",
+                                          f"index.{third['build_id']}.data.npy"])
+    np.testing.assert_array_equal(read_bundle(path)[1]["data"], np.full(3, 2.0))
+
+def test_string_table():
+    strings = sorted(["apple", "banana", "cherry", "é"])
+    table = StringTable(*pack_strings(strings))
+    assert list(table) == strings
+    assert table.index("cherry") == 2
+    assert table.index("durian") == -1
@@ -0,0 +1,53 @@
+# test_bm25.py
+
+import numpy as np
+import pytest
+from bm25 import Bm25Index, build_bm25_index, tokenize
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+# "the" is in more than half the documents, so its IDF is negative and
+# floored at epsilon * mean IDF
+TEXTS = [
+    "the cat sat on the mat",
+    "the dog chased the cat",
+    "a bird sang in the morning",
+    "the cat and the dog slept",
+    "gradient descent minimizes the loss",
+    "stochastic gradient descent with momentum",
+]
+
+QUESTIONS = [
+    "cat",
+    "the dog",
+    "gradient gradient descent",
+    "The CAT sat",
+    "momentum loss morning",
+]
+
+@pytest.mark.parametrize("k1, b, epsilon", [(1.5, 0.75, 0.25), (1.2, 0.5, 0.1)])
+def test_scores_match_bm25okapi(tmp_path, k1, b, epsilon):
+    path = str(tmp_path / "bm25_index.json")
+    build_bm25_index(TEXTS, path, k1=k1, b=b, epsilon=epsilon)
+    index = Bm25Index(path)
+    reference = rank_bm25.BM25Okapi([tokenize(text) for text in TEXTS], k1=k1, b=b, epsilon=epsilon)
+
+    scores, ids = index.search(QUESTIONS, top_k=len(TEXTS))
+    for q, question in enumerate(QUESTIONS):
+        expected = reference.get_scores(tokenize(question))
+        found = ids[q] >= 0
+        # Exactly the documents sharing a term with the question (BM25Okapi
+        # scores the others 0), each with BM25Okapi's score, best first
+        matching = [d for d, text in enumerate(TEXTS) if set(tokenize(text)) & set(tokenize(question))]
+        assert sorted(ids[q][found]) == matching
+        assert not expected[[d for d in range(len(TEXTS)) if d not in matching]].any()
+        np.testing.assert_allclose(scores[q][found], expected[ids[q][found]], rtol=1e-5)
+        assert np.all(np.diff(scores[q][found]) <= 0)
+        assert np.all(np.isneginf(scores[q][~found]))
+
+def test_unknown_terms_match_nothing(tmp_path):
+    path = str(tmp_path / "bm25_index.json")
+    build_bm25_index(TEXTS, path)
+    scores, ids = Bm25Index(path).search(["zebra quantum"], top_k=3)
+    assert ids.tolist() == [[-1, -1, -1]]
+    assert np.all(np.isneginf(scores))
@@ -0,0 +1,40 @@
+# test_embedding_cache.py
+
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+def test_persisted_entries_load_on_first_use(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.pkl")
+    cache = EmbeddingCache(4, path)
+    cache.put("model", "hello", [1.0, 2.0])
+    cache.save()
+
+    loads = []
+    original = EmbeddingCache.load
+    monkeypatch.setattr(EmbeddingCache, "load", lambda self, path=None: (loads.append(path), original(self, path)))
+    restored = EmbeddingCache(4, path)
+    assert loads == []
+    np.testing.assert_array_equal(restored.get("model", " hello "), [1.0, 2.0])
+    restored.get("model", "other")
+    assert len(loads) == 1
+
+def test_unused_cache_does_not_overwrite_file(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = EmbeddingCache(4, path)
+    cache.put("model", "hello", [1.0])
+    cache.save()
+
+    EmbeddingCache(4, path).save()
+    assert len(EmbeddingCache(4, path)) == 1
+
+def test_clear_drops_persisted_entries(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = EmbeddingCache(4, path)
+    cache.put("model", "hello", [1.0])
+    cache.save()
+
+    cleared = EmbeddingCache(4, path)
+    cleared.clear()
+    assert cleared.get("model", "hello") is None
+    cleared.save()
+    assert len(EmbeddingCache(4, path)) == 0
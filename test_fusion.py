@@ -0,0 +1,102 @@
+# test_fusion.py
+
+import time
+import pytest
+import retrieval_functions as rf
+
+def hit(video_id, timestamp, score=None, text=""):
+    result = {"text": text, "timestamp": timestamp, "video_id": video_id}
+    if score is not None:
+        result["score"] = score
+    return result
+
+def keys(results):
+    return [(r["video_id"], r["timestamp"]) for r in results]
+
+# --- Reciprocal rank fusion --- #
+
+def test_rrf_scores_and_order():
+    lexical = [hit("v", 10), hit("v", 20), hit("v", 30)]
+    semantic = [hit("v", 20), hit("v", 40)]
+    fused = rf.fuse_rankings([lexical, semantic], top_k=4, k=60)
+    assert keys(fused) == [("v", 20), ("v", 10), ("v", 40), ("v", 30)]
+    assert fused[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused[1]["score"] == pytest.approx(1 / 61)
+    assert fused[2]["score"] == pytest.approx(1 / 62)
+    assert fused[3]["score"] == pytest.approx(1 / 63)
+
+def test_rrf_ties_keep_first_seen_order():
+    # Equal fused scores are ranked in the order the results were first met
+    first = [hit("a", 1), hit("b", 2)]
+    second = [hit("b", 2), hit("a", 1)]
+    assert keys(rf.fuse_rankings([first, second], top_k=2)) == [("a", 1), ("b", 2)]
+    assert keys(rf.fuse_rankings([second, first], top_k=2)) == [("b", 2), ("a", 1)]
+
+def test_rrf_weights_and_first_copy_kept():
+    lexical = [hit("v", 10, text="lexical"), hit("v", 20)]
+    semantic = [hit("v", 20), hit("v", 10, text="semantic")]
+    fused = rf.fuse_rankings([lexical, semantic], top_k=2, weights=[1.0, 3.0])
+    assert keys(fused) == [("v", 20), ("v", 10)]
+    assert fused[1]["text"] == "lexical"
+
+def test_rrf_same_timestamp_in_different_videos_is_not_merged():
+    fused = rf.fuse_rankings([[hit("a", 5)], [hit("b", 5)]], top_k=3)
+    assert sorted(keys(fused)) == [("a", 5), ("b", 5)]
+
+# --- Weighted score fusion --- #
+
+def test_weighted_min_max_normalization():
+    lexical = [hit("v", 10, 12.0), hit("v", 20, 8.0), hit("v", 30, 4.0)]
+    semantic = [hit("v", 30, 0.9), hit("v", 10, 0.5)]
+    fused = rf.fuse_scores([lexical, semantic], top_k=3)
+    scores = {key: r["score"] for key, r in zip(keys(fused), fused)}
+    assert scores == pytest.approx({("v", 10): 1.0, ("v", 20): 0.5, ("v", 30): 1.0})
+
+def test_weighted_equal_scores_do_not_divide_by_zero():
+    # All scores equal (or a single hit): every result normalizes to 1
+    equal = [hit("v", 10, 0.7), hit("v", 20, 0.7)]
+    single = [hit("v", 30, -3.0)]
+    fused = rf.fuse_scores([equal, single], top_k=3, weights=[1.0, 2.0])
+    assert {key: r["score"] for key, r in zip(keys(fused), fused)} == pytest.approx(
+        {("v", 10): 1.0, ("v", 20): 1.0, ("v", 30): 2.0})
+
+def test_weighted_missing_scores_fall_back_to_rank():
+    fused = rf.fuse_scores([[hit("v", 10), hit("v", 20), hit("v", 30)], []], top_k=3)
+    assert keys(fused) == [("v", 10), ("v", 20), ("v", 30)]
+    assert [r["score"] for r in fused] == pytest.approx([1.0, 0.25, 0.0])
+
+# --- Hybrid queries --- #
+
+@pytest.fixture
+def fake_backends(monkeypatch):
+    def lexical(questions, top_k, video_ids):
+        return [[hit("v", 10, 5.0), hit("v", 20, 1.0)] for _ in questions]
+
+    def slow(questions, top_k, video_ids):
+        time.sleep(0.5)
+        return [[hit("v", 30, 0.9)] for _ in questions]
+
+    def broken(questions, top_k, video_ids):
+        raise RuntimeError("backend down")
+
+    monkeypatch.setattr(rf, "_hybrid_backends", lambda: {
+        "bm25": lexical, "tfidf": lexical, "faiss": slow, "hnsw": broken, "ivfflat": lexical,
+    })
+    monkeypatch.setattr(rf, "hybrid_stats", {})
+
+def test_hybrid_drops_backend_past_deadline(fake_backends):
+    start = time.perf_counter()
+    results = rf.query_hybrid_batch(["q1", "q2"], top_k=3, lexical="bm25", semantic="faiss", deadline=0.05)
+    assert time.perf_counter() - start < 0.4
+    assert [keys(r) for r in results] == [[("v", 10), ("v", 20)]] * 2
+    assert rf.hybrid_stats == {"dropped": {"faiss": 1}}
+
+def test_hybrid_failed_backend_is_counted(fake_backends):
+    results = rf.query_hybrid_batch(["q"], top_k=3, lexical="bm25", semantic="hnsw", fusion="weighted")
+    assert keys(results[0]) == [("v", 10), ("v", 20)]
+    assert rf.hybrid_stats == {"failed": {"hnsw": 1}}
+
+def test_hybrid_fuses_both_backends_within_deadline(fake_backends):
+    results = rf.query_hybrid_batch(["q"], top_k=3, lexical="bm25", semantic="faiss", deadline=5.0)
+    assert sorted(keys(results[0])) == [("v", 10), ("v", 20), ("v", 30)]
+    assert rf.hybrid_stats == {}
@@ -0,0 +1,79 @@
+# test_postings.py
+
+import numpy as np
+import pytest
+from bm25 import Bm25Index, build_bm25_index
+from tfidf import TfidfIndex, build_tfidf_index
+
+TEXTS = [
+    "the cat sat on the mat",
+    "the dog chased the cat",
+    "a bird sang in the morning",
+    "the cat and the dog slept",
+    "gradient descent minimizes the loss",
+    "stochastic gradient descent with momentum",
+    "a cat a dog a bird",
+]
+
+QUESTIONS = [
+    "cat cat dog",             # repeated term
+    "zebra quantum",           # no known terms
+    "the the the",
+    "gradient descent momentum",
+    "",
+    "bird morning cat",
+]
+
+@pytest.fixture(params=["bm25", "tfidf"])
+def index(request, tmp_path):
+    path = str(tmp_path / f"{request.param}_index.json")
+    if request.param == "bm25":
+        build_bm25_index(TEXTS, path)
+        return Bm25Index(path)
+    build_tfidf_index(TEXTS, path)
+    return TfidfIndex(path)
+
+@pytest.mark.parametrize("top_k", [1, 3, len(TEXTS) + 2])
+def test_batch_matches_single_questions(index, top_k):
+    scores, ids = index.search(QUESTIONS, top_k)
+    assert scores.shape == ids.shape == (len(QUESTIONS), top_k)
+    for q, question in enumerate(QUESTIONS):
+        single_scores, single_ids = index.search([question], top_k)
+        np.testing.assert_array_equal(ids[q], single_ids[0])
+        np.testing.assert_array_equal(scores[q], single_scores[0])
+
+def test_question_without_known_terms(index):
+    scores, ids = index.search(["zebra quantum", "cat"], 3)
+    assert ids[0].tolist() == [-1, -1, -1]
+    assert np.all(np.isneginf(scores[0]))
+    assert ids[1][0] >= 0
+
+def test_repeated_terms_are_weighted(index):
+    # Repeating a term changes the query weights, so it must reach scoring
+    # in the batch exactly as in a single call
+    scores, ids = index.search(["cat dog", "cat cat dog"], len(TEXTS))
+    single_scores, single_ids = index.search(["cat cat dog"], len(TEXTS))
+    np.testing.assert_array_equal(ids[1], single_ids[0])
+    np.testing.assert_array_equal(scores[1], single_scores[0])
+    assert not np.array_equal(scores[0], scores[1])
+
+def test_doc_mask(index):
+    mask = np.zeros(len(TEXTS), dtype=bool)
+    mask[[1, 3, 5]] = True
+    scores, ids = index.search(QUESTIONS, len(TEXTS), doc_mask=mask)
+    full_scores, full_ids = index.search(QUESTIONS, len(TEXTS))
+    for q, question in enumerate(QUESTIONS):
+        single_scores, single_ids = index.search([question], len(TEXTS), doc_mask=mask)
+        np.testing.assert_array_equal(ids[q], single_ids[0])
+        np.testing.assert_array_equal(scores[q], single_scores[0])
+        # The unmasked ranking restricted to the allowed documents
+        kept = [(s, d) for s, d in zip(full_scores[q], full_ids[q]) if d >= 0 and mask[d]]
+        found = ids[q] >= 0
+        assert list(zip(scores[q][found], ids[q][found])) == kept
+        assert set(ids[q][found]) <= {1, 3, 5}
+
+def test_empty_batch_and_zero_top_k(index):
+    scores, ids = index.search([], 3)
+    assert scores.shape == ids.shape == (0, 3)
+    scores, ids = index.search(["cat"], 0)
+    assert scores.shape == ids.shape == (1, 0)
@@ -0,0 +1,81 @@
+# test_prepare_data.py
+
+import json
+import numpy as np
+import pytest
+
+prepare_data = pytest.importorskip("prepare_data")
+
+RATE = 1000  # samples per second, to keep the arrays small
+WINDOW = 50  # samples in the 50 ms energy window at RATE
+
+def noise(seconds, silences=(), seed=0):
+    # Loud noise with silent 50 ms windows starting at the given seconds
+    audio = np.random.default_rng(seed).uniform(-0.5, 0.5, int(seconds * RATE)).astype(np.float32)
+    for start in silences:
+        audio[int(start * RATE):int(start * RATE) + WINDOW] = 0
+    return audio
+
+def chunks(audio, chunk_seconds=10, search_seconds=3):
+    return prepare_data.silence_chunks(audio, chunk_seconds, search_seconds, sample_rate=RATE)
+
+def test_cuts_at_quietest_window_within_search_window():
+    # Targets at 10 s and (first cut + 10 s); silences at 11.5 s and 19 s
+    audio = noise(25.02, silences=[11.5, 19.0])
+    result = chunks(audio)
+    assert result == [(0, 11525), (11525, 19025), (19025, len(audio))]
+
+def test_cuts_stay_within_search_window():
+    # Silences just outside the first search window [7 s, 13 s] are never chosen
+    audio = noise(45.0, silences=[6.9, 13.05])
+    result = chunks(audio)
+    assert 7 * RATE <= result[0][1] <= 13 * RATE
+    for (start, end), (next_start, _) in zip(result, result[1:]):
+        assert end == next_start
+        assert 7 * RATE <= end - start <= 13 * RATE
+
+def test_last_chunk_shorter_than_target():
+    # The remainder after the last cut is kept whole, however short
+    audio = noise(24.5, silences=[10.0, 20.0])
+    result = chunks(audio)
+    assert result == [(0, 10025), (10025, 20025), (20025, len(audio))]
+    assert result[-1][1] - result[-1][0] < 10 * RATE
+
+def test_short_audio_is_one_chunk():
+    audio = noise(12.9)
+    assert chunks(audio) == [(0, len(audio))]
+
+def test_chunks_cover_audio_without_gaps():
+    audio = noise(123.456, seed=1)
+    result = chunks(audio)
+    assert result[0][0] == 0 and result[-1][1] == len(audio)
+    assert all(end == start for (_, end), (start, _) in zip(result, result[1:]))
+    assert all(start < end for start, end in result)
+
+def test_interrupted_transcript_write_keeps_previous_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "data" / "transcript.json")
+    prepare_data.merge_into_shard_transcript([{"start": 0.0, "end": 1.0, "text": "a"}], "v1", path)
+
+    def interrupted(data, f, **kwargs):
+        f.write('[{"start": 0.0, "end"')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(prepare_data.json, "dump", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        prepare_data.merge_into_shard_transcript([{"start": 0.0, "end": 2.0, "text": "b"}], "v2", path)
+    monkeypatch.undo()
+
+    with open(path) as f:
+        assert json.load(f) == [{"start": 0.0, "end": 1.0, "text": "a", "video_id": "v1"}]
+
+def test_frames_manifest_replaces_entries_of_the_video(tmp_path):
+    frames = {"v1_frame_0000.jpg": {"video_id": "v1", "timestamp": 0.0}}
+    prepare_data.save_frames_manifest(frames, str(tmp_path), "v1")
+    prepare_data.save_frames_manifest({"v2_frame_0000.jpg": {"video_id": "v2", "timestamp": 0.0}}, str(tmp_path), "v2")
+    prepare_data.save_frames_manifest({"v1_frame_0001.jpg": {"video_id": "v1", "timestamp": 5.0}}, str(tmp_path), "v1")
+    with open(tmp_path / "frames.json") as f:
+        assert json.load(f) == {
+            "v2_frame_0000.jpg": {"video_id": "v2", "timestamp": 0.0},
+            "v1_frame_0001.jpg": {"video_id": "v1", "timestamp": 5.0},
+        }
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["frames.json"]
@@ -0,0 +1,12 @@
+# test_query_encoders.py
+
+import subprocess
+from query_encoders import child_error
+
+def test_child_error_reports_last_stderr_line():
+    error = subprocess.CalledProcessError(1, ["python"], stderr="Traceback ...\nRuntimeError: no model\n")
+    assert child_error(error) == "RuntimeError: no model"
+
+def test_child_error_without_stderr_reports_how_it_exited():
+    assert child_error(subprocess.CalledProcessError(-9, ["python"], stderr="")) == "killed by signal 9"
+    assert child_error(subprocess.CalledProcessError(3, ["python"], stderr=None)) == "exit status 3"
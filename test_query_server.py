@@ -0,0 +1,111 @@
+# test_query_server.py
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pytest
+import query_server
+from query_server import QueryClient, QueryServer
+
+def echo_batch(questions, sleep=0, **params):
+    time.sleep(sleep)
+    return [[{"question": question, "batch": len(questions), **params}] for question in questions]
+
+def make_server(**kwargs):
+    server = QueryServer(**kwargs)
+    server.functions = {"echo": echo_batch}
+    return server
+
+def test_concurrent_submits_all_answered():
+    # Arrivals are spread around max_delay so many batch windows close
+    # while a request is arriving
+    n = 500
+
+    async def run():
+        server = make_server(max_batch=8, max_delay_ms=1, concurrency=2)
+        server.queue = asyncio.Queue(server.queue_size)
+        dispatchers = [asyncio.create_task(server._dispatch()) for _ in range(server.concurrency)]
+        rng = random.Random(0)
+
+        async def client(i):
+            await asyncio.sleep(rng.uniform(0, 0.05))
+            return await asyncio.wait_for(server.submit("echo", f"q{i}", {"top_k": 1}), 5)
+
+        try:
+            return server, await asyncio.gather(*(client(i) for i in range(n)))
+        finally:
+            for task in dispatchers:
+                task.cancel()
+
+    server, results = asyncio.run(run())
+    assert [result[0]["question"] for result in results] == [f"q{i}" for i in range(n)]
+    assert all(1 <= result[0]["batch"] <= 8 for result in results)
+    assert server.stats["requests"] == n
+    assert server.stats["batches"] < n
+
+@contextmanager
+def running_server(server):
+    # Serves on an ephemeral port from a background event loop -> port
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def serve():
+        server.queue = asyncio.Queue(server.queue_size)
+        state["stop"] = asyncio.Event()
+        dispatchers = [asyncio.create_task(server._dispatch()) for _ in range(server.concurrency)]
+        tcp = await asyncio.start_server(server.handle_connection, query_server.SERVER_HOST, 0)
+        state["port"] = tcp.sockets[0].getsockname()[1]
+        started.set()
+        async with tcp:
+            await state["stop"].wait()
+        for task in dispatchers:
+            task.cancel()
+        await asyncio.gather(*dispatchers, return_exceptions=True)
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    assert started.wait(5)
+    try:
+        yield state["port"]
+    finally:
+        loop.call_soon_threadsafe(state["stop"].set)
+        thread.join(5)
+        loop.close()
+
+def test_client_threads_over_tcp():
+    # One shared QueryClient, requests pipelined from many threads
+    n = 200
+    with running_server(make_server(max_batch=16, max_delay_ms=2)) as port:
+        client = QueryClient(query_server.SERVER_HOST, port, timeout=10)
+        try:
+            with ThreadPoolExecutor(32) as pool:
+                results = list(pool.map(lambda i: client.query("echo", f"q{i}"), range(n)))
+            assert [result[0]["question"] for result in results] == [f"q{i}" for i in range(n)]
+            assert client.stats()["requests"] == n
+        finally:
+            client.close()
+
+def test_late_answer_of_timed_out_request_is_discarded():
+    # The slow request times out at 0.5 s and its answer arrives at 1 s,
+    # while a second request is in flight on the same connection
+    with running_server(make_server(max_delay_ms=1)) as port:
+        client = QueryClient(query_server.SERVER_HOST, port, timeout=0.5)
+        try:
+            with ThreadPoolExecutor(2) as pool:
+                slow = pool.submit(client.query, "echo", "slow", sleep=1.0)
+                time.sleep(0.8)
+                fast = pool.submit(client.query, "echo", "fast", sleep=0.4)
+                with pytest.raises(TimeoutError):
+                    slow.result()
+                sock = client._sock
+                assert fast.result()[0]["question"] == "fast"
+            # Same connection: the late answer did not force a reconnect
+            assert client._sock is sock
+            assert client.query("echo", "after")[0]["question"] == "after"
+            assert client._sock is sock
+        finally:
+            client.close()
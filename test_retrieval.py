@@ -0,0 +1,39 @@
+# test_retrieval.py
+
+import json
+import pytest
+from corpus import Shard
+
+retrieval = pytest.importorskip("retrieval")
+
+def make_frames(tmp_path, names, manifest=None):
+    shard = Shard("shard", ["default_vid"], str(tmp_path))
+    frames_folder = tmp_path / "data" / "frames"
+    frames_folder.mkdir(parents=True)
+    for name in names:
+        (frames_folder / name).write_bytes(b"")
+    if manifest is not None:
+        (frames_folder / "frames.json").write_text(json.dumps(manifest))
+    return shard
+
+def test_frame_names_keep_trailing_underscores_of_video_ids(tmp_path):
+    shard = make_frames(tmp_path, ["abc_def__frame_0001.jpg", "abc_def_frame_0002.jpg", "x-y_frame_0003.jpg"])
+    video_ids, timestamps = retrieval.frame_timestamps(shard, every_n_seconds=5)
+    frames = dict(zip(retrieval.list_frames(shard.frames_folder), zip(video_ids, timestamps)))
+    assert frames == {
+        "abc_def__frame_0001.jpg": ("abc_def_", 5.0),
+        "abc_def_frame_0002.jpg": ("abc_def", 10.0),
+        "x-y_frame_0003.jpg": ("x-y", 15.0),
+    }
+
+def test_legacy_frame_names_belong_to_first_video(tmp_path):
+    shard = make_frames(tmp_path, ["frame_0004.jpg"])
+    assert retrieval.frame_timestamps(shard, every_n_seconds=5) == (["default_vid"], pytest.approx([20.0]))
+
+def test_manifest_entries_take_precedence(tmp_path):
+    shard = make_frames(tmp_path, ["abc__frame_0001.jpg"], {
+        "abc__frame_0001.jpg": {"video_id": "abc_", "timestamp": 7.25},
+    })
+    video_ids, timestamps = retrieval.frame_timestamps(shard)
+    assert video_ids == ["abc_"]
+    assert timestamps.tolist() == [7.25]
@@ -0,0 +1,30 @@
+# test_telemetry.py
+
+import threading
+import time
+from telemetry import SamplingProfiler
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+def test_profile_written_while_sampling(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,))
+    worker.start()
+    profiler = SamplingProfiler(0.0005).start()
+    try:
+        time.sleep(0.05)
+        # Writing while the sampler is still counting stacks
+        for _ in range(20):
+            profiler.write(str(tmp_path / "profile.txt"))
+        profiler.stop_and_write(str(tmp_path / "profile.txt"))
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = (tmp_path / "profile.txt").read_text().splitlines()
+    assert any("busy (test_telemetry.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["profile.txt"]
+    assert profiler._thread is None
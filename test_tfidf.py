@@ -0,0 +1,47 @@
+# test_tfidf.py
+
+import numpy as np
+import pytest
+from tfidf import TfidfIndex, build_tfidf_index
+
+TEXTS = [
+    "The cat sat on the mat.",
+    "The dog chased the cat!",
+    "A bird sang in the morning",
+    "the cat and the dog slept, the cat snored",
+    "Gradient descent minimizes the loss",
+    "Stochastic gradient-descent with momentum",
+]
+
+QUESTIONS = [
+    "cat",
+    "the dog",
+    "Gradient gradient descent?",
+    "a b cat-sat",
+    "momentum, loss and morning",
+]
+
+def test_scores_match_tfidfvectorizer(tmp_path):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    path = str(tmp_path / "tfidf_index.json")
+    build_tfidf_index(TEXTS, path)
+    index = TfidfIndex(path)
+
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform(TEXTS)
+    expected_scores = (vectorizer.transform(QUESTIONS) @ matrix.T).toarray()
+
+    scores, ids = index.search(QUESTIONS, top_k=len(TEXTS))
+    for q, expected in enumerate(expected_scores):
+        found = ids[q] >= 0
+        assert sorted(ids[q][found]) == sorted(np.flatnonzero(expected))
+        np.testing.assert_allclose(scores[q][found], expected[ids[q][found]], rtol=1e-5)
+        assert np.all(np.diff(scores[q][found]) <= 0)
+
+def test_question_without_known_terms(tmp_path):
+    path = str(tmp_path / "tfidf_index.json")
+    build_tfidf_index(TEXTS, path)
+    # Single-character tokens are dropped by the token pattern
+    scores, ids = TfidfIndex(path).search(["a b c", "zebra"], top_k=2)
+    assert ids.tolist() == [[-1, -1], [-1, -1]]
+    assert np.all(np.isneginf(scores))
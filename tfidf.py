@@ -0,0 +1,41 @@
+# tfidf.py
+#
+# TF-IDF as an inverted index (see postings.py). The model is still fitted
+# with scikit-learn's TfidfVectorizer; its vocabulary, IDF vector and
+# l2-normalized document matrix are exported so that queries are scored
+# without sklearn or unpickling. Query vectors are computed exactly like
+# TfidfVectorizer.transform with the default settings used here.
+
+import re
+import numpy as np
+from postings import PostingsIndex, write_postings
+
+# TfidfVectorizer's default token_pattern (applied after lowercasing)
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+def build_tfidf_index(texts, index_path):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(tokenizer=tokenize, token_pattern=None, lowercase=False)
+    matrix = vectorizer.fit_transform(texts).tocoo()
+
+    # get_feature_names_out() is sorted, so feature ids are sorted term ids
+    terms = vectorizer.get_feature_names_out().tolist()
+    write_postings(index_path, matrix.row, matrix.col, matrix.data, terms, len(texts), {
+        "idf": vectorizer.idf_.tolist(),
+    })
+
+class TfidfIndex(PostingsIndex):
+    def __init__(self, path):
+        super().__init__(path)
+        self.idf = np.asarray(self.meta["idf"])
+
+    def query_weights(self, question):
+        counts = self.term_ids(tokenize(question))
+        if not counts:
+            return {}
+        weights = {term_id: count * self.idf[term_id] for term_id, count in counts.items()}
+        norm = np.sqrt(sum(w * w for w in weights.values()))
+        return {term_id: w / norm for term_id, w in weights.items()}